@@ -0,0 +1,88 @@
+'''
+Control socket throughput, against an app started with `python main.py --control /tmp/fp.sock`:
+round trips per second for single commands, commands per second when batched, and dabs per second for
+strokes submitted one per request and several per request. Clears the active layer when done.
+
+    python benchmarks/control.py [socket path] [seconds per test]
+'''
+
+import sys
+from math import cos, sin, pi
+from os.path import abspath, dirname
+from random import Random
+from time import perf_counter
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from modules.controlclient import Batch, ControlClient
+
+STROKE_POINTS = 200
+STROKES_PER_BATCH = 10
+COMMANDS_PER_BATCH = 100
+
+def random_stroke(rng, size):
+    cx = rng.uniform(size * 0.25, size * 0.75)
+    cy = rng.uniform(size * 0.25, size * 0.75)
+    r = rng.uniform(size * 0.05, size * 0.2)
+    turn = rng.uniform(0.5, 1.5)
+    points = []
+    pressures = []
+    for i in range(STROKE_POINTS):
+        a = 2.0 * pi * turn * i / STROKE_POINTS
+        points.append((cx + r * cos(a), cy + r * sin(a)))
+        pressures.append(0.5 + 0.5 * sin(a * 3.0))
+    return points, pressures
+
+def timed(seconds, step):
+    """ Runs step until seconds have passed; returns (calls, units counted by step, elapsed). """
+    calls = 0
+    units = 0
+    start = perf_counter()
+    while perf_counter() - start < seconds:
+        units += step()
+        calls += 1
+    return calls, units, perf_counter() - start
+
+def main(argv):
+    path = argv[1] if len(argv) > 1 else "/tmp/fp.sock"
+    seconds = float(argv[2]) if len(argv) > 2 else 3.0
+    rng = Random(1)
+
+    with ControlClient(path) as fp:
+        state = fp.state()
+        size = state["canvas"][0]
+        print(f"Canvas {state['canvas'][0]}x{state['canvas'][1]}, brush {state['brush']['current_prog']} size {state['brush']['size']}")
+        fp.brush(size=12.0, opacity=0.5)
+
+        calls, _, elapsed = timed(seconds, lambda: (fp.state(), 1)[1])
+        print(f"single commands:      {calls / elapsed:8.1f} round trips/s ({elapsed / calls * 1000.0:.2f} ms each)")
+
+        batch = Batch()
+        for _ in range(COMMANDS_PER_BATCH):
+            batch.brush(softness=1.0)
+        calls, commands, elapsed = timed(seconds, lambda: len(fp.run(batch)))
+        print(f"batched commands:     {commands / elapsed:8.1f} commands/s ({COMMANDS_PER_BATCH} per request)")
+
+        strokes = [random_stroke(rng, size) for _ in range(50)]
+        index = [0]
+        def one_stroke():
+            points, pressures = strokes[index[0] % len(strokes)]
+            index[0] += 1
+            return fp.stroke(points, pressures)
+        calls, dabs, elapsed = timed(seconds, one_stroke)
+        print(f"strokes, 1/request:   {calls / elapsed:8.1f} strokes/s, {dabs / elapsed:10.1f} dabs/s")
+
+        def stroke_batch():
+            batch = Batch()
+            for _ in range(STROKES_PER_BATCH):
+                points, pressures = strokes[index[0] % len(strokes)]
+                index[0] += 1
+                batch.stroke(points, pressures)
+            return sum(result["dabs"] for result in fp.run(batch))
+        calls, dabs, elapsed = timed(seconds, stroke_batch)
+        print(f"strokes, {STROKES_PER_BATCH}/request:  {calls * STROKES_PER_BATCH / elapsed:8.1f} strokes/s, {dabs / elapsed:10.1f} dabs/s")
+
+        fp.operator("canvas_clear")
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
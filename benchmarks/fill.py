@@ -0,0 +1,93 @@
+'''
+Paint bucket timings. Without arguments, times the CPU fill's NumPy part (colour comparison and the
+run-based scanline fill) on synthetic 4096 and 8192 canvases: a large open area, a disc, and a maze of
+thin walls that makes the fill wind back and forth.
+
+Given a control socket, e.g. against `python main.py --control /tmp/fp.sock` with `canvas_size` set
+to 4096 or 8192, also times whole fills in the app with both methods, readback and upload included:
+
+    python benchmarks/fill.py [socket path] [runs]
+'''
+
+import sys
+from os.path import abspath, dirname
+from time import perf_counter
+
+import numpy
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from modules.floodfill import similar_mask, scanline_fill
+
+SIZES = (4096, 8192)
+BACKGROUND = (200, 200, 200, 255)
+INK = (20, 20, 20, 255)
+
+def open_area(size):
+    image = numpy.empty((size, size, 4), dtype=numpy.uint8)
+    image[:] = BACKGROUND
+    return image
+
+def disc(size):
+    image = open_area(size)
+    ys, xs = numpy.ogrid[0:size, 0:size]
+    image[(xs - size / 2) ** 2 + (ys - size / 2) ** 2 < (size / 3) ** 2] = INK
+    return image
+
+def maze(size):
+    # walls every 64 pixels, alternately open at the left and right end, so the fill snakes through
+    image = open_area(size)
+    for i, y in enumerate(range(32, size, 64)):
+        image[y:y + 4, 64:] = INK
+        if i % 2:
+            image[y:y + 4, :size - 64] = INK
+            image[y:y + 4, size - 64:] = BACKGROUND
+    return image
+
+IMAGES = {"open": open_area, "disc": disc, "maze": maze}
+
+def best_of(runs, f):
+    best = None
+    result = None
+    for _ in range(runs):
+        start = perf_counter()
+        result = f()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def numpy_fills(runs):
+    for size in SIZES:
+        for name, make in IMAGES.items():
+            image = make(size)
+            seed = image[0, 0]
+            compare, similar = best_of(runs, lambda: similar_mask(image, seed, 0.1))
+            fill, (mask, _) = best_of(runs, lambda: scanline_fill(similar, 0, 0))
+            print(f"{size}x{size} {name:5s}  compare {compare * 1000.0:7.1f} ms  fill {fill * 1000.0:7.1f} ms  "
+                f"({int(mask.sum())} pixels)")
+
+def app_fills(path, runs):
+    from modules.controlclient import ControlClient
+
+    with ControlClient(path) as fp:
+        state = fp.state()
+        width, height = state["canvas"]
+        print(f"App canvas {width}x{height}")
+        for method in ("cpu", "gpu"):
+            times = []
+            for _ in range(runs):
+                fp.operator("canvas_clear")
+                times.append(fp.fill(width // 2, height // 2, 0.1, False, method)["ms"])
+            result = fp.fill(width // 2, height // 2, 0.1, True, method)
+            print(f"{method}: best {min(times):7.1f} ms, median {sorted(times)[len(times) // 2]:7.1f} ms; "
+                f"merged layers {result['ms']:7.1f} ms" + (f", {result['passes']} grow passes" if method == "gpu" else ""))
+        fp.operator("canvas_clear")
+
+def main(argv):
+    runs = int(argv[2]) if len(argv) > 2 else 3
+    numpy_fills(runs)
+    if len(argv) > 1:
+        app_fills(argv[1], runs)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
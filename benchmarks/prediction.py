@@ -0,0 +1,96 @@
+'''
+Synthetic check of pointer prediction: a pen moving along a few paths is sampled like a tablet,
+frames are drawn at the app's frame rate and shown one frame later, and the rendered stroke tip is
+compared with where the pen actually is when the frame reaches the screen. Reports the gap in pixels
+and in milliseconds of pen travel, without prediction (smoothed pointer, as drawn now) and with it.
+
+    python benchmarks/prediction.py
+'''
+
+import sys
+from math import cos, sin, pi, sqrt
+from os.path import abspath, dirname
+from random import Random
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from modules.prediction import PointerPredictor
+
+INPUT_RATE = 240.0
+FRAME_RATE = 120.0
+DISPLAY_LATENCY = 1.0 / FRAME_RATE
+SMOOTHING = 0.4
+NOISE = 0.3
+DURATION = 4.0
+
+def circle(t):
+    return 400.0 + 200.0 * cos(2.0 * pi * t), 400.0 + 200.0 * sin(2.0 * pi * t)
+
+def zigzag(t):
+    return 100.0 + 300.0 * t, 400.0 + 150.0 * sin(2.0 * pi * 1.5 * t)
+
+def scribble(t):
+    return 400.0 + 150.0 * sin(2.0 * pi * 2.3 * t) + 60.0 * cos(2.0 * pi * 5.1 * t), 400.0 + 150.0 * cos(2.0 * pi * 1.7 * t)
+
+PATHS = {"circle": circle, "zigzag": zigzag, "scribble": scribble}
+
+def speed(path, t, h=1e-4):
+    a = path(t - h)
+    b = path(t + h)
+    return sqrt((b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2) / (2.0 * h)
+
+def simulate(path, lookahead):
+    rng = Random(1)
+    predictor = PointerPredictor(lookahead)
+    a = 1.0 - SMOOTHING * 0.8
+    smoothed = path(0.0)
+
+    samples = []
+    t = 0.0
+    while t < DURATION:
+        x, y = path(t)
+        samples.append((t, x + rng.gauss(0.0, NOISE), y + rng.gauss(0.0, NOISE)))
+        t += 1.0 / INPUT_RATE
+
+    errors = []
+    lags = []
+    i = 0
+    frame = 0.1
+    while frame < DURATION - DISPLAY_LATENCY:
+        latest = None
+        while i < len(samples) and samples[i][0] <= frame:
+            predictor.add(*samples[i])
+            latest = samples[i]
+            i += 1
+        # the app reads the pointer once per frame and smooths it, like InputState.smooth_mpos
+        if latest:
+            smoothed = (latest[1] * a + smoothed[0] * (1 - a), latest[2] * a + smoothed[1] * (1 - a))
+
+        tip = smoothed
+        if lookahead > 0.0:
+            predicted = predictor.predict(frame)
+            if predicted:
+                tip = predicted
+
+        shown = frame + DISPLAY_LATENCY
+        actual = path(shown)
+        error = sqrt((tip[0] - actual[0]) ** 2 + (tip[1] - actual[1]) ** 2)
+        errors.append(error)
+        lags.append(error / max(speed(path, shown), 1.0) * 1000.0)
+        frame += 1.0 / FRAME_RATE
+
+    errors.sort()
+    lags.sort()
+    return sum(errors) / len(errors), errors[int(len(errors) * 0.95)], sum(lags) / len(lags)
+
+def main(argv):
+    lookaheads = [0.0, 4.0, 8.0, 12.0, 16.0]
+    print(f"{'path':<10} {'predict':>8} {'mean px':>9} {'p95 px':>9} {'mean ms':>9}")
+    for name, path in PATHS.items():
+        for ms in lookaheads:
+            mean, p95, lag = simulate(path, ms / 1000.0)
+            label = f"{ms:.0f} ms" if ms > 0.0 else "off"
+            print(f"{name:<10} {label:>8} {mean:9.2f} {p95:9.2f} {lag:9.2f}")
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
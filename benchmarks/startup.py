@@ -0,0 +1,47 @@
+'''
+Time to first frame: starts the app with --profile-startup --exit-after-startup a number of times and
+reports what the startup profile measured, plus the wall time of the whole process.
+
+    python benchmarks/startup.py [runs]
+'''
+
+import re
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+from statistics import median
+from time import perf_counter
+
+MAIN = join(dirname(dirname(abspath(__file__))), "main.py")
+MEASURE = re.compile(r"^\s+(.+?)\s+([\d.]+) ms")
+
+def run_once():
+    start = perf_counter()
+    result = subprocess.run([sys.executable, MAIN, "--profile-startup", "--exit-after-startup"], capture_output=True, text=True)
+    wall = (perf_counter() - start) * 1000.0
+    if result.returncode != 0:
+        print(result.stdout)
+        print(result.stderr)
+        raise SystemExit(f"main.py exited with {result.returncode}")
+
+    measures = {"process wall time": wall}
+    for line in result.stdout.splitlines():
+        match = MEASURE.match(line)
+        if match:
+            measures[match.group(1)] = float(match.group(2))
+    return measures
+
+def main(argv):
+    runs = int(argv[1]) if len(argv) > 1 else 5
+    samples = {}
+    for i in range(runs):
+        for name, ms in run_once().items():
+            samples.setdefault(name, []).append(ms)
+        print(f"run {i + 1}/{runs}: first frame {samples.get('time to first frame', [0.0])[-1]:.1f} ms")
+
+    print(f"\n{'':<40} {'median':>10} {'min':>10}")
+    for name, values in samples.items():
+        print(f"{name:<40} {median(values):8.1f} ms {min(values):8.1f} ms")
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
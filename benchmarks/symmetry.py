@@ -0,0 +1,70 @@
+'''
+Symmetry cost. Without arguments, times mirroring a frame's worth of dabs with NumPy for each mode
+against placing them with no symmetry. Given a control socket (`python main.py --control /tmp/fp.sock`),
+also times whole strokes in the app with symmetry off and with 2, 4 and 8-way radial symmetry, per dab
+drawn and per stroke:
+
+    python benchmarks/symmetry.py [socket path] [strokes]
+'''
+
+import sys
+from math import cos, sin, pi
+from os.path import abspath, dirname
+from time import perf_counter
+
+import numpy
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from modules.symmetry import mirror_dabs
+
+# dabs placed in a frame of a quick stroke with a small brush
+FRAME_DABS = 32
+RUNS = 2000
+
+def circle_stroke(size, points=200):
+    r = size * 0.3
+    xy = [(size * 0.5 + r * cos(2.0 * pi * i / points), size * 0.5 + r * sin(2.0 * pi * i / points)) for i in range(points)]
+    return xy, [1.0] * points
+
+def numpy_mirroring():
+    points = numpy.random.default_rng(1).uniform(0.0, 4096.0, (FRAME_DABS, 2))
+    opacities = numpy.full(FRAME_DABS, 0.5)
+    pressures = numpy.ones(FRAME_DABS)
+    for mode, count in (("off", 1), ("vertical", 2), ("radial", 4), ("radial", 8), ("radial", 16)):
+        start = perf_counter()
+        for _ in range(RUNS):
+            result = mirror_dabs(points, opacities, pressures, mode, count, (2048.0, 2048.0))
+        elapsed = (perf_counter() - start) / RUNS
+        print(f"{mode:8s} x{count:2d}: {elapsed * 1e6:7.1f} us per frame of {FRAME_DABS} dabs -> {len(result[0])}")
+
+def app_strokes(path, strokes):
+    from modules.controlclient import ControlClient
+
+    with ControlClient(path) as fp:
+        state = fp.state()
+        size = state["canvas"][0]
+        brush = state["brush"]
+        points, pressures = circle_stroke(size)
+        fp.brush(size=12.0)
+        for mode, count in (("off", 1), ("radial", 2), ("radial", 4), ("radial", 8)):
+            fp.brush(symmetry=mode, symmetry_count=count, symmetry_centre=[])
+            fp.operator("canvas_clear")
+            dabs = 0
+            start = perf_counter()
+            for _ in range(strokes):
+                dabs += fp.stroke(points, pressures)
+            elapsed = perf_counter() - start
+            print(f"{mode:8s} x{count}: {elapsed / strokes * 1000.0:7.2f} ms per stroke, "
+                f"{elapsed / max(dabs, 1) * 1e6:6.2f} us per dab ({dabs // strokes} dabs)")
+        fp.brush(size=brush["size"], symmetry=brush["symmetry"], symmetry_count=brush["symmetry_count"],
+            symmetry_centre=brush["symmetry_centre"])
+        fp.operator("canvas_clear")
+
+def main(argv):
+    numpy_mirroring()
+    if len(argv) > 1:
+        app_strokes(argv[1], int(argv[2]) if len(argv) > 2 else 20)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
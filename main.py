@@ -7,32 +7,96 @@ Required libs:
 import sys
 import os
 
+# before anything imports OpenGL.GL, or it has no effect: otherwise every GL call checks glGetError
+import OpenGL
+OpenGL.ERROR_CHECKING = False
+
+cwd = os.getcwd()
 dname = os.path.abspath(os.path.dirname(sys.argv[0]))
 os.chdir(dname)
 
-from modules.sdlapp import App
-
-FPS = 120.0
-FRAME_DELTA = 1000.0 / FPS
+from modules.startup import startup
+from modules.trace import tracer
 
 def main(argv):
+    profile_startup = "--profile-startup" in argv
+    # leave as soon as startup is done, for timing it
+    exit_after_startup = "--exit-after-startup" in argv
+    # None, or where to write the results ("" for nowhere)
+    latency_test = None
+    # path of the control socket, if any
+    control = None
+    for i, arg in enumerate(argv):
+        if arg == "--trace" and i + 1 < len(argv):
+            tracer.open(os.path.join(cwd, argv[i+1]))
+        elif arg == "--latency-test":
+            latency_test = os.path.join(cwd, argv[i+1]) if i + 1 < len(argv) and not argv[i+1].startswith("--") else ""
+        elif arg == "--control" and i + 1 < len(argv):
+            control = os.path.join(cwd, argv[i+1])
+
+    try:
+        run(profile_startup, exit_after_startup, latency_test, control)
+    finally:
+        tracer.close()
+
+def run(profile_startup, exit_after_startup, latency_test, control_path):
+    # imported here so the import time shows up in the startup profile
+    with startup.phase("imports"):
+        from modules.sdlapp import App
+
     app = App("py-fp")
+    app.render_first_frame()
+    app.finish_startup()
+    if profile_startup:
+        print(startup.report())
+    if exit_after_startup:
+        app.running = False
+
+    harness = None
+    if latency_test is not None:
+        from modules.latency import LatencyHarness
+        harness = LatencyHarness(app, path=latency_test)
+
+    control = None
+    if control_path:
+        from modules.control import ControlServer
+        control = ControlServer(control_path)
+        control.start()
 
-    waitpoint = app.get_ticks() + FRAME_DELTA
     while app.running:
-        app.update_input_state()
+        app.pacer.wait()
+        tracer.begin("frame", "frame")
 
+        if harness:
+            harness.before_input()
+        with tracer.span("update_input_state", "frame"):
+            app.update_input_state()
+
+        if not app.paused:
+            with tracer.span("check_keybinds_and_run_operators", "frame"):
+                app.check_keybinds_and_run_operators()
+        if control:
+            # commands run even while the pointer is outside the window
+            with tracer.span("control", "frame"):
+                control.process(app)
         if not app.paused:
-            app.check_keybinds_and_run_operators()
-            app.render()
-        app.swap_window()
-
-        now = app.get_ticks()
-        if now < waitpoint:
-            app.delay(waitpoint - now)
-        waitpoint = app.get_ticks() + FRAME_DELTA
+            with tracer.span("render", "frame"):
+                app.render()
+        if harness:
+            harness.before_swap()
+        app.pacer.before_swap()
+        with tracer.span("swap_window", "frame"):
+            app.swap_window()
+        app.pacer.after_swap()
+        if harness and not harness.after_swap():
+            app.running = False
+        tracer.end("frame", "frame")
         # app.running = False
 
+    if harness:
+        harness.close()
+    if control:
+        control.stop()
     app.close()
     print("Quit.")
 
@@ -0,0 +1,240 @@
+from os import listdir, makedirs, remove, replace
+from os.path import isdir, join
+from queue import Queue
+from struct import Struct
+from threading import Thread
+from time import localtime, perf_counter, strftime
+from zlib import compress, decompress
+
+from OpenGL import GL
+
+from modules.gl.gltypes import AsyncReadback, DirtyTiles
+from modules.gl.layers import BLEND_MODES
+from modules.trace import tracer
+
+AutosaveMagic = b"FPAUTO\0\0"
+AutosaveVersion = 2
+AutosaveTileSize = 256
+AutosavePixelSize = 8
+AutosaveReadbacks = 4
+
+# magic, version, width, height, tile size, layer count, tile count
+AUTOSAVE_HEADER = Struct("<8sIIIIII")
+# opacity, visible, blend mode, name
+AUTOSAVE_LAYER = Struct("<fBB2x32s")
+# layer index, tx, ty, w, h, compressed size
+AUTOSAVE_TILE = Struct("<IIIIII")
+
+class AutosaveWriter(Thread):
+    """ Compresses tiles handed over by the render thread and writes autosave files atomically. """
+    def __init__(self, directory, retention):
+        super().__init__(name="autosave", daemon=True)
+        self.directory = directory
+        self.retention = retention
+        self.queue = Queue()
+        # (layer id, tx, ty) -> (w, h, compressed pixels)
+        self.tiles = {}
+
+    def run(self):
+        tracer.name_thread("autosave")
+        while True:
+            item = self.queue.get()
+            if item[0] == "stop":
+                return
+            elif item[0] == "reset":
+                self.tiles = {}
+            elif item[0] == "tile":
+                _, key, w, h, data = item
+                with tracer.span("compress tile", "autosave"):
+                    self.tiles[key] = (w, h, compress(data, 1))
+            elif item[0] == "commit":
+                _, width, height, layers = item
+                with tracer.span("write autosave", "autosave", {"tiles": len(self.tiles)}):
+                    self.write(width, height, layers)
+
+    def write(self, width, height, layers):
+        if not isdir(self.directory):
+            makedirs(self.directory)
+
+        # forget layers that have been removed
+        indices = dict((layer[0], i) for i, layer in enumerate(layers))
+        self.tiles = dict((key, tile) for key, tile in self.tiles.items() if key[0] in indices)
+
+        name = "autosave-" + strftime("%Y%m%d-%H%M%S", localtime()) + ".fpa"
+        path = join(self.directory, name)
+        temp = path + ".tmp"
+        with open(temp, 'wb') as f:
+            f.write(AUTOSAVE_HEADER.pack(AutosaveMagic, AutosaveVersion, width, height, AutosaveTileSize, len(layers), len(self.tiles)))
+            for _, opacity, visible, blend_mode, layer_name in layers:
+                f.write(AUTOSAVE_LAYER.pack(opacity, 1 if visible else 0, BLEND_MODES.index(blend_mode), layer_name.encode('utf-8')[:32]))
+            for (layer_id, tx, ty), (w, h, data) in self.tiles.items():
+                f.write(AUTOSAVE_TILE.pack(indices[layer_id], tx, ty, w, h, len(data)))
+                f.write(data)
+        replace(temp, path)
+
+        saves = list_autosaves(self.directory)
+        for old in saves[:-self.retention] if self.retention > 0 else []:
+            remove(join(self.directory, old))
+
+def list_autosaves(directory):
+    if not isdir(directory):
+        return []
+    return sorted(f for f in listdir(directory) if f.startswith("autosave-") and f.endswith(".fpa"))
+
+class Autosave:
+    """ Reads back layer tiles changed since the last autosave a few at a time through pixel buffer objects,
+        so the paint loop never waits on the GPU, and leaves compression and disk writes to a worker thread.
+    """
+    def __init__(self, settings):
+        self.interval = settings.autosave_interval
+        self.directory = settings.autosave_dir
+        self.tiles_per_frame = settings.autosave_tiles_per_frame
+        self.enabled = self.interval > 0
+
+        self.size = None
+        self.generation = None
+        self.dirty = {}
+        self.queue = []
+        self.readbacks = []
+        self.last_save = perf_counter()
+        self.saved_version = None
+        self.saving = False
+
+        self.writer = AutosaveWriter(self.directory, settings.autosave_retention)
+        if self.enabled:
+            self.writer.start()
+
+    def close(self):
+        for readback in self.readbacks:
+            readback.delete()
+        self.readbacks = []
+        if self.writer.is_alive():
+            self.writer.queue.put(("stop",))
+
+    def track(self, stack):
+        # a replaced stack (opened document, recovered autosave) has to be read back in full
+        replaced = self.generation is not None and stack.generation != self.generation
+        if stack.generation != self.generation:
+            self.generation = stack.generation
+            self.size = list(stack.size)
+            self.dirty = {}
+            self.queue = []
+            self.saving = False
+            self.writer.queue.put(("reset",))
+
+        ids = set()
+        for layer in stack.layers:
+            ids.add(layer.id)
+            if layer.id not in self.dirty:
+                tracker = DirtyTiles(self.size[0], self.size[1], AutosaveTileSize)
+                layer.canvas.dirty_trackers.append(tracker)
+                self.dirty[layer.id] = tracker
+                if replaced:
+                    tracker.mark_all()
+        for layer_id in list(self.dirty):
+            if layer_id not in ids:
+                del self.dirty[layer_id]
+
+    def tile_rect(self, tx, ty):
+        x = tx * AutosaveTileSize
+        y = ty * AutosaveTileSize
+        return x, y, min(AutosaveTileSize, self.size[0] - x), min(AutosaveTileSize, self.size[1] - y)
+
+    def update(self, stack):
+        if not self.enabled:
+            return
+        self.track(stack)
+
+        if not self.saving:
+            if perf_counter() - self.last_save < self.interval:
+                return
+            changed = any(tracker.tiles for tracker in self.dirty.values())
+            if not changed and stack.version == self.saved_version:
+                return
+            self.queue = []
+            for layer_id, tracker in self.dirty.items():
+                self.queue.extend((layer_id, tx, ty) for tx, ty in tracker.take())
+            self.saved_version = stack.version
+            self.saving = True
+            tracer.instant("autosave start", "autosave", {"tiles": len(self.queue)})
+
+        # hand over whatever the GPU has finished with
+        for readback in self.readbacks:
+            if readback.ready():
+                _, _, w, h = readback.region
+                self.writer.queue.put(("tile", readback.tag, w, h, readback.take()))
+
+        # and queue up the next few tiles
+        layers = dict((layer.id, layer) for layer in stack.layers)
+        started = 0
+        for readback in self.free_readbacks():
+            while self.queue and self.queue[-1][0] not in layers:
+                self.queue.pop()
+            if not self.queue or started >= self.tiles_per_frame:
+                break
+            layer_id, tx, ty = self.queue.pop()
+            x, y, w, h = self.tile_rect(tx, ty)
+            readback.start(layers[layer_id].canvas.front(), x, y, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_SHORT, AutosavePixelSize, (layer_id, tx, ty))
+            started += 1
+
+        if not self.queue and not any(r.busy() for r in self.readbacks):
+            info = [(layer.id, layer.opacity, layer.visible, layer.blend_mode, layer.name) for layer in stack.layers]
+            self.writer.queue.put(("commit", self.size[0], self.size[1], info))
+            self.saving = False
+            self.last_save = perf_counter()
+
+    def free_readbacks(self):
+        free = [r for r in self.readbacks if not r.busy()]
+        while len(self.readbacks) < AutosaveReadbacks and len(free) < self.tiles_per_frame:
+            readback = AsyncReadback(AutosaveTileSize * AutosaveTileSize * AutosavePixelSize)
+            self.readbacks.append(readback)
+            free.append(readback)
+        return free
+
+def recover_autosave(directory, renderer):
+    """ Loads the most recent autosave into the renderer's layer stack. """
+    saves = list_autosaves(directory)
+    if not saves:
+        print("No autosave found.")
+        return False
+
+    path = join(directory, saves[-1])
+    stack = renderer.layers
+    with open(path, 'rb') as f:
+        magic, version, width, height, tile_size, layer_count, tile_count = AUTOSAVE_HEADER.unpack(f.read(AUTOSAVE_HEADER.size))
+        if magic != AutosaveMagic or version != AutosaveVersion:
+            print(f"ERROR: {path} is not a version {AutosaveVersion} autosave.")
+            return False
+
+        resized = stack.size != [width, height]
+        # as open_document does: a floating region or selection belongs to the layers being replaced
+        if renderer.transform:
+            renderer.transform.discard()
+        if renderer.selection:
+            renderer.selection.clear()
+        stack.reset(width, height, layer_count)
+        for layer in stack.layers:
+            opacity, visible, blend_mode, name = AUTOSAVE_LAYER.unpack(f.read(AUTOSAVE_LAYER.size))
+            layer.opacity = opacity
+            layer.visible = visible != 0
+            layer.blend_mode = BLEND_MODES[blend_mode] if blend_mode < len(BLEND_MODES) else "normal"
+            layer.name = name.rstrip(b"\0").decode('utf-8', 'replace')
+
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 2 )
+        for _ in range(tile_count):
+            li, tx, ty, w, h, nbytes = AUTOSAVE_TILE.unpack(f.read(AUTOSAVE_TILE.size))
+            data = decompress(f.read(nbytes))
+            for fb in stack.layers[li].canvas.fbs:
+                fb.texture.use()
+                GL.glTexSubImage2D( GL.GL_TEXTURE_2D, 0, tx * tile_size, ty * tile_size, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_SHORT, data )
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 4 )
+
+    for layer in stack.layers:
+        for fb in layer.canvas.fbs:
+            if fb.gen_mipmaps:
+                fb.update_mipmaps()
+    stack.invalidate()
+    if resized:
+        renderer.update_canvas_size(width, height)
+    print(f"Recovered {path}")
+    return True
@@ -0,0 +1,215 @@
+import asyncio
+from collections import deque
+from os import lstat, unlink
+from os.path import lexists
+from stat import S_ISSOCK
+from threading import Thread
+from time import perf_counter
+
+import numpy
+from OpenGL import GL
+
+from modules.controlproto import MESSAGE_HEADER, pack_message, unpack_header, unpack_text
+from modules.inputstate import KeyBind, KeyPressed
+from modules.math import vec2f_mat4_mul_inverse
+from modules.operators import stroke
+from modules.trace import tracer
+
+# seconds of each frame spent running control commands; one batch always runs, however long it takes
+ControlBudget = 0.004
+# brush settings that aren't plain values
+ControlHiddenBrush = ("progs",)
+
+def is_socket(path):
+    return lexists(path) and S_ISSOCK(lstat(path).st_mode)
+
+def check_request(request):
+    """ What's wrong with the shape of a request, or None: it has to be an object, with "commands" a
+        list of objects.
+    """
+    if not isinstance(request, dict):
+        return f"Request is {type(request).__name__}, not an object"
+    commands = request.get("commands", [])
+    if not isinstance(commands, list):
+        return f"commands is {type(commands).__name__}, not a list"
+    for command in commands:
+        if not isinstance(command, dict):
+            return f"Command is {type(command).__name__}, not an object"
+    return None
+
+class ControlServer(Thread):
+    """ Unix domain socket for driving the app from scripts. The socket is served by asyncio on its own
+        thread, which only reads and writes messages: each batch of commands is queued and run on the main
+        thread by process(), once a frame, and its results are sent back when it's done. Commands in a batch
+        run in order; see run_command for what they are.
+    """
+    def __init__(self, path):
+        super().__init__(name="control", daemon=True)
+        self.path = path
+        self.pending = deque()
+        self.loop = None
+        self.server = None
+
+    def run(self):
+        tracer.name_thread("control")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    async def serve(self):
+        # a socket left behind by an earlier run is replaced, anything else at the path is left alone
+        if lexists(self.path) and not is_socket(self.path):
+            print(f"ERROR: {self.path} exists and isn't a socket; not serving control commands.")
+            return
+        if is_socket(self.path):
+            unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path)
+        print(f"Control socket at {self.path}")
+        await self.server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                text_length, blob_length = unpack_header(await reader.readexactly(MESSAGE_HEADER.size))
+                request = unpack_text(await reader.readexactly(text_length))
+                blob = await reader.readexactly(blob_length) if blob_length else b""
+
+                # a malformed request is answered here, it never gets to the main thread
+                error = check_request(request)
+                if error:
+                    reply, reply_blob = {"id": request.get("id") if isinstance(request, dict) else None, "results": [{"error": error}]}, b""
+                else:
+                    done = self.loop.create_future()
+                    self.pending.append((request, blob, done))
+                    reply, reply_blob = await done
+                writer.write(pack_message(reply, reply_blob))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.server.close)
+        if self.is_alive():
+            self.join(1.0)
+        if self.server and is_socket(self.path):
+            unlink(self.path)
+
+    def process(self, app):
+        """ Runs queued batches on the main thread until the frame's budget is used up. """
+        start = perf_counter()
+        while self.pending and perf_counter() - start < ControlBudget:
+            request, blob, done = self.pending.popleft()
+            with tracer.span("control batch", "control", {"commands": len(request.get("commands", ()))}):
+                reply = run_batch(app, request, blob)
+            self.loop.call_soon_threadsafe(done.set_result, reply)
+
+def run_batch(app, request, blob):
+    results = []
+    out = bytearray()
+    for command in request.get("commands", ()):
+        try:
+            results.append(run_command(app, command, blob, out))
+        # whatever a command gets wrong is its result, the rest of the batch and the app carry on
+        except Exception as e:
+            results.append({"error": f"{type(e).__name__}: {e}"})
+    return {"id": request.get("id"), "results": results}, bytes(out)
+
+def run_command(app, command, blob, out):
+    """ The commands are:
+        operator  run an operator once, as a key press and release: "name", optional "to"
+        stroke    draw a stroke with the current brush: "points" refers to float32 (x, y, pressure)
+                  triples; "space" is "canvas" (default, pixels) or "window" (pixels from bottom left)
+        brush     set brush settings: "values" maps setting names to values
+        read      read pixels back: "rect" [x, y, w, h] on a layer's canvas ("layer", default the active
+                  one) or on the view ("layer": "view"), rows bottom up; "format" rgba8 (default) or float
+        fill      paint bucket with the brush colour at "point" [x, y] (canvas pixels); "tolerance", "merged"
+                  and "method" (cpu or gpu) default to the brush's fill settings. Returns the method used,
+                  grow passes and milliseconds taken
+        state     canvas size, layers and brush settings
+    """
+    renderer = app.renderer
+    input_state = app.input_state
+    cmd = command["cmd"]
+
+    if cmd == "operator":
+        if not isinstance(command["name"], str):
+            raise TypeError("Operator name isn't a string")
+        bind = KeyBind([], "none", command["name"], KeyPressed, command.get("to", ""))
+        if not bind.op:
+            raise KeyError(f"Unknown operator {command['name']}")
+        app.ops.do(bind, False, renderer, input_state)
+        app.ops.do(bind, True, renderer, input_state)
+        return {}
+
+    elif cmd == "stroke":
+        offset, count = command["points"]
+        data = numpy.frombuffer(blob, dtype=numpy.float32, count=count * 3, offset=offset).reshape(count, 3)
+        points = data[:, :2]
+        if command.get("space", "canvas") == "window":
+            points = [vec2f_mat4_mul_inverse(renderer.view_transform, (x, y)) for x, y in points]
+        return {"dabs": stroke(renderer, input_state, points, data[:, 2])}
+
+    elif cmd == "brush":
+        brush = input_state.brush
+        if not isinstance(command["values"], dict):
+            raise TypeError("Brush values aren't an object")
+        for name, value in command["values"].items():
+            if name in ControlHiddenBrush or not hasattr(brush, name):
+                raise KeyError(f"Unknown brush setting {name}")
+            setattr(brush, name, value)
+        return {}
+
+    elif cmd == "read":
+        layer = command.get("layer")
+        x, y, w, h = (int(v) for v in command["rect"])
+        if layer == "view":
+            fb = renderer.view.fb
+        else:
+            layer = renderer.layers.layers[layer] if layer is not None else renderer.layers.active_layer()
+            renderer.page_in((x, y, x + w, y + h), layer)
+            fb = layer.canvas.front()
+        x = min(max(x, 0), fb.width)
+        y = min(max(y, 0), fb.height)
+        w = min(max(w, 0), fb.width - x)
+        h = min(max(h, 0), fb.height - y)
+
+        fmt = command.get("format", "rgba8")
+        if fmt not in ("rgba8", "float"):
+            raise ValueError(f"Unknown read format {fmt}")
+        pixel_type, dtype = (GL.GL_UNSIGNED_BYTE, "uint8") if fmt == "rgba8" else (GL.GL_FLOAT, "float32")
+        pixels = numpy.zeros(0, dtype=dtype)
+        if w and h:
+            fb.use()
+            data = GL.glReadPixels(x, y, w, h, GL.GL_RGBA, pixel_type)
+            # PyOpenGL hands unsigned bytes back as bytes, floats as an array
+            pixels = numpy.frombuffer(data, dtype=dtype) if isinstance(data, bytes) else numpy.ascontiguousarray(data, dtype=dtype).reshape(-1)
+        offset = len(out)
+        out.extend(pixels.tobytes())
+        return {"data": [offset, pixels.size], "dtype": dtype, "shape": [h, w, 4], "rect": [x, y, w, h]}
+
+    elif cmd == "fill":
+        x, y = command["point"]
+        result = renderer.fill(x, y, input_state.brush, command.get("tolerance"), command.get("merged"), command.get("method"))
+        if result is None:
+            raise ValueError(f"Can't fill at {x}, {y}")
+        return result
+
+    elif cmd == "state":
+        layers = renderer.layers
+        brush = dict((k, v) for k, v in vars(input_state.brush).items() if k not in ControlHiddenBrush)
+        return {
+            "canvas": list(layers.size),
+            "layers": [layer.name for layer in layers.layers],
+            "active": layers.active,
+            "brush": brush,
+        }
+
+    raise KeyError(f"Unknown command {cmd}")
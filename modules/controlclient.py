@@ -0,0 +1,110 @@
+'''
+Client for the control socket; start the app with `python main.py --control /tmp/fp.sock`, then:
+
+    from modules.controlclient import ControlClient
+
+    with ControlClient("/tmp/fp.sock") as fp:
+        fp.brush(size=12.0, color=[0.1, 0.1, 0.1, 1.0])
+        fp.stroke([(100, 100), (200, 140), (300, 120)], [0.2, 1.0, 0.5])
+        pixels = fp.read(0, 0, 64, 64)
+
+Each call is one round trip. To send many commands in one, fill a Batch and pass it to run().
+Needs numpy, but none of the app's other dependencies.
+'''
+
+import socket
+
+import numpy
+
+from modules.controlproto import pack_message, recv_message
+
+class ControlError(Exception):
+    pass
+
+class Batch:
+    def __init__(self):
+        self.commands = []
+        self.blob = bytearray()
+
+    def operator(self, name, to=""):
+        self.commands.append({"cmd": "operator", "name": name, "to": to})
+        return self
+
+    def stroke(self, points, pressures=None, space="canvas"):
+        points = numpy.asarray(points, dtype=numpy.float32).reshape(-1, 2)
+        data = numpy.empty((len(points), 3), dtype=numpy.float32)
+        data[:, :2] = points
+        data[:, 2] = 1.0 if pressures is None else numpy.asarray(pressures, dtype=numpy.float32)
+        self.commands.append({"cmd": "stroke", "points": [len(self.blob), len(points)], "space": space})
+        self.blob += data.tobytes()
+        return self
+
+    def brush(self, **values):
+        self.commands.append({"cmd": "brush", "values": values})
+        return self
+
+    def read(self, x, y, w, h, layer=None, fmt="rgba8"):
+        self.commands.append({"cmd": "read", "rect": [x, y, w, h], "layer": layer, "format": fmt})
+        return self
+
+    def fill(self, x, y, tolerance=None, merged=None, method=None):
+        command = {"cmd": "fill", "point": [x, y]}
+        for name, value in (("tolerance", tolerance), ("merged", merged), ("method", method)):
+            if value is not None:
+                command[name] = value
+        self.commands.append(command)
+        return self
+
+    def state(self):
+        self.commands.append({"cmd": "state"})
+        return self
+
+class ControlClient:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.next_id = 0
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, batch, check=True):
+        """ Sends a batch and waits for it to run; returns one result per command, with pixel reads
+            turned into arrays (h x w x 4, bottom row first). With check, the first error raises ControlError.
+        """
+        self.next_id += 1
+        self.sock.sendall(pack_message({"id": self.next_id, "commands": batch.commands}, batch.blob))
+        reply, blob = recv_message(self.sock)
+
+        results = reply["results"]
+        for result in results:
+            if check and "error" in result:
+                raise ControlError(result["error"])
+            if "data" in result:
+                offset, count = result["data"]
+                result["pixels"] = numpy.frombuffer(blob, dtype=result["dtype"], count=count, offset=offset).reshape(result["shape"])
+        return results
+
+    def operator(self, name, to=""):
+        return self.run(Batch().operator(name, to))[0]
+
+    def stroke(self, points, pressures=None, space="canvas"):
+        return self.run(Batch().stroke(points, pressures, space))[0]["dabs"]
+
+    def brush(self, **values):
+        return self.run(Batch().brush(**values))[0]
+
+    def read(self, x, y, w, h, layer=None, fmt="rgba8"):
+        return self.run(Batch().read(x, y, w, h, layer, fmt))[0]["pixels"]
+
+    def fill(self, x, y, tolerance=None, merged=None, method=None):
+        return self.run(Batch().fill(x, y, tolerance, merged, method))[0]
+
+    def state(self):
+        return self.run(Batch().state())[0]
@@ -0,0 +1,43 @@
+'''
+Framing for the control socket, shared by the server (modules/control.py) and the client
+(modules/controlclient.py); standard library only, so scripts can use it without the app's dependencies.
+
+Every message, either way, is a header of two big-endian uint32s (JSON length, binary length), a UTF-8
+JSON object, then the binary part. Commands and results refer to arrays in the binary part as
+[byte offset, count].
+'''
+
+from json import dumps, loads
+from struct import Struct
+
+MESSAGE_HEADER = Struct("!II")
+# anything bigger than this (bytes) is taken as a broken stream
+MessageLimit = 256 * 1024 * 1024
+
+def pack_message(obj, blob=b""):
+    text = dumps(obj).encode("utf-8")
+    return MESSAGE_HEADER.pack(len(text), len(blob)) + text + bytes(blob)
+
+def unpack_header(header):
+    text_length, blob_length = MESSAGE_HEADER.unpack(header)
+    if text_length + blob_length > MessageLimit:
+        raise ValueError(f"Message of {text_length + blob_length} bytes is over the limit")
+    return text_length, blob_length
+
+def unpack_text(text):
+    return loads(text.decode("utf-8"))
+
+def recv_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Control socket closed")
+        data += chunk
+    return bytes(data)
+
+def recv_message(sock):
+    text_length, blob_length = unpack_header(recv_exactly(sock, MESSAGE_HEADER.size))
+    obj = unpack_text(recv_exactly(sock, text_length))
+    blob = recv_exactly(sock, blob_length) if blob_length else b""
+    return obj, blob
@@ -5,6 +5,7 @@ from Xlib.display import Display
 from Xlib.ext import xinput
 
 from modules.devices.stylusdummy import STYLUS_DUMMY_VALUES
+from modules.trace import tracer
 
 def convert_valuator_name(name):
     if name in ("Abs X"):
@@ -42,6 +43,7 @@ class Devices:
         print(f'XInput version {vers_info.major_version}.{vers_info.minor_version}')
 
         self.devices = {}
+        self.pointer_window = None
     
     def close(self):
         self.display.close()
@@ -73,6 +75,11 @@ class Devices:
         return True
 
     def update_devices(self):
+        tracer.begin("poll devices", "devices")
+        self.poll_devices()
+        tracer.end("poll devices", "devices")
+
+    def poll_devices(self):
         for devicename in self.devices:
             dev = self.devices[devicename]
 
@@ -101,6 +108,13 @@ class Devices:
                     if valuator_name == "pressure":
                         print(c["value"])
 
+    def query_pointer(self, window_id):
+        """ Pointer position relative to the window with this X id, from the top left. """
+        if not self.pointer_window or self.pointer_window.id != window_id:
+            self.pointer_window = self.display.create_resource_object("window", window_id)
+        reply = self.pointer_window.query_pointer()
+        return reply.win_x, reply.win_y
+
     def is_device_active(self, namestr):
         if namestr not in self.devices:
             # print(f'Device "{namestr}" not found in current devices.')
@@ -0,0 +1,270 @@
+import mmap
+from os.path import isfile, getsize
+from struct import Struct
+from time import perf_counter
+
+import numpy
+from OpenGL import GL
+
+from modules.gl.gltypes import DirtyTiles
+from modules.gl.layers import BLEND_MODES
+from modules.trace import tracer
+
+DocumentMagic = b"FPDOC\0\0\0"
+DocumentVersion = 2
+DocumentTileSize = 256
+DocumentChannels = 4
+
+# magic, version, width, height, tile size, layer count
+DOCUMENT_HEADER = Struct("<8sIIIII")
+# opacity, visible, blend mode, name
+LAYER_RECORD = Struct("<fBB2x32s")
+
+# tiles uploaded per frame while a document is being paged in
+UploadTilesPerFrame = 16
+
+TileEmpty = 0
+TileWritten = 1
+
+def align(n, to):
+    return ((n + to - 1) // to) * to
+
+def pack_layer(layer):
+    return LAYER_RECORD.pack(layer.opacity, 1 if layer.visible else 0, BLEND_MODES.index(layer.blend_mode), layer.name.encode('utf-8')[:32])
+
+def unpack_layer(data):
+    opacity, visible, blend_mode, name = LAYER_RECORD.unpack(data)
+    mode = BLEND_MODES[blend_mode] if blend_mode < len(BLEND_MODES) else "normal"
+    return opacity, visible != 0, mode, name.rstrip(b"\0").decode('utf-8', 'replace')
+
+class Document:
+    """ Native document: a header, layer records, a one byte per tile index, then fixed-size
+        RGBA16 tile blocks for each layer. The file is memory-mapped so a save only touches the
+        blocks of tiles that changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.width = 0
+        self.height = 0
+        self.tile_size = DocumentTileSize
+        self.layer_count = 0
+        self.tiles_x = 0
+        self.tiles_y = 0
+        self.index_offset = 0
+        self.data_offset = 0
+        self.block_size = 0
+        self.layer_records = []
+        # layer ids in the order they're stored, and what's changed on each since the last save
+        self.layer_ids = []
+        self.dirty = {}
+        self.pending = set()
+
+    def layout(self, width, height, tile_size, layer_count):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.layer_count = layer_count
+        self.tiles_x = (width + tile_size - 1) // tile_size
+        self.tiles_y = (height + tile_size - 1) // tile_size
+        self.block_size = tile_size * tile_size * DocumentChannels * 2
+        self.index_offset = DOCUMENT_HEADER.size + LAYER_RECORD.size * layer_count
+        self.data_offset = align(self.index_offset + self.tile_count() * layer_count, mmap.ALLOCATIONGRANULARITY)
+
+    def tile_count(self):
+        return self.tiles_x * self.tiles_y
+
+    def file_size(self):
+        return self.data_offset + self.tile_count() * self.layer_count * self.block_size
+
+    def create(self, stack):
+        self.close()
+        self.layout(stack.size[0], stack.size[1], DocumentTileSize, len(stack.layers))
+
+        # the file is sparse until tiles are written
+        with open(self.path, 'wb') as f:
+            f.truncate(self.file_size())
+
+        self.map_file()
+        self.map[0:DOCUMENT_HEADER.size] = DOCUMENT_HEADER.pack(DocumentMagic, DocumentVersion, self.width, self.height, self.tile_size, self.layer_count)
+        self.pending = set()
+
+    def open(self):
+        self.close()
+        if not isfile(self.path):
+            print(f"ERROR: Document {self.path} not found.")
+            return False
+
+        with open(self.path, 'rb') as f:
+            header = f.read(DOCUMENT_HEADER.size)
+        if len(header) < DOCUMENT_HEADER.size:
+            print(f"ERROR: {self.path} is not a document.")
+            return False
+
+        magic, version, width, height, tile_size, layer_count = DOCUMENT_HEADER.unpack(header)
+        if magic != DocumentMagic or version != DocumentVersion:
+            print(f"ERROR: {self.path} is not a version {DocumentVersion} document.")
+            return False
+
+        self.layout(width, height, tile_size, layer_count)
+        if getsize(self.path) < self.file_size():
+            print(f"ERROR: {self.path} is truncated.")
+            return False
+
+        self.map_file()
+        self.layer_records = []
+        for i in range(layer_count):
+            offset = DOCUMENT_HEADER.size + i * LAYER_RECORD.size
+            self.layer_records.append(unpack_layer(self.map[offset:offset + LAYER_RECORD.size]))
+        return True
+
+    def map_file(self):
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def close(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def attach(self, stack):
+        """ Starts tracking edits made to the stack's layers, in their current order. """
+        self.detach(stack)
+        self.layer_ids = [layer.id for layer in stack.layers]
+        for layer in stack.layers:
+            tracker = DirtyTiles(self.width, self.height, self.tile_size)
+            layer.canvas.dirty_trackers.append(tracker)
+            self.dirty[layer.id] = tracker
+
+    def detach(self, stack):
+        for layer in stack.layers:
+            tracker = self.dirty.get(layer.id)
+            if tracker in layer.canvas.dirty_trackers:
+                layer.canvas.dirty_trackers.remove(tracker)
+        self.dirty = {}
+
+    def matches(self, stack):
+        # layers added, removed or reordered since the last save need a new layout
+        return self.map is not None and self.layer_ids == [layer.id for layer in stack.layers]
+
+    def mark_pending(self, stack):
+        self.pending = set()
+        for li, layer in enumerate(stack.layers):
+            for i, flag in enumerate(self.map[self.index_offset + li * self.tile_count():self.index_offset + (li + 1) * self.tile_count()]):
+                if flag == TileWritten:
+                    self.pending.add((layer.id, i % self.tiles_x, i // self.tiles_x))
+
+    def tile_index(self, layer_index, tx, ty):
+        return layer_index * self.tile_count() + ty * self.tiles_x + tx
+
+    def tile_rect(self, tx, ty):
+        x = tx * self.tile_size
+        y = ty * self.tile_size
+        return x, y, min(self.tile_size, self.width - x), min(self.tile_size, self.height - y)
+
+    def tile_block(self, layer_index, tx, ty):
+        offset = self.data_offset + self.tile_index(layer_index, tx, ty) * self.block_size
+        count = self.tile_size * self.tile_size * DocumentChannels
+        return offset, numpy.frombuffer(self.map, dtype=numpy.uint16, count=count, offset=offset)
+
+    def save(self, stack):
+        start = perf_counter()
+        tracer.begin("save document", "document")
+
+        for li, layer in enumerate(stack.layers):
+            offset = DOCUMENT_HEADER.size + li * LAYER_RECORD.size
+            self.map[offset:offset + LAYER_RECORD.size] = pack_layer(layer)
+
+        GL.glPixelStorei( GL.GL_PACK_ALIGNMENT, 2 )
+        GL.glPixelStorei( GL.GL_PACK_ROW_LENGTH, self.tile_size )
+        saved = 0
+        for li, layer in enumerate(stack.layers):
+            tiles = self.dirty[layer.id].take()
+            # tiles that were never paged in are still correct on disk unless the canvas has drawn over them
+            self.pending -= set((layer.id, tx, ty) for tx, ty in tiles)
+
+            layer.canvas.front().use()
+            for tx, ty in tiles:
+                x, y, w, h = self.tile_rect(tx, ty)
+                offset, block = self.tile_block(li, tx, ty)
+                GL.glReadPixels( x, y, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_SHORT, block )
+                del block
+                self.map[self.index_offset + self.tile_index(li, tx, ty)] = TileWritten
+                self.map.flush(offset, self.block_size)
+            saved += len(tiles)
+        GL.glPixelStorei( GL.GL_PACK_ROW_LENGTH, 0 )
+        GL.glPixelStorei( GL.GL_PACK_ALIGNMENT, 4 )
+
+        self.map.flush(0, self.data_offset)
+
+        tracer.end("save document", "document", {"tiles": saved})
+        print(f"Saved {self.path}: {saved} tiles in {(perf_counter() - start) * 1000.0:.1f} ms")
+
+    def upload_tiles(self, stack, tiles):
+        layers = dict((layer.id, (li, layer)) for li, layer in enumerate(stack.layers))
+
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 2 )
+        GL.glPixelStorei( GL.GL_UNPACK_ROW_LENGTH, self.tile_size )
+        uploaded = set()
+        for layer_id, tx, ty in tiles:
+            li, layer = layers[layer_id]
+            x, y, w, h = self.tile_rect(tx, ty)
+            _, block = self.tile_block(li, tx, ty)
+            for fb in layer.canvas.fbs:
+                fb.texture.use()
+                GL.glTexSubImage2D( GL.GL_TEXTURE_2D, 0, x, y, w, h, GL.GL_RGBA, GL.GL_UNSIGNED_SHORT, block )
+            del block
+            # new to anything else tracking the canvas (an autosave may have read it blank), not to the document
+            for tracker in layer.canvas.dirty_trackers:
+                if tracker is not self.dirty.get(layer_id):
+                    tracker.mark(x, y, w, h)
+            uploaded.add(layer)
+        GL.glPixelStorei( GL.GL_UNPACK_ROW_LENGTH, 0 )
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 4 )
+
+        for layer in uploaded:
+            for fb in layer.canvas.fbs:
+                if fb.gen_mipmaps:
+                    fb.update_mipmaps()
+            layer.canvas.mark_changed()
+            if layer is not stack.active_layer():
+                stack.invalidate()
+
+    def upload_visible(self, stack, rect, limit=UploadTilesPerFrame, layer=None):
+        """ Pages in stored tiles overlapping rect (x0, y0, x1, y1 in canvas pixels); with rect None, all of them.
+            With layer, only that layer's.
+        """
+        if not self.pending:
+            return
+
+        ts = self.tile_size
+        if rect:
+            x0 = max(int(rect[0]) // ts, 0)
+            y0 = max(int(rect[1]) // ts, 0)
+            x1 = min(int(rect[2]) // ts, self.tiles_x - 1)
+            y1 = min(int(rect[3]) // ts, self.tiles_y - 1)
+        else:
+            x0, y0, x1, y1 = 0, 0, self.tiles_x - 1, self.tiles_y - 1
+
+        ids = set(layer.id for layer in stack.layers)
+        tiles = []
+        for tile in list(self.pending):
+            layer_id, tx, ty = tile
+            if tx < x0 or tx > x1 or ty < y0 or ty > y1 or (layer is not None and layer_id != layer.id):
+                continue
+            self.pending.discard(tile)
+            # anything drawing on a layer pages its tiles in first (Renderer.page_in), so a tile still
+            # pending and dirty was replaced whole (the layer cleared) or its layer removed since opening
+            if layer_id not in ids or (tx, ty) in self.dirty[layer_id].tiles:
+                continue
+            tiles.append(tile)
+            if limit and len(tiles) >= limit:
+                break
+
+        if tiles:
+            with tracer.span("upload tiles", "document", {"tiles": len(tiles)}):
+                self.upload_tiles(stack, tiles)
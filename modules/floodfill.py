@@ -0,0 +1,87 @@
+'''
+The CPU side of the fill tool: which pixels of an image are close enough to a seed colour, and the
+4-connected region of those containing the seed, found a whole run of pixels at a time. NumPy only, so
+benchmarks/fill.py can time it without a GL context.
+'''
+
+import numpy
+
+def similar_mask(pixels, seed, tolerance):
+    """ Pixels (h x w x 4, uint8) within tolerance (0-1) of seed in every channel, as an h x w bool array. """
+    h, w, _ = pixels.shape
+    limit = int(tolerance * 255.0 + 0.5)
+    # whole rows against the seed repeated along them, so numpy's inner loops run the length of a row
+    rows = pixels.reshape(h, w * 4)
+    seeds = numpy.tile(numpy.asarray(seed, dtype=numpy.uint8), w)
+    diff = numpy.maximum(rows, seeds)
+    diff -= numpy.minimum(rows, seeds)
+    # four matching channels are four true bytes, one uint32 per pixel
+    return (diff <= limit).view(numpy.uint32) == 0x01010101
+
+def runs(similar):
+    """ Every horizontal run of similar pixels, as parallel arrays of rows and start and end indices into
+        similar flattened with a gap after each row (so runs never join across rows), sorted by row then
+        start, plus where each row's runs begin in them (h + 1 offsets).
+    """
+    h, w = similar.shape
+    padded = numpy.zeros((h, w + 1), dtype=bool)
+    padded[:, :w] = similar
+    flat = padded.reshape(-1)
+    starts = numpy.flatnonzero(flat[1:] & ~flat[:-1]) + 1
+    if flat[0]:
+        starts = numpy.concatenate(([0], starts))
+    ends = numpy.flatnonzero(flat[:-1] & ~flat[1:]) + 1
+    rows = starts // (w + 1)
+    offsets = numpy.searchsorted(rows, numpy.arange(h + 1))
+    return rows, starts, ends, offsets
+
+def scanline_fill(similar, x, y):
+    """ Boolean mask of the 4-connected region of similar (h x w) containing (x, y) and its bounds
+        (x0, y0, x1, y1), or None if (x, y) isn't similar itself. Works on runs rather than pixels: each run is visited once, and the runs it
+        touches in the rows above and below are found by binary search.
+    """
+    h, w = similar.shape
+    if not (0 <= x < w and 0 <= y < h) or not similar[y, x]:
+        return None
+
+    rows, starts, ends, offsets = runs(similar)
+    stride = w + 1
+    row_start = offsets[y]
+    seed = row_start + numpy.searchsorted(starts[row_start:offsets[y + 1]], y * stride + x, side="right") - 1
+
+    visited = numpy.zeros(len(starts), dtype=bool)
+    visited[seed] = True
+    stack = [seed]
+    while stack:
+        r = stack.pop()
+        row = rows[r]
+        for ny in (row - 1, row + 1):
+            if ny < 0 or ny >= h:
+                continue
+            # the same columns in that row
+            shift = (ny - row) * stride
+            s = starts[r] + shift
+            e = ends[r] + shift
+            lo = offsets[ny]
+            hi = offsets[ny + 1]
+            # runs in that row that start before this one ends and end after it starts
+            first = lo + numpy.searchsorted(ends[lo:hi], s, side="right")
+            last = lo + numpy.searchsorted(starts[lo:hi], e, side="left")
+            for n in range(first, last):
+                if not visited[n]:
+                    visited[n] = True
+                    stack.append(n)
+
+    # +1 where each filled run starts and -1 just past its end, summed along the flattened rows
+    filled = numpy.flatnonzero(visited)
+    delta = numpy.zeros(h * stride + 1, dtype=numpy.int8)
+    delta[starts[filled]] = 1
+    delta[ends[filled]] = -1
+    mask = numpy.cumsum(delta[:-1], dtype=numpy.int8).view(bool)
+    bounds = (
+        int((starts[filled] % stride).min()),
+        int(rows[filled].min()),
+        int(((ends[filled] - 1) % stride).max() + 1),
+        int(rows[filled].max() + 1),
+    )
+    return mask.reshape(h, stride)[:, :w], bounds
@@ -0,0 +1,170 @@
+from math import ceil, floor, log2
+
+from OpenGL import GL
+
+from modules.gl.gltypes import load_program, VertexArrayObject, Framebuffer
+from modules.gl.layers import TRANSPARENT
+from modules.trace import tracer
+
+# gaussian sigma as a fraction of the brush radius
+BlurStrength = 0.5
+# smallest kernel, in texels, before dropping to the next mip level
+BlurMinSigma = 2.0
+# canvases keep mip levels 0-3
+BlurMaxLod = 3
+BlurMaxTaps = 64
+
+SmudgeMinPickup = 32
+
+class BlurEngine:
+    """ Separable gaussian blur brush. The dab's region is blurred horizontally into a scratch target,
+        reading a lower canvas mip level for large radii, then vertically while blending under the dab
+        mask, so a dab costs two short 1D kernels instead of a 2D one.
+    """
+    def __init__(self, quad, fmt):
+        self.fmt = fmt
+        self.hprogram = load_program("shaders/screen.vert", "shaders/engines/blur_h.frag")
+        self.vprogram = load_program("shaders/draw/draw.vert", "shaders/engines/blur_v.frag")
+        self.vao = VertexArrayObject(self.hprogram.id, quad["verts"], quad["uvs"])
+        self.scratch = None
+
+    def delete(self):
+        if self.scratch:
+            self.scratch.delete()
+            self.scratch = None
+
+    def begin_stroke(self):
+        pass
+
+    def ensure_scratch(self, width, height):
+        if self.scratch and self.scratch.width >= width and self.scratch.height >= height:
+            return
+        size = 64
+        while size < max(width, height):
+            size *= 2
+        self.delete()
+        self.scratch = Framebuffer(size, size, TRANSPARENT, False, False, self.fmt)
+
+    def kernel(self, radius):
+        sigma = max(radius * BlurStrength, 0.5)
+        lod = 0
+        if sigma > BlurMinSigma:
+            lod = min(int(floor(log2(sigma / BlurMinSigma))), BlurMaxLod)
+        scale = float(1 << lod)
+        sigma /= scale
+        taps = min(int(ceil(sigma * 3.0)), BlurMaxTaps)
+        return lod, scale, sigma, taps
+
+    def dab(self, canvas, vao, uniforms, copy=0):
+        # nothing carries over between dabs, so symmetry copies need nothing of their own
+        rect = canvas.dab_rect(uniforms["radius"], uniforms["mpos"], uniforms.get("selectionrect"))
+        if not rect:
+            return
+
+        lod, scale, sigma, taps = self.kernel(uniforms["radius"])
+        s = int(scale)
+
+        # the region the vertical pass reads: the dab rect plus the kernel above and below
+        x0 = (rect[0] - s) // s * s
+        y0 = (rect[1] - (taps + 1) * s) // s * s
+        x1 = rect[0] + rect[2] + s
+        y1 = rect[1] + rect[3] + (taps + 1) * s
+        w = (x1 - x0 + s - 1) // s
+        h = (y1 - y0 + s - 1) // s
+        self.ensure_scratch(w, h)
+
+        with tracer.span("blur dab", "dabs", {"lod": lod, "taps": taps}):
+            self.scratch.use()
+            GL.glViewport(0, 0, w, h)
+            self.hprogram.use()
+            self.vao.use()
+            self.hprogram.set_uniforms({
+                "basetexture": canvas.front().texture,
+                "origin": (float(x0), float(y0)),
+                "scale": scale,
+                "lod": float(lod),
+                "sigma": sigma,
+                "taps": taps,
+                "sz": float(canvas.size[0]),
+            })
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+
+            values = dict(uniforms)
+            values.update({
+                "blurtexture": self.scratch.texture,
+                "origin": (float(x0), float(y0)),
+                "scale": scale,
+                "blursize": (float(self.scratch.width), float(self.scratch.height)),
+                "sigma": sigma,
+                "taps": taps,
+            })
+            canvas.render(vao, self.vprogram, values)
+
+class SmudgeEngine:
+    """ Smudge brush with a pickup buffer the size of the brush that persists across a stroke. Each dab
+        deposits what the buffer holds, then mixes the canvas under it back in, so the smear depends on
+        dab spacing rather than on how far the pointer moved in a frame. Each symmetry copy of a stroke
+        (dab's copy) has its own buffer, so copies don't smear each other's paint across the axes.
+    """
+    def __init__(self, quad, fmt):
+        self.fmt = fmt
+        self.pickup_program = load_program("shaders/screen.vert", "shaders/engines/smudge_pickup.frag")
+        self.deposit_program = load_program("shaders/draw/draw.vert", "shaders/engines/smudge_deposit.frag")
+        self.vao = VertexArrayObject(self.pickup_program.id, quad["verts"], quad["uvs"])
+        # per copy, a ping-pong pair, since a pickup reads the buffer it updates
+        self.pickups = []
+        self.loaded = []
+
+    def delete(self):
+        for pair in self.pickups:
+            for fb in pair:
+                fb.delete()
+        self.pickups = []
+        self.loaded = []
+
+    def begin_stroke(self):
+        self.loaded = [False] * len(self.loaded)
+
+    def ensure_pickup(self, radius, copy):
+        needed = int(ceil(radius * 2.0 + 4.0))
+        if self.pickups and self.pickups[0][0].width < needed:
+            self.delete()
+        size = self.pickups[0][0].width if self.pickups else SmudgeMinPickup
+        while size < needed:
+            size *= 2
+        while len(self.pickups) <= copy:
+            self.pickups.append([Framebuffer(size, size, TRANSPARENT, False, False, self.fmt) for _ in range(2)])
+            self.loaded.append(False)
+
+    def pickup(self, canvas, mpos, rate, copy):
+        pickups = self.pickups[copy]
+        held, target = pickups
+        target.use()
+        self.pickup_program.use()
+        self.vao.use()
+        self.pickup_program.set_uniforms({
+            "pickuptexture": held.texture,
+            "basetexture": canvas.front().texture,
+            "mpos": mpos,
+            "pickupsize": float(target.width),
+            "rate": rate,
+            "sz": float(canvas.size[0]),
+        })
+        GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+        pickups.reverse()
+
+    def dab(self, canvas, vao, uniforms, copy=0):
+        self.ensure_pickup(uniforms["radius"], copy)
+
+        with tracer.span("smudge dab", "dabs"):
+            if not self.loaded[copy]:
+                self.pickup(canvas, uniforms["mpos"], 1.0, copy)
+                self.loaded[copy] = True
+
+            held = self.pickups[copy][0]
+            values = dict(uniforms)
+            values["pickuptexture"] = held.texture
+            values["pickupsize"] = float(held.width)
+            canvas.render(vao, self.deposit_program, values)
+
+            self.pickup(canvas, uniforms["mpos"], 1.0 - uniforms["smudgelength"], copy)
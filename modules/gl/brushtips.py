@@ -0,0 +1,96 @@
+from ctypes import POINTER, c_ubyte, cast
+
+import numpy
+import sdl2
+from OpenGL import GL
+
+from modules.gl.gltypes import texture_memory
+from modules.trace import tracer
+
+# every tip is resampled to this square; the mip chain covers smaller dabs
+TipSize = 256
+
+def resample(a, size):
+    """ Box filters a 2D array down to size x size (nearest neighbour when enlarging). """
+    for axis in (0, 1):
+        n = a.shape[axis]
+        starts = (numpy.arange(size) * n) // size
+        if n > size:
+            counts = numpy.diff(numpy.append(starts, n))
+            a = numpy.add.reduceat(a, starts, axis=axis)
+            a = a / (counts[:, None] if axis == 0 else counts[None, :])
+        else:
+            a = numpy.take(a, starts, axis=axis)
+    return a
+
+def load_tip_image(path):
+    """ A TipSize x TipSize uint8 mask from an image: its darkness times its alpha, so black on white and
+        black on transparent both work. BMP always loads; other formats need SDL2_image.
+    """
+    try:
+        from sdl2 import sdlimage
+        surface = sdlimage.IMG_Load(path.encode())
+    except (ImportError, RuntimeError):
+        surface = sdl2.SDL_LoadBMP(path.encode())
+    if not surface:
+        print(f"ERROR: Loading brush tip {path} failed: {sdl2.SDL_GetError().decode()}")
+        return None
+
+    converted = sdl2.SDL_ConvertSurfaceFormat(surface, sdl2.SDL_PIXELFORMAT_RGBA32, 0)
+    sdl2.SDL_FreeSurface(surface)
+    s = converted.contents
+    pixels = numpy.ctypeslib.as_array(cast(s.pixels, POINTER(c_ubyte)), shape=(s.h, s.pitch))
+    rgba = pixels[:, :s.w * 4].reshape(s.h, s.w, 4).astype(numpy.float32) / 255.0
+    sdl2.SDL_FreeSurface(converted)
+
+    luma = rgba[..., 0] * 0.2126 + rgba[..., 1] * 0.7152 + rgba[..., 2] * 0.0722
+    mask = resample((1.0 - luma) * rgba[..., 3], TipSize)
+    # images are stored top row first, textures bottom row first
+    return numpy.ascontiguousarray(numpy.clip(mask[::-1] * 255.0 + 0.5, 0, 255).astype(numpy.uint8))
+
+class TipAtlas:
+    """ Every brush tip image in one mipmapped texture array, a layer per tip. Dabs pick a layer by index
+        and a mip level by radius, so a big textured dab reads about as many texels as a small one.
+    """
+    def __init__(self, tips):
+        self.names = []
+        masks = []
+        with tracer.span("load brush tips", "startup", {"tips": len(tips)}):
+            for name, path in tips.items():
+                mask = load_tip_image(path)
+                if mask is not None:
+                    self.names.append(name)
+                    masks.append(mask)
+        if not masks:
+            # the draw shader always samples the atlas, so it needs at least one (empty) layer
+            masks.append(numpy.zeros((TipSize, TipSize), dtype=numpy.uint8))
+        data = numpy.stack(masks)
+
+        self.id = GL.glGenTextures(1)
+        self.use()
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 1 )
+        GL.glTexImage3D( GL.GL_TEXTURE_2D_ARRAY, 0, GL.GL_R8, TipSize, TipSize, len(masks), 0, GL.GL_RED, GL.GL_UNSIGNED_BYTE, data )
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 4 )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR )
+        GL.glGenerateMipmap( GL.GL_TEXTURE_2D_ARRAY )
+
+        # the full chain adds a third
+        self.nbytes = data.nbytes * 4 // 3
+        texture_memory["r8"] += self.nbytes
+        if self.names:
+            print(f"Loaded brush tips: {', '.join(self.names)}")
+
+    def index(self, name):
+        """ The atlas layer for a tip, or -1 for the round procedural tip. """
+        return self.names.index(name) if name in self.names else -1
+
+    def use(self):
+        GL.glBindTexture( GL.GL_TEXTURE_2D_ARRAY, self.id )
+
+    def delete(self):
+        GL.glDeleteTextures( [self.id] )
+        texture_memory["r8"] -= self.nbytes
+        self.nbytes = 0
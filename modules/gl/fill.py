@@ -0,0 +1,213 @@
+from time import perf_counter
+
+import numpy
+from OpenGL import GL
+
+from modules.floodfill import similar_mask, scanline_fill
+from modules.gl.gltypes import load_program, clip_rect, VertexArrayObject, Framebuffer, DualFramebuffer, AsyncReadback
+from modules.gl.layers import TRANSPARENT
+from modules.trace import tracer
+
+# pixels a grow pass can carry the fill along a row or column
+FillReach = 32
+# grow passes (a horizontal and a vertical each) between checks for whether the fill stopped spreading
+FillCheckEvery = 4
+FillMaxPasses = 4096
+
+FILL_METHODS = ("cpu", "gpu")
+
+def clip_bounds(bounds, clip):
+    """ bounds (x0, y0, x1, y1) cut down to clip, or None if they don't meet. """
+    rect = clip_rect((bounds[0], bounds[1], bounds[2] - bounds[0], bounds[3] - bounds[1]), clip)
+    return (rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3]) if rect else None
+
+class FloodFill:
+    """ Paint bucket. The region is everything 4-connected to the seed pixel within a tolerance of its
+        colour, on the active layer or on all layers merged, and is found one of two ways:
+
+        cpu  the reference image is read back through a pixel buffer and filled a run at a time with NumPy
+             (modules/floodfill.py), then the mask is uploaded
+        gpu  an R8 mask is grown from the seed in a DualFramebuffer, each pass carrying it up to FillReach
+             pixels along rows, then columns, over similar pixels, until an occlusion query counts no new
+             ones; nothing is read back but the query results
+
+        Either way the mask ends up in self.masks and one pass paints the brush colour under it.
+    """
+    def __init__(self, quad, fmt):
+        self.fmt = fmt
+        self.grow_program = load_program("shaders/screen.vert", "shaders/fill/grow.frag")
+        self.paint_program = load_program("shaders/screen.vert", "shaders/fill/paint.frag")
+        self.vao = VertexArrayObject(self.grow_program.id, quad["verts"], quad["uvs"])
+        self.masks = None
+        self.merged = None
+        self.readback = None
+        self.query = GL.glGenQueries(1)
+
+    def delete(self):
+        for target in (self.masks, self.merged):
+            if target:
+                target.delete()
+        self.masks = None
+        self.merged = None
+        if self.readback:
+            self.readback.delete()
+            self.readback = None
+        GL.glDeleteQueries(1, [self.query])
+
+    def ensure_targets(self, width, height):
+        if self.masks and self.masks.size == [width, height]:
+            return
+        for target in (self.masks, self.merged):
+            if target:
+                target.delete()
+        self.masks = DualFramebuffer(width, height, TRANSPARENT, False, "r8")
+        self.merged = None
+
+    def reference(self, layers, merged):
+        """ The framebuffer to compare colours in: the active layer, or every layer flattened. """
+        if not merged:
+            return layers.active_layer().canvas.front()
+        width, height = layers.size
+        if not self.merged:
+            self.merged = Framebuffer(width, height, TRANSPARENT, False, False, self.fmt)
+        layers.flatten(self.merged, layers.layers)
+        return self.merged
+
+    def fill(self, layers, x, y, color, opacity, tolerance, merged=False, method="cpu", selection=None):
+        """ Fills from canvas pixel (x, y) on the active layer, only where selection (Selection.uniforms())
+            allows. Returns what was done, for the control socket and benchmarks: the method, grow passes
+            (gpu) and milliseconds, or None if (x, y) is off the canvas.
+        """
+        selection = selection or {"selection": 0}
+        width, height = layers.size
+        x = int(x)
+        y = int(y)
+        if not (0 <= x < width and 0 <= y < height):
+            return None
+        self.ensure_targets(width, height)
+
+        start = perf_counter()
+        with tracer.span("fill", "fill", {"method": method, "merged": merged}):
+            ref = self.reference(layers, merged)
+            if method == "gpu":
+                passes, bounds = self.grow(ref, x, y, tolerance)
+            else:
+                passes = 0
+                bounds = self.scanline(ref, x, y, tolerance)
+            if bounds and "selectionrect" in selection:
+                # the region can reach past the selection, but nothing outside it is painted
+                bounds = clip_bounds(bounds, selection["selectionrect"])
+            if bounds:
+                self.paint(layers.active_layer().canvas, bounds, color, opacity, selection)
+            GL.glFinish()
+        return {"method": method, "passes": passes, "ms": (perf_counter() - start) * 1000.0}
+
+    def scanline(self, ref, x, y, tolerance):
+        width, height = self.masks.size
+        if not self.readback:
+            self.readback = AsyncReadback(width * height * 4)
+        with tracer.span("fill readback", "fill"):
+            self.readback.start(ref, 0, 0, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, 4)
+            pixels = numpy.frombuffer(self.readback.take(), dtype=numpy.uint8).reshape(height, width, 4)
+        with tracer.span("fill scanline", "fill"):
+            similar = similar_mask(pixels, pixels[y, x], tolerance)
+            result = scanline_fill(similar, x, y)
+        if not result:
+            return None
+
+        mask, bounds = result
+        x0, y0, x1, y1 = bounds
+        # just the region's bounds; paint doesn't look outside them
+        region = numpy.ascontiguousarray(mask[y0:y1, x0:x1]).view(numpy.uint8) * numpy.uint8(255)
+        self.masks.front().texture.use()
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 1 )
+        GL.glTexSubImage2D( GL.GL_TEXTURE_2D, 0, x0, y0, x1 - x0, y1 - y0, GL.GL_RED, GL.GL_UNSIGNED_BYTE, region )
+        GL.glPixelStorei( GL.GL_UNPACK_ALIGNMENT, 4 )
+        return bounds
+
+    def grow(self, ref, x, y, tolerance):
+        masks = self.masks
+        width, height = masks.size
+        ref.use()
+        seed = GL.glReadPixels( x, y, 1, 1, GL.GL_RGBA, GL.GL_FLOAT ).flat
+
+        # both masks empty but for the seed
+        for fb in masks.fbs:
+            fb.clear()
+            fb.use()
+            GL.glEnable( GL.GL_SCISSOR_TEST )
+            GL.glScissor( x, y, 1, 1 )
+            GL.glClearColor( 1.0, 1.0, 1.0, 1.0 )
+            GL.glClear( GL.GL_COLOR_BUFFER_BIT )
+            GL.glDisable( GL.GL_SCISSOR_TEST )
+
+        self.grow_program.use()
+        self.vao.use()
+        self.grow_program.set_uniforms({
+            "reftexture": ref.texture,
+            "seedcolor": (seed[0], seed[1], seed[2], seed[3]),
+            "tolerance": tolerance,
+            "reach": FillReach,
+        })
+        mask_location = self.grow_program.location("masktexture")
+        direction_location = self.grow_program.location("direction")
+        # the reference stays on unit 0, the mask being read goes on unit 1
+        GL.glUniform1i( mask_location, 1 )
+        GL.glActiveTexture( GL.GL_TEXTURE1 )
+
+        # nothing can be filled outside this, and it only grows by the reach each pass
+        x0, y0, x1, y1 = x, y, x + 1, y + 1
+        passes = 0
+        GL.glEnable( GL.GL_SCISSOR_TEST )
+        with tracer.span("fill grow", "fill"):
+            while passes < FillMaxPasses:
+                check = passes % FillCheckEvery == FillCheckEvery - 1
+                if check:
+                    GL.glBeginQuery( GL.GL_SAMPLES_PASSED, self.query )
+                for direction in ((1.0, 0.0), (0.0, 1.0)):
+                    if direction[0]:
+                        x0 = max(x0 - FillReach, 0)
+                        x1 = min(x1 + FillReach, width)
+                    else:
+                        y0 = max(y0 - FillReach, 0)
+                        y1 = min(y1 + FillReach, height)
+                    # grow pixels are discarded unless they're newly filled, so the target has to hold the
+                    # current mask too: each pass is copied back, the way dabs are
+                    target = masks.fbs[masks.toggle]
+                    target.use()
+                    masks.front().texture.use()
+                    GL.glUniform2f( direction_location, direction[0], direction[1] )
+                    GL.glScissor( x0, y0, x1 - x0, y1 - y0 )
+                    GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+                    GL.glCopyTexSubImage2D( GL.GL_TEXTURE_2D, 0, x0, y0, x0, y0, x1 - x0, y1 - y0 )
+                    masks.toggle = 1 - masks.toggle
+                passes += 1
+                if check:
+                    GL.glEndQuery( GL.GL_SAMPLES_PASSED )
+                    if GL.glGetQueryObjectuiv( self.query, GL.GL_QUERY_RESULT ) == 0:
+                        break
+        GL.glDisable( GL.GL_SCISSOR_TEST )
+        GL.glActiveTexture( GL.GL_TEXTURE0 )
+        if passes >= FillMaxPasses:
+            # long winding regions take a pass per FillReach pixels of their length
+            print(f"Fill stopped spreading after {passes} passes; the cpu method handles winding regions better")
+        return passes, (x0, y0, x1, y1)
+
+    def paint(self, canvas, bounds, color, opacity, selection):
+        x0, y0, x1, y1 = bounds
+        self.paint_program.use()
+        self.vao.use()
+        canvas.fbs[canvas.toggle].use()
+        uniforms = {
+            "basetexture": canvas.front().texture,
+            "masktexture": self.masks.front().texture,
+            "brushcolor": color,
+            "opacity": opacity,
+        }
+        uniforms.update(selection)
+        self.paint_program.set_uniforms(uniforms)
+        GL.glEnable( GL.GL_SCISSOR_TEST )
+        GL.glScissor( x0, y0, x1 - x0, y1 - y0 )
+        GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+        GL.glDisable( GL.GL_SCISSOR_TEST )
+        canvas.commit_back((x0, y0, x1 - x0, y1 - y0))
@@ -0,0 +1,290 @@
+from math import ceil, log2
+
+from OpenGL import GL
+
+from modules.gl.gltypes import load_program, VertexArrayObject, Framebuffer
+from modules.gl.layers import TRANSPARENT
+from modules.trace import tracer
+
+# canvas pixels per tile when a filter is applied at full resolution
+FilterTileSize = 1024
+# scratch targets grow in steps of this many pixels
+FilterScratchStep = 256
+# canvases keep mip levels 0-3
+FilterMaxLod = 3
+# blurs run on coarser levels while their sigma is still at least this many texels there
+FilterBlurTexels = 4.0
+
+class FilterPass:
+    """ One fragment shader in shaders/filters. reach is how far (canvas pixels, across and up) the pass
+        reads around each pixel it writes, given the filter's values, so tiles can be drawn with enough
+        margin. scale, given the values and the scale the filter is drawn at, is the scale (canvas pixels
+        per texel) the pass runs at, which can be coarser for a pass whose result is smooth anyway.
+    """
+    def __init__(self, shader, reach=None, scale=None):
+        self.shader = shader
+        self.reach = reach if reach else lambda values: (0.0, 0.0)
+        self.scale = scale if scale else lambda values, scale: scale
+
+class Filter:
+    """ A chain of passes, each reading the previous one's output (the first reads the canvas), and the
+        values they take as uniforms: name -> (default, min, max).
+    """
+    def __init__(self, label, passes, params):
+        self.label = label
+        self.passes = passes
+        self.params = params
+
+    def defaults(self):
+        return dict((name, param[0]) for name, param in self.params.items())
+
+def gaussian_reach_h(values):
+    return values["radius"] * 3.0, 0.0
+
+def gaussian_reach_v(values):
+    return 0.0, values["radius"] * 3.0
+
+def gaussian_scale(values, scale):
+    """ Halves the resolution, down the canvas's mip levels, for as long as the blur stays FilterBlurTexels
+        wide, so a wide blur takes a couple of dozen taps over a fraction of the pixels instead of hundreds
+        over all of them, and never more than the shaders' 64.
+    """
+    while scale * 2.0 <= 2.0 ** FilterMaxLod and values["radius"] / (scale * 2.0) >= FilterBlurTexels:
+        scale *= 2.0
+    return scale
+
+FILTERS = {
+    "blur": Filter("Gaussian Blur",
+        [FilterPass("blur_h", gaussian_reach_h, gaussian_scale), FilterPass("blur_v", gaussian_reach_v, gaussian_scale)],
+        {"radius": (4.0, 0.5, 64.0)}),
+    "sharpen": Filter("Sharpen",
+        [FilterPass("blur_h", gaussian_reach_h, gaussian_scale), FilterPass("blur_v", gaussian_reach_v, gaussian_scale),
+            FilterPass("sharpen")],
+        {"radius": (2.0, 0.5, 16.0), "amount": (1.0, 0.0, 4.0)}),
+    "levels": Filter("Levels",
+        [FilterPass("levels")],
+        {"black": (0.0, 0.0, 1.0), "white": (1.0, 0.0, 1.0), "gamma": (1.0, 0.1, 5.0)}),
+    "hue": Filter("Hue/Saturation",
+        [FilterPass("hue")],
+        {"hue": (0.0, -180.0, 180.0), "saturation": (1.0, 0.0, 2.0), "lightness": (0.0, -1.0, 1.0)}),
+}
+
+# added after a filter's own passes while something is selected, to keep the canvas outside the selection
+SelectPass = FilterPass("select")
+# added when a filter's last pass ran coarser than it's drawn, to bring it back up
+ResamplePass = FilterPass("resample")
+
+class FilterPipeline:
+    """ Runs a filter's passes over the active canvas. Passes in between go to a pair of scratch targets;
+        the last writes straight into the canvas's back framebuffer, one tile at a time with enough margin
+        for the passes' reach, and the pair is swapped once every tile is done. While values are being
+        changed the filter can instead be previewed over the visible part of the canvas at view resolution,
+        drawn in place of the canvas when the view is composited. While something is selected, tiles
+        outside the selection are skipped and a last pass puts back the canvas outside it.
+    """
+    def __init__(self, quad, fmt):
+        self.fmt = fmt
+        self.quad = quad
+        self.vao = None
+        self.scratch = []
+
+        # what the Filters window is set to
+        self.current = "blur"
+        self.values = dict((name, f.defaults()) for name, f in FILTERS.items())
+        self.previewing = False
+
+        self.preview = None
+        # canvas uv rect (x0, y0, x1, y1) the preview covers, and the fraction of its texture that's used
+        self.preview_rect = None
+        self.preview_extent = (1.0, 1.0)
+        self.preview_key = None
+
+    def delete(self):
+        for fb in self.scratch:
+            fb.delete()
+        self.scratch = []
+        if self.preview:
+            self.preview.delete()
+            self.preview = None
+        self.preview_key = None
+
+    def program(self, shader):
+        program = load_program("shaders/screen.vert", f"shaders/filters/{shader}.frag")
+        if not self.vao:
+            self.vao = VertexArrayObject(program.id, self.quad["verts"], self.quad["uvs"])
+        return program
+
+    def ensure_scratch(self, width, height):
+        if self.scratch and self.scratch[0].width >= width and self.scratch[0].height >= height:
+            return
+        step = FilterScratchStep
+        width = (max(width, self.scratch[0].width if self.scratch else 0) + step - 1) // step * step
+        height = (max(height, self.scratch[0].height if self.scratch else 0) + step - 1) // step * step
+        for fb in self.scratch:
+            fb.delete()
+        self.scratch = [Framebuffer(width, height, TRANSPARENT, False, False, self.fmt) for _ in range(2)]
+
+    def ensure_preview(self, width, height):
+        if self.preview and self.preview.width >= width and self.preview.height >= height:
+            return
+        if self.preview:
+            width = max(width, self.preview.width)
+            height = max(height, self.preview.height)
+            self.preview.delete()
+        self.preview = Framebuffer(width, height, TRANSPARENT, False, False, self.fmt)
+
+    def draw(self, name, values, canvas, rect, scale, target=None, selection=None):
+        """ Runs the filter for the canvas region rect (x0, y0, x1, y1) at scale canvas pixels per output
+            pixel. The last pass goes to the same region of the canvas's back framebuffer, or with a target,
+            to that framebuffer with rect's corner at its pixel (0, 0). selection is Selection.uniforms().
+        """
+        f = FILTERS[name]
+        # each pass with the scale it runs at
+        passes = [(p, p.scale(values, scale)) for p in f.passes]
+        if selection and selection["selection"]:
+            passes.append((SelectPass, scale))
+        if passes[-1][1] != scale:
+            passes.append((ResamplePass, scale))
+        width, height = canvas.size
+        source = canvas.front().texture
+
+        common = dict(values)
+        common.update({
+            "sourcetexture": source,
+            "sourcelod": min(max(log2(scale), 0.0), FilterMaxLod),
+            "sz": (float(width), float(height)),
+        })
+        if selection:
+            common.update(selection)
+        # the first pass reads the canvas at the level of detail it runs at
+        inputs = {
+            "inputtexture": source,
+            "inputorigin": (0.0, 0.0),
+            "inputscale": (1.0 / width, 1.0 / height),
+            "inputlod": min(max(log2(passes[0][1]), 0.0), FilterMaxLod),
+        }
+
+        # how far past rect (across, up) each pass has to write for the passes after it to have what they
+        # read, and a texel more for the filtering when they read it
+        margins = []
+        mx = my = 0.0
+        for p, pass_scale in reversed(passes):
+            margins.append((mx + pass_scale, my + pass_scale))
+            rx, ry = p.reach(values)
+            mx += rx
+            my += ry
+        margins.reverse()
+
+        for i, (p, pass_scale) in enumerate(passes):
+            program = self.program(p.shader)
+            program.use()
+            self.vao.use()
+            uniforms = dict(common)
+            uniforms.update(inputs)
+            uniforms["scale"] = pass_scale
+
+            if i == len(passes) - 1:
+                if target:
+                    target.use()
+                    GL.glViewport(0, 0, int(ceil((rect[2] - rect[0]) / scale)), int(ceil((rect[3] - rect[1]) / scale)))
+                    uniforms["origin"] = (float(rect[0]), float(rect[1]))
+                else:
+                    canvas.fbs[canvas.toggle].use()
+                    uniforms["origin"] = (0.0, 0.0)
+                    GL.glScissor( int(rect[0]), int(rect[1]), int(rect[2] - rect[0]), int(rect[3] - rect[1]) )
+                    GL.glEnable( GL.GL_SCISSOR_TEST )
+                program.set_uniforms(uniforms)
+                GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+                GL.glDisable( GL.GL_SCISSOR_TEST )
+                break
+
+            mx, my = margins[i]
+            x0 = max(rect[0] - mx, 0.0)
+            y0 = max(rect[1] - my, 0.0)
+            x1 = min(rect[2] + mx, width)
+            y1 = min(rect[3] + my, height)
+            w = int(ceil((x1 - x0) / pass_scale))
+            h = int(ceil((y1 - y0) / pass_scale))
+            self.ensure_scratch(w, h)
+            fb = self.scratch[i % 2]
+            fb.use()
+            GL.glViewport(0, 0, w, h)
+
+            uniforms["origin"] = (x0, y0)
+            program.set_uniforms(uniforms)
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+
+            inputs = {
+                "inputtexture": fb.texture,
+                "inputorigin": (x0, y0),
+                "inputscale": (1.0 / (pass_scale * fb.width), 1.0 / (pass_scale * fb.height)),
+                "inputlod": 0.0,
+            }
+
+    def apply(self, canvas, name, values, selection=None):
+        """ Runs the filter over the whole canvas at full resolution, or just what selection (a Selection)
+            covers if something is selected.
+        """
+        width, height = canvas.size
+        uniforms = selection.uniforms() if selection else None
+        tiles = []
+        for y in range(0, height, FilterTileSize):
+            for x in range(0, width, FilterTileSize):
+                tile = (x, y, min(FilterTileSize, width - x), min(FilterTileSize, height - y))
+                if selection:
+                    tile = selection.clip(tile)
+                if tile:
+                    tiles.append((tile[0], tile[1], tile[0] + tile[2], tile[1] + tile[3]))
+        with tracer.span("apply filter", "filters", {"filter": name, "tiles": len(tiles)}):
+            for rect in tiles:
+                self.draw(name, values, canvas, rect, 1.0, None, uniforms)
+            if selection and selection.bounds:
+                x0, y0, x1, y1 = selection.bounds
+                canvas.commit_back((x0, y0, x1 - x0, y1 - y0))
+            else:
+                canvas.commit_back()
+        self.preview_key = None
+        print(f"Applied {FILTERS[name].label}")
+
+    def update_preview(self, canvas, visible, scale, selection=None):
+        """ Redraws the preview of the current filter if anything it depends on changed. visible is the
+            canvas rect (x0, y0, x1, y1) in view, scale how many canvas pixels fall on a window pixel,
+            selection the Selection it's limited to.
+        """
+        width, height = canvas.size
+        scale = max(scale, 1.0)
+        x0 = min(max(int(visible[0] / scale) * scale, 0.0), width)
+        y0 = min(max(int(visible[1] / scale) * scale, 0.0), height)
+        x1 = min(max(visible[2], 0.0), width)
+        y1 = min(max(visible[3], 0.0), height)
+        w = int(ceil((x1 - x0) / scale))
+        h = int(ceil((y1 - y0) / scale))
+        if w < 1 or h < 1:
+            self.preview_rect = None
+            return
+
+        values = self.values[self.current]
+        key = (self.current, tuple(sorted(values.items())), id(canvas), canvas.version, x0, y0, w, h, scale,
+            selection.version if selection else None)
+        if key == self.preview_key:
+            return
+        self.preview_key = key
+
+        self.ensure_preview(w, h)
+        # the rect is widened to whole preview pixels; anything past the canvas edge is clamped in the shaders
+        rect = (x0, y0, x0 + w * scale, y0 + h * scale)
+        with tracer.span("preview filter", "filters", {"filter": self.current, "size": [w, h]}):
+            self.draw(self.current, values, canvas, rect, scale, self.preview,
+                selection.uniforms() if selection else None)
+        self.preview_rect = (rect[0] / width, rect[1] / height, rect[2] / width, rect[3] / height)
+        self.preview_extent = (w / self.preview.width, h / self.preview.height)
+
+    def preview_uniforms(self):
+        if not self.previewing or not self.preview_rect:
+            return {"preview": 0}
+        return {
+            "preview": 1,
+            "previewtexture": self.preview.texture,
+            "previewrect": self.preview_rect,
+            "previewextent": self.preview_extent,
+        }
@@ -1,13 +1,21 @@
 from math import sqrt
 from ctypes import c_int
 
-import OpenGL
-OpenGL.ERROR_CHECKING = False
 from OpenGL import GL
 from OpenGL.GL import shaders
 
-from modules.math import mat4_ortho, mat4_mul, mat4_identity, mat4_translate, mat4_rotate_z_at_point, mat4_scale_at_point, mat4_flip_horizontal_at_point
-from modules.gl.gltypes import Program, RenderTarget, DualFramebuffer
+from modules.math import mat4_ortho, mat4_mul, mat4_identity, mat4_translate, mat4_rotate_z_at_point, mat4_scale_at_point, mat4_flip_horizontal_at_point, vec2f_mat4_mul_inverse
+import numpy
+
+from modules.gl.gltypes import Program, RenderTarget, VertexArrayObject, AsyncReadback, load_program, memory_report
+from modules.gl.layers import LayerStack
+from modules.gl.brushengines import BlurEngine, SmudgeEngine
+from modules.gl.brushtips import TipAtlas
+from modules.gl.filters import FilterPipeline, FILTERS
+from modules.gl.fill import FloodFill, FILL_METHODS
+from modules.gl.selection import Selection
+from modules.gl.transform import RegionTransform
+from modules.document import Document
 
 DEFAULT_CANVAS = {
     "verts": [
@@ -39,8 +47,64 @@ DEFAULT_SCREENQUAD = {
     ]
 }
 
+# what the first frame draws with; everything else is compiled once it's on screen
+FIRST_FRAME_PROGRAMS = (
+    ("shaders/screen.vert", "shaders/layers/flatten.frag"),
+    ("shaders/canvas.vert", "shaders/canvas.frag"),
+    ("shaders/overlay/cursor.vert", "shaders/overlay/cursor.frag"),
+)
+
+# picks in flight at once; results arrive a frame or two after they're requested
+ColorPickReadbacks = 2
+ColorPickMaxSize = 64
+
+class ColorPicker:
+    def __init__(self):
+        self.readbacks = [AsyncReadback(16) for _ in range(ColorPickReadbacks)]
+        self.index = 0
+
+    def request(self, fb, x, y, size, circle):
+        readback = self.readbacks[self.index]
+        if readback.busy():
+            return
+
+        size = int(min(max(size, 1), ColorPickMaxSize))
+        x0 = int(min(max(x - size // 2, 0), fb.width - 1))
+        y0 = int(min(max(y - size // 2, 0), fb.height - 1))
+        w = int(min(size, fb.width - x0))
+        h = int(min(size, fb.height - y0))
+
+        readback.start(fb, x0, y0, w, h, GL.GL_RGBA, GL.GL_FLOAT, 16, (x - x0, y - y0, size * 0.5, circle))
+        self.index = (self.index + 1) % len(self.readbacks)
+
+    def poll(self, wait=False):
+        """ Returns the newest finished pick, or None. With wait, blocks on anything still in flight. """
+        color = None
+        for i in range(len(self.readbacks)):
+            # oldest first, so a newer result overrides an older one
+            readback = self.readbacks[(self.index + i) % len(self.readbacks)]
+            if readback.busy() and (wait or readback.ready()):
+                color = self.average(readback)
+        return color
+
+    def average(self, readback):
+        _, _, w, h = readback.region
+        cx, cy, radius, circle = readback.tag
+        pixels = numpy.frombuffer(readback.take(), dtype=numpy.float32).reshape(h, w, 4)
+        if circle:
+            ys, xs = numpy.ogrid[0:h, 0:w]
+            inside = (xs + 0.5 - cx) ** 2 + (ys + 0.5 - cy) ** 2 <= radius * radius
+            if inside.any():
+                pixels = pixels[inside]
+        color = pixels.reshape(-1, 4).mean(axis=0)
+        return (float(color[0]), float(color[1]), float(color[2]), float(color[3]))
+
+    def delete(self):
+        for readback in self.readbacks:
+            readback.delete()
+
 class Renderer:
-    def __init__(self, window_size, canvas_size, input_state):
+    def __init__(self, window_size, canvas_size, input_state, canvas_format="rgba16", view_format="rgba16"):
         self.window_size = window_size
         self.input_state = input_state
 
@@ -51,7 +115,7 @@ class Renderer:
 
         self.system_framebuffer_id = GL.glGetIntegerv( GL.GL_FRAMEBUFFER_BINDING )
 
-        self.canvas = DualFramebuffer(canvas_size, canvas_size, (0.5, 0.5, 0.5, 1.0), True)
+        self.layers = LayerStack(canvas_size, canvas_size, (0.5, 0.5, 0.5, 1.0), DEFAULT_SCREENQUAD, canvas_format)
 
         self.view = RenderTarget(
             {
@@ -64,17 +128,20 @@ class Renderer:
                 "width": self.window_size[0],
                 "height": self.window_size[0],
                 "color": (0.4, 0.4, 0.4, 1),
-                "generate mipmaps": False
+                "generate mipmaps": False,
+                "format": view_format,
             }
         )
         self.view_transform = mat4_identity()
         self.view_scale_amount = 1.0
         self.view_reset()
+        # what the view was last composited from; it's only redrawn when this changes
+        self.view_key = None
 
         self.screen = RenderTarget(
             {
-                "vertex shader path": "shaders/screen.vert",
-                "fragment shader path": "shaders/screen.frag",
+                "vertex shader path": "shaders/overlay/cursor.vert",
+                "fragment shader path": "shaders/overlay/cursor.frag",
             }, {
                 "vertices": DEFAULT_SCREENQUAD["verts"],
                 "uvs": DEFAULT_SCREENQUAD["uvs"],
@@ -88,11 +155,232 @@ class Renderer:
         )
         self.screen.fb.id = self.system_framebuffer_id
 
+        self.document = None
+        self.document_path = "canvas.fpd"
+
+        self.picker = ColorPicker()
+
+        self.canvas_format = canvas_format
+        self.engines = {}
+        self.tips = None
+        self.filters = None
+        self.floodfill = None
+        self.selection = None
+        self.transform = None
+
+        # predicted dabs (canvas positions) and their uniforms, drawn over the window for one frame only
+        self.prediction = None
+        self.overlay_program = None
+        self.overlay_vao = None
+        # the quad every dab is drawn with; the screen target's is the cursor's, built for its own shader
+        self.dab_vao = None
+
+        for line in memory_report():
+            print(f"Texture memory {line}")
+
+    def load_engines(self):
+        # brushes that need more than a single pass of a shader in shaders/draw
+        self.engines = {
+            "blur": BlurEngine(DEFAULT_SCREENQUAD, self.canvas_format),
+            "smudge": SmudgeEngine(DEFAULT_SCREENQUAD, self.canvas_format),
+        }
+        self.overlay_program = load_program("shaders/overlay/dab.vert", "shaders/overlay/dab.frag")
+        self.overlay_vao = VertexArrayObject(self.overlay_program.id, DEFAULT_SCREENQUAD["verts"], DEFAULT_SCREENQUAD["uvs"])
+        dab_program = load_program("shaders/draw/draw.vert", "shaders/draw/draw.frag")
+        self.dab_vao = VertexArrayObject(dab_program.id, DEFAULT_SCREENQUAD["verts"], DEFAULT_SCREENQUAD["uvs"])
+        self.filters = FilterPipeline(DEFAULT_SCREENQUAD, self.canvas_format)
+        self.floodfill = FloodFill(DEFAULT_SCREENQUAD, self.canvas_format)
+        self.selection = Selection(DEFAULT_SCREENQUAD)
+        self.transform = RegionTransform(DEFAULT_SCREENQUAD, self.canvas_format)
+
+    def load_tips(self, tips):
+        if self.tips:
+            self.tips.delete()
+        self.tips = TipAtlas(tips)
+
+    @property
+    def canvas(self):
+        # dabs always go to the active layer
+        return self.layers.active_layer().canvas
+
+    def update_canvas_size(self, width, height):
+        verts = DEFAULT_CANVAS["verts"]
+        scaled = []
+        for i in range(0, len(verts), 3):
+            scaled.extend((verts[i] * width, verts[i+1] * height, verts[i+2]))
+        self.view.vao = VertexArrayObject(self.view.program.id, scaled, DEFAULT_CANVAS["uvs"])
+        self.view_reset()
+
+    def add_layer(self):
+        self.layers.add_layer()
+
+    def remove_layer(self):
+        if self.transform and self.transform.canvas is self.canvas:
+            self.transform.discard()
+        self.layers.remove_layer()
+
+    def select_layer(self, index):
+        self.layers.set_active(index)
+
+    def visible_canvas_rect(self):
+        corners = (
+            (0, 0),
+            (self.window_size[0], 0),
+            (0, self.window_size[1]),
+            (self.window_size[0], self.window_size[1]),
+        )
+        points = [vec2f_mat4_mul_inverse(self.view_transform, c) for c in corners]
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        return (min(xs), min(ys), max(xs), max(ys))
+
+    def page_in(self, rect=None, layer=None):
+        """ Pages in what the open document still has on disk under rect (x0, y0, x1, y1 in canvas pixels,
+            default all of it) on layer (default every layer), before something draws or reads there.
+        """
+        if self.document and self.document.pending:
+            self.document.upload_visible(self.layers, rect, 0, layer)
+
+    def save_document(self, path):
+        if not self.document or self.document.path != path or not self.document.matches(self.layers):
+            if self.document:
+                # the whole file is about to be rewritten, so anything not paged in yet has to be first
+                self.document.upload_visible(self.layers, None, 0)
+                self.document.detach(self.layers)
+                self.document.close()
+            self.document = Document(path)
+            self.document.create(self.layers)
+            self.document.attach(self.layers)
+            for tracker in self.document.dirty.values():
+                tracker.mark_all()
+        self.document.save(self.layers)
+
+    def open_document(self, path):
+        document = Document(path)
+        if not document.open():
+            return False
+        if document.width != document.height:
+            print(f"ERROR: {path} is not square; only square canvases are supported.")
+            document.close()
+            return False
+
+        if self.document:
+            self.document.detach(self.layers)
+            self.document.close()
+        self.document = document
+
+        resized = self.layers.size != [document.width, document.height]
+        if self.transform:
+            self.transform.discard()
+        self.layers.reset(document.width, document.height, document.layer_count)
+        for layer, (opacity, visible, blend_mode, name) in zip(self.layers.layers, document.layer_records):
+            layer.opacity = opacity
+            layer.visible = visible
+            layer.blend_mode = blend_mode
+            layer.name = name
+        self.layers.invalidate()
+        if self.selection:
+            self.selection.clear()
+        if resized:
+            self.update_canvas_size(document.width, document.height)
+
+        document.attach(self.layers)
+        document.mark_pending(self.layers)
+
+        # what's on screen is paged in now, the rest as it scrolls into view
+        document.upload_visible(self.layers, self.visible_canvas_rect(), 0)
+        print(f"Opened {path}")
+        return True
+
+    def apply_filter(self, name=None):
+        """ Runs a filter (default the one in the Filters window) over the active layer, with the values
+            the Filters window has for it, and ends the preview.
+        """
+        if not self.filters:
+            return
+        name = name or self.filters.current
+        if name not in FILTERS:
+            print(f"Unknown filter: {name}")
+            return
+        # a filter reads around every pixel it writes, so the whole layer
+        self.page_in(None, self.layers.active_layer())
+        self.filters.apply(self.canvas, name, self.filters.values[name], self.selection)
+        self.filters.previewing = False
+
+    def fill(self, x, y, brush, tolerance=None, merged=None, method=None):
+        """ Paint bucket at canvas pixel (x, y) with the brush colour and opacity; the other options
+            default to the brush's fill settings. Returns FloodFill.fill's result.
+        """
+        if not self.floodfill:
+            return None
+        method = method or brush.fill_method
+        if method not in FILL_METHODS:
+            print(f"Unknown fill method: {method}")
+            return None
+        merged = brush.fill_merged if merged is None else merged
+        # the fill can reach anywhere on the layer, and merged it reads every layer
+        self.page_in(None, None if merged else self.layers.active_layer())
+        return self.floodfill.fill(self.layers, x, y, brush.color, brush.opacity,
+            brush.fill_tolerance if tolerance is None else tolerance, merged, method, self.selection_uniforms())
+
+    def transform_begin(self):
+        """ Lifts the selection (or the whole active layer) to transform it, unless that's already
+            happening. Returns whether there's a transform to change.
+        """
+        if not self.transform:
+            return False
+        if self.transform.active():
+            return True
+        active = self.selection and self.selection.active()
+        self.page_in(self.selection.bounds if active else None, self.layers.active_layer())
+        return self.transform.lift(self.canvas, self.selection)
+
+    def transform_apply(self):
+        if not self.transform or not self.transform.active():
+            return
+        # where the region is about to be put down
+        rect = self.transform.bounds()
+        layer = next((layer for layer in self.layers.layers if layer.canvas is self.transform.canvas), None)
+        if rect and layer:
+            self.page_in((rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3]), layer)
+        self.transform.apply()
+        # what was selected has moved
+        if self.selection:
+            self.selection.clear()
+
+    def transform_cancel(self):
+        # it goes back where it was lifted from, which was paged in to lift it
+        if self.transform:
+            self.transform.cancel()
+
+    def selection_uniforms(self):
+        return self.selection.uniforms() if self.selection else {"selection": 0}
+
+    def invalidate_view(self):
+        self.view_key = None
+        if self.filters:
+            self.filters.preview_key = None
+
+    def current_view_key(self):
+        canvas = self.canvas
+        return (
+            tuple(tuple(row) for row in self.view_transform),
+            tuple(self.window_size),
+            self.layers.version,
+            self.layers.generation,
+            id(canvas),
+            canvas.version,
+            self.filters.preview_key if self.filters and self.filters.previewing else None,
+            self.selection.version if self.selection else None,
+            self.transform.version if self.transform else None,
+        )
+
     def view_reset(self):
         self.view_flipped = False
         self.view_transform = mat4_identity()
-        hz = self.canvas.fbs[0].width * 0.5
-        mat4_translate(self.view_transform, self.window_size[0] * 0.5 - hz, self.window_size[1] * 0.5 - hz, 0)
+        hx = self.canvas.fbs[0].width * 0.5
+        hy = self.canvas.fbs[0].height * 0.5
+        mat4_translate(self.view_transform, self.window_size[0] * 0.5 - hx, self.window_size[1] * 0.5 - hy, 0)
         self.view_scale_amount = 1.0
 
     def view_translate(self, x, y):
@@ -111,12 +399,26 @@ class Renderer:
         mat4_flip_horizontal_at_point(self.view_transform, x)
 
     def close(self):
-        pass
+        self.picker.delete()
+        for engine in self.engines.values():
+            engine.delete()
+        if self.tips:
+            self.tips.delete()
+        if self.filters:
+            self.filters.delete()
+        if self.floodfill:
+            self.floodfill.delete()
+        if self.selection:
+            self.selection.delete()
+        if self.transform:
+            self.transform.delete()
+        if self.document:
+            self.document.close()
+        self.layers.delete()
 
     def resize_window(self, window_size):
         self.window_size = window_size
-        GL.glBindTexture( GL.GL_TEXTURE_2D, self.view.fb.texture.id )
-        GL.glTexImage2D( GL.GL_TEXTURE_2D, 0, GL.GL_RGB16, self.window_size[0], self.window_size[1], 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, None)
+        self.view.fb.texture.resize(self.window_size[0], self.window_size[1])
         self.ortho_matrix = mat4_ortho(self.window_size[0], self.window_size[1])
         self.screen.fb.width = window_size[0]
         self.screen.fb.height = window_size[1]
@@ -125,20 +427,73 @@ class Renderer:
         self.view_reset()
 
     def render(self):
+        if self.document and self.document.pending:
+            self.document.upload_visible(self.layers, self.visible_canvas_rect())
+
+        self.layers.update()
+
         self.view_transform_screen = mat4_mul(self.view_transform, self.ortho_matrix)
         
-        self.view.render({
-            "basetexture": self.canvas.fbs[0].texture if self.canvas.toggle else self.canvas.fbs[1].texture,
-            "transform": self.view_transform_screen
-        })
+        if self.filters and self.filters.previewing:
+            self.filters.update_preview(self.canvas, self.visible_canvas_rect(), 1.0 / self.view_scale_amount,
+                self.selection)
+
+        key = self.current_view_key()
+        if key != self.view_key:
+            uniforms = self.layers.composite_uniforms()
+            uniforms.update(self.filters.preview_uniforms() if self.filters else {"preview": 0})
+            uniforms.update(self.selection_uniforms())
+            uniforms.update(self.transform.uniforms(self.canvas) if self.transform else {"floating": 0})
+            if self.layers.blended:
+                uniforms.update(self.layers.merge(self.view.program, self.view.vao, uniforms))
+            uniforms["transform"] = self.view_transform_screen
+            self.view.render(uniforms)
+            self.view_key = key
+
+        # the window gets a plain copy of the view, then the overlays that change every frame
+        w, h = self.window_size
+        GL.glBindFramebuffer( GL.GL_READ_FRAMEBUFFER, self.view.fb.id )
+        GL.glBindFramebuffer( GL.GL_DRAW_FRAMEBUFFER, self.screen.fb.id )
+        GL.glBlitFramebuffer( 0, 0, w, h, 0, 0, w, h, GL.GL_COLOR_BUFFER_BIT, GL.GL_NEAREST )
+        self.screen.fb.use()
 
-        self.screen.render({
+        self.render_prediction()
+        self.render_cursor()
+
+    def render_cursor(self):
+        diam = max(self.input_state.brush.size * self.view_scale_amount, 1.0)
+        self.screen.program.use()
+        self.screen.vao.use()
+        self.screen.program.set_uniforms({
             "brushcolor": self.input_state.brush.color,
             "opacity": self.input_state.brush.opacity,
-            "diam": max(self.input_state.brush.size * self.view_scale_amount, 1.0),
-            "mpos": (self.input_state.mpos[0] / self.window_size[0], self.input_state.mpos[1] / self.window_size[1]),
+            "diam": diam,
+            "mpos": self.input_state.mpos,
             "winsize": (self.window_size[0], self.window_size[1]),
-            "basetexture": self.view.fb.texture,
             "showcolor": 1 if self.input_state.brush.showcolor else 0,
             "softness": self.input_state.brush.softness,
         })
+        GL.glEnable( GL.GL_BLEND )
+        GL.glBlendFunc( GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA )
+        GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+        GL.glDisable( GL.GL_BLEND )
+
+    def render_prediction(self):
+        if not self.prediction or not self.overlay_program:
+            return
+        dabs, uniforms = self.prediction
+        # replaced by the real dabs next frame
+        self.prediction = None
+
+        self.screen.fb.use()
+        self.overlay_program.use()
+        self.overlay_vao.use()
+        GL.glEnable( GL.GL_BLEND )
+        GL.glBlendFunc( GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA )
+        values = dict(uniforms)
+        values["transform"] = self.view_transform_screen
+        for xy in dabs:
+            values["mpos"] = xy
+            self.overlay_program.set_uniforms(values)
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+        GL.glDisable( GL.GL_BLEND )
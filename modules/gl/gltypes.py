@@ -1,10 +1,14 @@
-from ctypes import byref, c_int
-from os.path import isfile
+from ctypes import byref, c_int, c_void_p, string_at
+from os.path import isfile, normpath
+from time import perf_counter
 
 from OpenGL import GL
 from OpenGL.GL import shaders
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as glReadPixelsRaw
 from numpy import array, float32
 
+from modules.trace import tracer
+
 FRAMEBUFFER_STATUS = {
     "GL_FRAMEBUFFER_COMPLETE": GL.GL_FRAMEBUFFER_COMPLETE,
     "GL_FRAMEBUFFER_UNDEFINED": GL.GL_FRAMEBUFFER_UNDEFINED,
@@ -30,13 +34,83 @@ class Shader:
 
         self.id = shaders.compileShader(self.source, GL.GL_FRAGMENT_SHADER if isfrag else GL.GL_VERTEX_SHADER)
 
+# every program by (vertex path, fragment path), so a shader file change can find what to rebuild
+programs = {}
+# "vertex + fragment" -> message, for programs whose last reload failed
+program_errors = {}
+
+# fixed, so VAOs built against one program work with every program and across reloads
+ATTRIB_LOCATIONS = {"v_pos": 0, "v_uv": 1}
+
+def load_program(v_fpath, f_fpath):
+    key = (normpath(v_fpath), normpath(f_fpath))
+    if key not in programs:
+        programs[key] = Program(v_fpath, f_fpath)
+    return programs[key]
+
+def reload_programs(paths):
+    """ Rebuilds every program using one of the changed shader files. """
+    paths = set(normpath(p) for p in paths)
+    reloaded = []
+    for key, program in list(programs.items()):
+        if key[0] in paths or key[1] in paths:
+            start = perf_counter()
+            if program.reload():
+                print(f"Reloaded {program.name()} in {(perf_counter() - start) * 1000.0:.1f} ms")
+                reloaded.append(program)
+    return reloaded
+
 class Program:
     def __init__(self, v_fpath, f_fpath):
-        self.vertex_shader = Shader(v_fpath)
-        self.fragment_shader = Shader(f_fpath)
-
-        self.id = shaders.compileProgram(self.vertex_shader.id, self.fragment_shader.id)
-
+        self.v_fpath = v_fpath
+        self.f_fpath = f_fpath
+        self.id = self.compile()
+        self.read_uniforms()
+
+    def name(self):
+        return f"{self.v_fpath} + {self.f_fpath}"
+
+    def compile(self):
+        tracer.begin("compile program", "shader", {"vertex": self.v_fpath, "fragment": self.f_fpath})
+        try:
+            self.vertex_shader = Shader(self.v_fpath)
+            self.fragment_shader = Shader(self.f_fpath)
+
+            program_id = GL.glCreateProgram()
+            GL.glAttachShader(program_id, self.vertex_shader.id)
+            GL.glAttachShader(program_id, self.fragment_shader.id)
+            for attrib, location in ATTRIB_LOCATIONS.items():
+                GL.glBindAttribLocation(program_id, location, attrib)
+            GL.glLinkProgram(program_id)
+            GL.glDeleteShader(self.vertex_shader.id)
+            GL.glDeleteShader(self.fragment_shader.id)
+
+            if GL.glGetProgramiv(program_id, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+                log = GL.glGetProgramInfoLog(program_id).decode('utf-8', 'replace')
+                GL.glDeleteProgram(program_id)
+                raise RuntimeError(f"Link failure ({log})")
+        finally:
+            tracer.end("compile program", "shader")
+        return program_id
+
+    def reload(self):
+        """ Recompiles from the files on disk and swaps the result in place, so every holder of this
+            program picks it up. On failure the old program is kept and the error recorded.
+        """
+        try:
+            program_id = self.compile()
+        except (RuntimeError, OSError) as e:
+            program_errors[self.name()] = str(e)
+            print(f"ERROR: Reloading {self.name()} failed: {e}")
+            return False
+
+        GL.glDeleteProgram(self.id)
+        self.id = program_id
+        self.read_uniforms()
+        program_errors.pop(self.name(), None)
+        return True
+
+    def read_uniforms(self):
         self.uniforms = {}
         uniform_count = GL.glGetProgramiv(self.id, GL.GL_ACTIVE_UNIFORMS)
         for i in range(uniform_count):
@@ -44,6 +118,7 @@ class Program:
             u = {}
             u["index"] = i
             u["name"] = name.decode('utf-8')
+            u["location"] = GL.glGetUniformLocation(self.id, u["name"])
             u["size"] = size
             u["type"] = datatype
             self.uniforms[u["name"]] = u
@@ -51,24 +126,36 @@ class Program:
     def use(self):
         GL.glUseProgram(self.id)
 
+    def location(self, name):
+        # -1 for uniforms the program doesn't have (or the compiler dropped), which GL ignores
+        return self.uniforms[name]["location"] if name in self.uniforms else -1
+
     def set_uniforms(self, values):
+        """ Returns the texture unit each sampler was bound to. """
+        # each sampler passed in gets its own texture unit, in the order the program lists them
+        unit = 0
+        units = {}
         for key in self.uniforms:
             u = self.uniforms[key]
             if key in values:
-                if u["type"] == GL.GL_SAMPLER_2D:
-                    # GL.glActiveTexture( GL.GL_TEXTURE0 )
-                    # GL.glUniform1i( u["index"], 0 )
+                if u["type"] in (GL.GL_SAMPLER_2D, GL.GL_SAMPLER_2D_ARRAY):
+                    GL.glActiveTexture( GL.GL_TEXTURE0 + unit )
                     values[key].use()
+                    GL.glUniform1i( u["location"], unit )
+                    units[key] = unit
+                    unit += 1
                 if u["type"] == GL.GL_FLOAT_MAT4:
-                    GL.glUniformMatrix4fv( u["index"], 1, GL.GL_FALSE, array(values[key], dtype=float32) )
+                    GL.glUniformMatrix4fv( u["location"], 1, GL.GL_FALSE, array(values[key], dtype=float32) )
                 if u["type"] == GL.GL_FLOAT_VEC4:
-                    GL.glUniform4fv( u["index"], 1, array(values[key], dtype=float32) )
+                    GL.glUniform4fv( u["location"], 1, array(values[key], dtype=float32) )
                 if u["type"] == GL.GL_FLOAT_VEC2:
-                    GL.glUniform2fv( u["index"], 1, array(values[key], dtype=float32) )
+                    GL.glUniform2fv( u["location"], 1, array(values[key], dtype=float32) )
                 if u["type"] == GL.GL_FLOAT:
-                    GL.glUniform1f( u["index"], values[key] )
+                    GL.glUniform1f( u["location"], values[key] )
                 if u["type"] == GL.GL_INT:
-                    GL.glUniform1i( u["index"], values[key] )
+                    GL.glUniform1i( u["location"], values[key] )
+        GL.glActiveTexture( GL.GL_TEXTURE0 )
+        return units
 
 class VertexArrayObject:
     def __init__(self, progID, verts_list, uvs_list):
@@ -85,7 +172,9 @@ class VertexArrayObject:
         GL.glBindBuffer( GL.GL_ARRAY_BUFFER, vxbuf_id )
         GL.glBufferData( GL.GL_ARRAY_BUFFER, verts.nbytes, verts, GL.GL_STATIC_DRAW)
         
-        v_pos_attrib = GL.glGetAttribLocation( progID, "v_pos" )
+        # the fixed locations every program is linked with, not this program's, which can be -1 for an
+        # attribute it doesn't use
+        v_pos_attrib = ATTRIB_LOCATIONS["v_pos"]
         GL.glEnableVertexAttribArray( v_pos_attrib )
         GL.glVertexAttribPointer(
             v_pos_attrib,
@@ -99,7 +188,7 @@ class VertexArrayObject:
         GL.glBindBuffer( GL.GL_ARRAY_BUFFER, uvbuf_id )
         GL.glBufferData( GL.GL_ARRAY_BUFFER, uvs.nbytes, uvs, GL.GL_STATIC_DRAW)
         
-        v_uv_attrib = GL.glGetAttribLocation( progID, "v_uv" )
+        v_uv_attrib = ATTRIB_LOCATIONS["v_uv"]
         GL.glEnableVertexAttribArray( v_uv_attrib )
         GL.glVertexAttribPointer(
             v_uv_attrib,
@@ -118,12 +207,43 @@ class VertexArrayObject:
     def use(self):
         GL.glBindVertexArray( self.id )
 
+# internal format, bytes per pixel
+PIXEL_FORMATS = {
+    "r8": (GL.GL_R8, 1),
+    "rgba8": (GL.GL_RGBA8, 4),
+    "rgba16": (GL.GL_RGBA16, 8),
+    "rgba16f": (GL.GL_RGBA16F, 8),
+}
+
+# bytes of texture memory allocated in each format
+texture_memory = dict((fmt, 0) for fmt in PIXEL_FORMATS)
+
+def texture_bytes(width, height, fmt, gen_mipmaps):
+    size = width * height * PIXEL_FORMATS[fmt][1]
+    if gen_mipmaps:
+        # levels 1-3 of the chain
+        size += size // 4 + size // 16 + size // 64
+    return size
+
+def memory_report():
+    lines = []
+    for fmt in PIXEL_FORMATS:
+        lines.append(f"{fmt}: {texture_memory[fmt] / (1024.0 * 1024.0):.1f} MiB")
+    lines.append(f"total: {sum(texture_memory.values()) / (1024.0 * 1024.0):.1f} MiB")
+    return lines
+
 class Texture:
-    def __init__(self, width, height, gen_mipmaps):
+    def __init__(self, width, height, gen_mipmaps, fmt="rgba16"):
+        if fmt not in PIXEL_FORMATS:
+            print(f"ERROR: Unknown pixel format {fmt}, using rgba16.")
+            fmt = "rgba16"
+        self.fmt = fmt
+        self.nbytes = 0
+
         tex_id = GL.glGenTextures( 1 )
         GL.glBindTexture( GL.GL_TEXTURE_2D, tex_id )
         print(width, height)
-        GL.glTexImage2D( GL.GL_TEXTURE_2D, 0, GL.GL_RGBA16, width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None )
+        self.allocate(width, height, gen_mipmaps)
 
         GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE )
         GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE )
@@ -140,11 +260,27 @@ class Texture:
         self.id = tex_id
         self.gen_mipmaps = gen_mipmaps
     
+    def allocate(self, width, height, gen_mipmaps):
+        # expects the texture to be bound
+        GL.glTexImage2D( GL.GL_TEXTURE_2D, 0, PIXEL_FORMATS[self.fmt][0], width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None )
+        texture_memory[self.fmt] -= self.nbytes
+        self.nbytes = texture_bytes(width, height, self.fmt, gen_mipmaps)
+        texture_memory[self.fmt] += self.nbytes
+
+    def resize(self, width, height):
+        self.use()
+        self.allocate(width, height, self.gen_mipmaps)
+
     def use(self):
         GL.glBindTexture( GL.GL_TEXTURE_2D, self.id )
 
+    def delete(self):
+        GL.glDeleteTextures( [self.id] )
+        texture_memory[self.fmt] -= self.nbytes
+        self.nbytes = 0
+
 class Framebuffer:
-    def __init__(self, width, height, color, gen_mipmaps, dummy):
+    def __init__(self, width, height, color, gen_mipmaps, dummy, fmt="rgba16"):
         self.width = width
         self.height = height
         self.color = color
@@ -154,7 +290,7 @@ class Framebuffer:
             self.id = 0
             return
         
-        self.texture = Texture(width, height, gen_mipmaps)
+        self.texture = Texture(width, height, gen_mipmaps, fmt)
         
         fb_id = GL.glGenFramebuffers( 1 )
         GL.glBindFramebuffer( GL.GL_FRAMEBUFFER, fb_id )
@@ -173,6 +309,12 @@ class Framebuffer:
         if gen_mipmaps:
             self.update_mipmaps()
     
+    def delete(self):
+        if self.id == 0:
+            return
+        GL.glDeleteFramebuffers( 1, [self.id] )
+        self.texture.delete()
+
     def update_mipmaps(self):
         self.use()
         self.texture.use()
@@ -189,11 +331,13 @@ class Framebuffer:
 
 class RenderTarget:
     def __init__(self, prog_args, vao_args, fb_args):
-        self.program = Program(prog_args["vertex shader path"], prog_args["fragment shader path"])
+        self.program = load_program(prog_args["vertex shader path"], prog_args["fragment shader path"])
         self.vao = VertexArrayObject(self.program.id, vao_args["vertices"], vao_args["uvs"])
         if "dummy" not in fb_args:
             fb_args["dummy"] = False
-        self.fb = Framebuffer(fb_args["width"], fb_args["height"], fb_args["color"], fb_args["generate mipmaps"], fb_args["dummy"])
+        if "format" not in fb_args:
+            fb_args["format"] = "rgba16"
+        self.fb = Framebuffer(fb_args["width"], fb_args["height"], fb_args["color"], fb_args["generate mipmaps"], fb_args["dummy"], fb_args["format"])
     
     def render(self, uniforms):
         self.program.use()
@@ -213,67 +357,269 @@ class RenderTarget:
         flat = arr.flat
         return (flat[0], flat[1], flat[2], flat[3])
 
+class AsyncReadback:
+    """ Reads a framebuffer region into a pixel buffer object without stalling;
+        the data is picked up on a later frame once the fence has signalled.
+    """
+    def __init__(self, size):
+        self.id = GL.glGenBuffers(1)
+        self.size = 0
+        self.nbytes = 0
+        self.fence = None
+        self.region = None
+        self.tag = None
+        self.allocate(size)
+
+    def allocate(self, size):
+        GL.glBindBuffer( GL.GL_PIXEL_PACK_BUFFER, self.id )
+        GL.glBufferData( GL.GL_PIXEL_PACK_BUFFER, size, None, GL.GL_STREAM_READ )
+        GL.glBindBuffer( GL.GL_PIXEL_PACK_BUFFER, 0 )
+        self.size = size
+
+    def delete(self):
+        if self.fence:
+            GL.glDeleteSync(self.fence)
+            self.fence = None
+        GL.glDeleteBuffers( 1, [self.id] )
+
+    def busy(self):
+        return self.fence is not None
+
+    def start(self, fb, x, y, w, h, pixel_format, pixel_type, pixel_size, tag=None):
+        self.nbytes = w * h * pixel_size
+        if self.nbytes > self.size:
+            self.allocate(self.nbytes)
+
+        fb.use()
+        GL.glPixelStorei( GL.GL_PACK_ALIGNMENT, 1 )
+        GL.glBindBuffer( GL.GL_PIXEL_PACK_BUFFER, self.id )
+        glReadPixelsRaw( x, y, w, h, pixel_format, pixel_type, c_void_p(0) )
+        GL.glBindBuffer( GL.GL_PIXEL_PACK_BUFFER, 0 )
+        GL.glPixelStorei( GL.GL_PACK_ALIGNMENT, 4 )
+
+        self.fence = GL.glFenceSync( GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0 )
+        self.region = (x, y, w, h)
+        self.tag = tag
+
+    def ready(self):
+        if not self.fence:
+            return False
+        status = GL.glClientWaitSync( self.fence, 0, 0 )
+        return status in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED)
+
+    def cancel(self):
+        # forget a read in flight without waiting for it
+        if self.fence:
+            GL.glDeleteSync(self.fence)
+            self.fence = None
+
+    def take(self):
+        GL.glBindBuffer( GL.GL_PIXEL_PACK_BUFFER, self.id )
+        ptr = GL.glMapBufferRange( GL.GL_PIXEL_PACK_BUFFER, 0, self.nbytes, GL.GL_MAP_READ_BIT )
+        data = string_at(ptr, self.nbytes)
+        GL.glUnmapBuffer( GL.GL_PIXEL_PACK_BUFFER )
+        GL.glBindBuffer( GL.GL_PIXEL_PACK_BUFFER, 0 )
+
+        GL.glDeleteSync(self.fence)
+        self.fence = None
+        return data
+
+def clip_rect(rect, bounds):
+    """ rect (x, y, w, h) cut down to bounds (x0, y0, x1, y1), or None if they don't meet. """
+    x0 = max(rect[0], int(bounds[0]))
+    y0 = max(rect[1], int(bounds[1]))
+    x1 = min(rect[0] + rect[2], int(bounds[2]))
+    y1 = min(rect[1] + rect[3], int(bounds[3]))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+class DirtyTiles:
+    def __init__(self, width, height, tile_size):
+        self.tile_size = tile_size
+        self.tiles_x = (width + tile_size - 1) // tile_size
+        self.tiles_y = (height + tile_size - 1) // tile_size
+        self.tiles = set()
+
+    def mark(self, x, y, w, h):
+        ts = self.tile_size
+        x0 = max(int(x) // ts, 0)
+        y0 = max(int(y) // ts, 0)
+        x1 = min(int(x + w - 1) // ts, self.tiles_x - 1)
+        y1 = min(int(y + h - 1) // ts, self.tiles_y - 1)
+        for ty in range(y0, y1 + 1):
+            for tx in range(x0, x1 + 1):
+                self.tiles.add((tx, ty))
+
+    def mark_all(self):
+        for ty in range(self.tiles_y):
+            for tx in range(self.tiles_x):
+                self.tiles.add((tx, ty))
+
+    def take(self):
+        tiles = self.tiles
+        self.tiles = set()
+        return tiles
+
 class DualFramebuffer:
-    def __init__(self, width, height, color, gen_mipmaps):
+    def __init__(self, width, height, color, gen_mipmaps, fmt="rgba16"):
         self.toggle = 0
         self.size = [width, height]
+        self.fmt = fmt
 
         self.fbs = [
-            Framebuffer(width, height, color, gen_mipmaps, False),
-            Framebuffer(width, height, color, gen_mipmaps, False)
+            Framebuffer(width, height, color, gen_mipmaps, False, fmt),
+            Framebuffer(width, height, color, gen_mipmaps, False, fmt)
         ]
 
+        # anything that needs to know which parts of the canvas changed (saving etc.) registers a DirtyTiles here
+        self.dirty_trackers = []
+        # bumped on every change, so cached views of the canvas know to redraw
+        self.version = 0
+
     def get_texture(self, i):
         return self.fbs[i].texture.id
+
+    def front(self):
+        # the framebuffer holding the most recent dab
+        return self.fbs[1 - self.toggle]
+
+    def delete(self):
+        for fb in self.fbs:
+            fb.delete()
+
+    def mark_changed(self):
+        self.version += 1
+
+    def mark_dirty(self, x, y, w, h):
+        self.version += 1
+        for tracker in self.dirty_trackers:
+            tracker.mark(x, y, w, h)
+    
+    def dab_rect(self, radius, mpos, clip=None):
+        """ Integer scissor rect (x, y, w, h) covering a dab, or None if it's entirely off the canvas or
+            outside clip (x0, y0, x1, y1; a selection's bounds).
+        """
+        width, height = self.size
+        radplus = radius + 1.0
+        diaplus = radius*2.0 + 4.0
+        
+        # lower-left corner of dab rect
+        scpos = (mpos[0] - radplus, mpos[1] - radplus)
+        
+        if scpos[0] >= width or scpos[1] >= height:
+            return None
+        
+        scisx = min( max( 0.0, scpos[0] ), width )
+        scisy = min( max( 0.0, scpos[1] ), height )
+        scisw = ( diaplus if scpos[0] > 0.0 else diaplus + scpos[0] ) if scisx+diaplus < width else width + 0.999 - scisx
+        scish = ( diaplus if scpos[1] > 0.0 else diaplus + scpos[1] ) if scisy+diaplus < height else height + 0.999 - scisy
+        if scisw < 0.0 or scish < 0.0:
+            return None
+        
+        rect = int(scisx), int(scisy), int(scisw), int(scish)
+        return clip_rect(rect, clip) if clip else rect
     
     def render(self, vao, program, uniforms):
         if not "radius" in uniforms or not "mpos" in uniforms:
             return
         
+        rect = self.dab_rect(uniforms["radius"], uniforms["mpos"], uniforms.get("selectionrect"))
+        if not rect:
+            return
+        
         program.use()
         vao.use()
         
         fb = self.fbs[self.toggle]
         fb.use()
-        self.fbs[1 - self.toggle].texture.use()
-        
-        program.set_uniforms(uniforms)
 
-        radplus = uniforms["radius"] + 1.0
-        diaplus = uniforms["radius"]*2.0 + 4.0
-        
-        # lower-left corner of dab rect
-        scpos = (uniforms["mpos"][0] - radplus, uniforms["mpos"][1] - radplus)
-        
-        if scpos[0] >= fb.width or scpos[1] >= fb.height:
-            return
-        
-        scisx = min( max( 0.0, scpos[0] ), fb.width )
-        scisy = min( max( 0.0, scpos[1] ), fb.height )
-        scisw = ( diaplus if scpos[0] > 0.0 else diaplus + scpos[0] ) if scisx+diaplus < fb.width else fb.width + 0.999 - scisx
-        scish = ( diaplus if scpos[1] > 0.0 else diaplus + scpos[1] ) if scisy+diaplus < fb.height else fb.height + 0.999 - scisy
-        if scisw < 0.0 or scish < 0.0:
-            return
-        
-        giscisx = GL.GLint(int(scisx))
-        giscisy = GL.GLint(int(scisy))
-        giscisw = GL.GLsizei(int(scisw))
-        giscish = GL.GLsizei(int(scish))
+        values = dict(uniforms)
+        values["basetexture"] = self.fbs[1 - self.toggle].texture
+        program.set_uniforms(values)
+
+        giscisx = GL.GLint(rect[0])
+        giscisy = GL.GLint(rect[1])
+        giscisw = GL.GLsizei(rect[2])
+        giscish = GL.GLsizei(rect[3])
 
         GL.glScissor( giscisx, giscisy, giscisw, giscish )
         GL.glEnable( GL.GL_SCISSOR_TEST )
         GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
         GL.glDisable( GL.GL_SCISSOR_TEST )
         
+        self.fbs[1 - self.toggle].texture.use()
         GL.glCopyTexSubImage2D( GL.GL_TEXTURE_2D, 0, giscisx, giscisy, giscisx, giscisy, giscisw, giscish )
+        self.mark_dirty(*rect)
 
         if fb.gen_mipmaps:
             fb.update_mipmaps()
 
         self.toggle = 1 - self.toggle
-        
+
+    def render_batch(self, vao, program, uniforms, dabs):
+        """ Draws a run of dabs with the program set up once. uniforms holds what every dab shares; dabs is a
+            sequence of (mpos, opacity, pressure), the only uniforms that change from one dab to the next.
+            Returns how many dabs landed on the canvas.
+        """
+        program.use()
+        vao.use()
+        values = dict(uniforms)
+        values["basetexture"] = self.fbs[1 - self.toggle].texture
+        unit = program.set_uniforms(values).get("basetexture", 0)
+        clip = uniforms.get("selectionrect")
+        mpos_location = program.location("mpos")
+        opacity_location = program.location("opacity")
+        pressure_location = program.location("pressure")
+
+        # every texture change below happens on the canvas's own unit, so the other samplers stay bound
+        GL.glActiveTexture( GL.GL_TEXTURE0 + unit )
+        GL.glEnable( GL.GL_SCISSOR_TEST )
+        count = 0
+        for mpos, opacity, pressure in dabs:
+            rect = self.dab_rect(uniforms["radius"], mpos, clip)
+            if not rect:
+                continue
+
+            fb = self.fbs[self.toggle]
+            fb.use()
+            self.fbs[1 - self.toggle].texture.use()
+            GL.glUniform2f( mpos_location, mpos[0], mpos[1] )
+            GL.glUniform1f( opacity_location, opacity )
+            GL.glUniform1f( pressure_location, pressure )
+
+            GL.glScissor( *rect )
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+            GL.glCopyTexSubImage2D( GL.GL_TEXTURE_2D, 0, rect[0], rect[1], rect[0], rect[1], rect[2], rect[3] )
+            self.mark_dirty(*rect)
+
+            if fb.gen_mipmaps:
+                fb.update_mipmaps()
+            self.toggle = 1 - self.toggle
+            count += 1
+        GL.glDisable( GL.GL_SCISSOR_TEST )
+        GL.glActiveTexture( GL.GL_TEXTURE0 )
+        return count
     
+    def commit_back(self, rect=None):
+        """ Makes the back framebuffer, after something other than a dab has drawn into it (a filter or a
+            fill, say), the front one, and copies what changed (rect, default all of it) over the other so
+            the pair match again.
+        """
+        fb = self.fbs[self.toggle]
+        x, y, w, h = rect if rect else (0, 0, fb.width, fb.height)
+        fb.use()
+        self.fbs[1 - self.toggle].texture.use()
+        GL.glCopyTexSubImage2D( GL.GL_TEXTURE_2D, 0, x, y, x, y, w, h )
+        if fb.gen_mipmaps:
+            fb.update_mipmaps()
+        self.toggle = 1 - self.toggle
+        self.mark_dirty(x, y, w, h)
+
     def clear(self):
         for fb in self.fbs:
             fb.clear()
             fb.update_mipmaps()
+        self.version += 1
+        for tracker in self.dirty_trackers:
+            tracker.mark_all()
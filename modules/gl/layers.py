@@ -0,0 +1,190 @@
+from itertools import count
+
+from OpenGL import GL
+
+from modules.gl.gltypes import load_program, VertexArrayObject, Framebuffer, DualFramebuffer
+from modules.math import mat4_ortho
+from modules.trace import tracer
+
+BLEND_MODES = ["normal", "multiply", "screen", "overlay", "add"]
+
+TRANSPARENT = (0.0, 0.0, 0.0, 0.0)
+
+layer_ids = count(1)
+
+class Layer:
+    def __init__(self, name, width, height, color, fmt):
+        self.id = next(layer_ids)
+        self.name = name
+        self.opacity = 1.0
+        self.visible = True
+        self.blend_mode = "normal"
+        self.canvas = DualFramebuffer(width, height, color, True, fmt)
+
+    def delete(self):
+        self.canvas.delete()
+
+class LayerStack:
+    """ Layers are composited as three textures: everything below the active layer flattened,
+        the active layer itself, and everything above it flattened. The flattened caches are
+        only rebuilt when a layer other than the active one changes.
+
+        Only normal layers can be flattened above the active one, since the other modes depend on
+        what's under them. Layers above it up to the last that isn't normal are kept in self.blended
+        instead, and merge() composites them one by one over the rest every time the view is drawn.
+    """
+    def __init__(self, width, height, color, quad, fmt):
+        self.fmt = fmt
+        self.program = load_program("shaders/screen.vert", "shaders/layers/flatten.frag")
+        self.vao = VertexArrayObject(self.program.id, quad["verts"], quad["uvs"])
+
+        self.layers = []
+        self.active = 0
+        self.below = None
+        self.above = None
+        self.scratch = None
+        # below, the active layer and self.blended composited, while there are any blended layers
+        self.merged = None
+        self.blended = []
+        self.background = color
+        # bumped whenever the layer list or a layer's properties change
+        self.version = 0
+        # bumped whenever the whole stack is replaced, e.g. by opening a document
+        self.generation = 0
+        self.reset(width, height, 1)
+
+    def reset(self, width, height, layer_count):
+        for layer in self.layers:
+            layer.delete()
+        for fb in (self.below, self.above, self.scratch, self.merged):
+            if fb:
+                fb.delete()
+        self.merged = None
+        self.blended = []
+
+        self.size = [width, height]
+        self.layers = [Layer("Background", width, height, self.background, self.fmt)]
+        for i in range(1, layer_count):
+            self.layers.append(Layer(f"Layer {i}", width, height, TRANSPARENT, self.fmt))
+        self.active = 0
+
+        self.below = Framebuffer(width, height, TRANSPARENT, False, False, self.fmt)
+        self.above = Framebuffer(width, height, TRANSPARENT, False, False, self.fmt)
+        self.scratch = Framebuffer(width, height, TRANSPARENT, False, False, self.fmt)
+        self.generation += 1
+        self.invalidate()
+
+    def delete(self):
+        for layer in self.layers:
+            layer.delete()
+        for fb in (self.below, self.above, self.scratch, self.merged):
+            if fb:
+                fb.delete()
+
+    def invalidate(self):
+        self.dirty = True
+        self.version += 1
+
+    def active_layer(self):
+        return self.layers[self.active]
+
+    def set_active(self, index):
+        index = min(max(index, 0), len(self.layers) - 1)
+        if index != self.active:
+            self.active = index
+            self.invalidate()
+
+    def add_layer(self):
+        layer = Layer(f"Layer {len(self.layers)}", self.size[0], self.size[1], TRANSPARENT, self.fmt)
+        self.layers.insert(self.active + 1, layer)
+        self.active += 1
+        self.invalidate()
+        return layer
+
+    def remove_layer(self):
+        if len(self.layers) < 2:
+            return
+        self.layers.pop(self.active).delete()
+        self.active = min(self.active, len(self.layers) - 1)
+        self.invalidate()
+
+    def move_layer(self, offset):
+        index = self.active + offset
+        if index < 0 or index >= len(self.layers):
+            return
+        self.layers.insert(index, self.layers.pop(self.active))
+        self.active = index
+        self.invalidate()
+
+    def set_property(self, layer, name, value):
+        if getattr(layer, name) == value:
+            return
+        setattr(layer, name, value)
+        # properties of the active layer are applied in the final composite, not baked into the caches
+        if layer is self.active_layer():
+            self.version += 1
+        else:
+            self.invalidate()
+
+    def update(self):
+        if not self.dirty:
+            return
+        with tracer.span("flatten layers", "layers", {"layers": len(self.layers)}):
+            above = [layer for layer in self.layers[self.active + 1:] if layer.visible and layer.opacity > 0.0]
+            last = max((i for i, layer in enumerate(above) if layer.blend_mode != "normal"), default=-1)
+            self.blended = above[:last + 1]
+            self.flatten(self.below, self.layers[:self.active])
+            self.flatten(self.above, above[last + 1:])
+        if self.blended and not self.merged:
+            self.merged = Framebuffer(self.size[0], self.size[1], TRANSPARENT, False, False, self.fmt)
+        self.dirty = False
+
+    def flatten(self, target, layers, clear=True):
+        if clear:
+            target.clear()
+
+        self.program.use()
+        self.vao.use()
+        for layer in layers:
+            if not layer.visible or layer.opacity <= 0.0:
+                continue
+            self.scratch.use()
+            self.program.set_uniforms({
+                "dsttexture": target.texture,
+                "srctexture": layer.canvas.front().texture,
+                "opacity": layer.opacity,
+                "blendmode": BLEND_MODES.index(layer.blend_mode),
+            })
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+
+            # copy the result back into the cache, the same way dabs are copied between the canvas pair
+            target.texture.use()
+            GL.glCopyTexSubImage2D( GL.GL_TEXTURE_2D, 0, 0, 0, 0, 0, self.size[0], self.size[1] )
+
+    def composite_uniforms(self):
+        layer = self.active_layer()
+        return {
+            "belowtexture": self.below.texture,
+            "basetexture": layer.canvas.front().texture,
+            "abovetexture": self.above.texture,
+            "above": 1,
+            "opacity": layer.opacity if layer.visible else 0.0,
+            "blendmode": BLEND_MODES.index(layer.blend_mode),
+        }
+
+    def merge(self, program, vao, uniforms):
+        """ Draws the composite shader (program, with the view's uniforms) over the whole canvas into
+            self.merged without the flattened layers above, then the blended layers over that in turn.
+            Returns the uniforms that have the view composited from self.merged instead.
+        """
+        with tracer.span("merge blended layers", "layers", {"layers": len(self.blended)}):
+            values = dict(uniforms)
+            values.update({"transform": mat4_ortho(self.size[0], self.size[1]), "above": 0, "selection": 0})
+            self.merged.use()
+            program.use()
+            vao.use()
+            program.set_uniforms(values)
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+            self.flatten(self.merged, self.blended, False)
+        # with no opacity the active layer leaves what's under it, which already has it
+        return {"belowtexture": self.merged.texture, "opacity": 0.0, "preview": 0, "floating": 0}
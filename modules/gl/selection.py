@@ -0,0 +1,139 @@
+from ctypes import c_void_p
+
+from numpy import array, float32
+from OpenGL import GL
+
+from modules.gl.gltypes import load_program, clip_rect, VertexArrayObject, Framebuffer, ATTRIB_LOCATIONS
+from modules.gl.layers import TRANSPARENT
+from modules.trace import tracer
+
+SelectionRect = 0
+SelectionEllipse = 1
+
+class Selection:
+    """ What brushes, filters and fills are confined to, as an R8 mask the size of the canvas (a quarter
+        of a float mask's memory, and only allocated while something is selected) plus the rect around
+        what's selected. Shapes are drawn into the mask on the GPU: rectangles and ellipses analytically,
+        with antialiased edges, lassos as a triangle fan that inverts every pixel it covers, so pixels
+        covered an odd number of times end up inside.
+
+        uniforms() is what the shaders that honour the selection read; its "selectionrect" also lets
+        dabs and filter tiles entirely outside the selection be skipped before anything is drawn.
+    """
+    def __init__(self, quad):
+        self.shape_program = load_program("shaders/screen.vert", "shaders/selection/shape.frag")
+        self.lasso_program = load_program("shaders/selection/lasso.vert", "shaders/selection/lasso.frag")
+        self.vao = VertexArrayObject(self.shape_program.id, quad["verts"], quad["uvs"])
+
+        self.lasso_vao = GL.glGenVertexArrays(1)
+        self.lasso_buffer = GL.glGenBuffers(1)
+        GL.glBindVertexArray( self.lasso_vao )
+        GL.glBindBuffer( GL.GL_ARRAY_BUFFER, self.lasso_buffer )
+        GL.glEnableVertexAttribArray( ATTRIB_LOCATIONS["v_pos"] )
+        GL.glVertexAttribPointer( ATTRIB_LOCATIONS["v_pos"], 2, GL.GL_FLOAT, GL.GL_FALSE, 0, c_void_p(0) )
+        GL.glBindBuffer( GL.GL_ARRAY_BUFFER, 0 )
+        GL.glBindVertexArray( 0 )
+
+        self.mask = None
+        # bound in the mask's place while nothing is selected, so the sampler never shares a unit with a
+        # sampler of another type (the brush tips' array)
+        self.empty = Framebuffer(1, 1, TRANSPARENT, False, False, "r8")
+        # (x0, y0, x1, y1) in canvas pixels, or None when nothing is selected
+        self.bounds = None
+        # bumped on every change, so cached views know to redraw
+        self.version = 0
+
+    def delete(self):
+        if self.mask:
+            self.mask.delete()
+            self.mask = None
+        self.empty.delete()
+        GL.glDeleteBuffers( 1, [self.lasso_buffer] )
+        GL.glDeleteVertexArrays( 1, [self.lasso_vao] )
+
+    def active(self):
+        return self.bounds is not None
+
+    def clear(self):
+        """ Selects nothing, which leaves everything editable; the mask is freed. """
+        if self.mask:
+            self.mask.delete()
+            self.mask = None
+        self.bounds = None
+        self.version += 1
+
+    def begin(self, size, bounds):
+        """ Clears the mask for a new shape covering bounds; returns the integer bounds on the canvas,
+            or None (and nothing selected) if the shape misses it.
+        """
+        width, height = size
+        if not self.mask or self.mask.width != width or self.mask.height != height:
+            if self.mask:
+                self.mask.delete()
+            self.mask = Framebuffer(width, height, TRANSPARENT, False, False, "r8")
+        self.mask.clear()
+        self.version += 1
+
+        x0 = max(int(bounds[0]), 0)
+        y0 = max(int(bounds[1]), 0)
+        x1 = min(int(bounds[2]) + 1, width)
+        y1 = min(int(bounds[3]) + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            self.bounds = None
+            return None
+        self.bounds = (x0, y0, x1, y1)
+        return self.bounds
+
+    def select_shape(self, size, shape, a, b):
+        """ A rectangle or ellipse (SelectionRect, SelectionEllipse) spanning canvas points a and b. """
+        rect = (min(a[0], b[0]), min(a[1], b[1]), max(a[0], b[0]), max(a[1], b[1]))
+        bounds = self.begin(size, rect)
+        if not bounds:
+            return
+        with tracer.span("select shape", "selection"):
+            self.mask.use()
+            self.shape_program.use()
+            self.vao.use()
+            self.shape_program.set_uniforms({"shape": shape, "rect": rect})
+            GL.glEnable( GL.GL_SCISSOR_TEST )
+            GL.glScissor( bounds[0], bounds[1], bounds[2] - bounds[0], bounds[3] - bounds[1] )
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+            GL.glDisable( GL.GL_SCISSOR_TEST )
+
+    def select_lasso(self, size, points):
+        """ The polygon through points (canvas pixels), closed back to the first one. """
+        if len(points) < 3:
+            self.clear()
+            return
+        verts = array(points, dtype=float32)
+        bounds = self.begin(size, (verts[:, 0].min(), verts[:, 1].min(), verts[:, 0].max(), verts[:, 1].max()))
+        if not bounds:
+            return
+        with tracer.span("select lasso", "selection", {"points": len(points)}):
+            self.mask.use()
+            self.lasso_program.use()
+            self.lasso_program.set_uniforms({"sz": (float(size[0]), float(size[1]))})
+            GL.glBindVertexArray( self.lasso_vao )
+            GL.glBindBuffer( GL.GL_ARRAY_BUFFER, self.lasso_buffer )
+            GL.glBufferData( GL.GL_ARRAY_BUFFER, verts.nbytes, verts, GL.GL_STREAM_DRAW )
+            GL.glBindBuffer( GL.GL_ARRAY_BUFFER, 0 )
+
+            # 1 - dst per covering triangle: even-odd fill without a stencil buffer
+            GL.glEnable( GL.GL_BLEND )
+            GL.glBlendFunc( GL.GL_ONE_MINUS_DST_COLOR, GL.GL_ZERO )
+            GL.glDrawArrays( GL.GL_TRIANGLE_FAN, 0, len(verts) )
+            GL.glDisable( GL.GL_BLEND )
+            GL.glBindVertexArray( 0 )
+
+    def clip(self, rect):
+        """ rect (x, y, w, h) cut down to the selection's bounds, or None if they don't meet. """
+        return clip_rect(rect, self.bounds) if self.bounds else rect
+
+    def uniforms(self):
+        if not self.bounds:
+            return {"selection": 0, "selectiontexture": self.empty.texture}
+        return {
+            "selection": 1,
+            "selectiontexture": self.mask.texture,
+            "selectionrect": tuple(float(v) for v in self.bounds),
+        }
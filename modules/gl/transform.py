@@ -0,0 +1,194 @@
+from math import ceil, floor, log2, sqrt
+
+import numpy
+from OpenGL import GL
+
+from modules.gl.gltypes import load_program, clip_rect, VertexArrayObject, Framebuffer
+from modules.gl.layers import TRANSPARENT
+from modules.math import mat4_identity, mat4_translate, mat4_rotate_z_at_point, mat4_scale_at_point
+from modules.trace import tracer
+
+# the floating region keeps mip levels 0-3, like the canvases
+TransformMaxLod = 3
+
+class RegionTransform:
+    """ Moves, scales and rotates part of a layer. Lifting copies the selection (or the whole layer) into
+        a floating texture, premultiplied so it filters and mipmaps without dark fringes, and cuts it out
+        of the layer; both are GPU passes, nothing is read back. While the transform is changed the view
+        draws the floating region over the layer through the inverse of self.matrix, at view resolution.
+        Applying draws it into the layer once with a bicubic resample, and cancelling puts it back where
+        it was.
+
+        self.matrix maps canvas pixels where the region was lifted from to where it's going, as a mat4
+        in modules/math.py's layout, so the same helpers the view uses can change it.
+    """
+    def __init__(self, quad, fmt):
+        self.fmt = fmt
+        self.lift_program = load_program("shaders/screen.vert", "shaders/transform/lift.frag")
+        self.cut_program = load_program("shaders/screen.vert", "shaders/transform/cut.frag")
+        self.commit_program = load_program("shaders/screen.vert", "shaders/transform/commit.frag")
+        self.vao = VertexArrayObject(self.lift_program.id, quad["verts"], quad["uvs"])
+
+        self.floating = None
+        # the layer's canvas the region came from, and the canvas rect (x0, y0, x1, y1) it was lifted from
+        self.canvas = None
+        self.rect = None
+        self.matrix = mat4_identity()
+        # bumped on every change, so cached views know to redraw
+        self.version = 0
+
+    def delete(self):
+        if self.floating:
+            self.floating.delete()
+            self.floating = None
+        self.canvas = None
+
+    def active(self):
+        return self.canvas is not None
+
+    def lift(self, canvas, selection):
+        """ Starts a transform of what's selected on canvas, or all of it. Returns False if there's nothing
+            to lift.
+        """
+        width, height = canvas.size
+        rect = selection.bounds if selection and selection.active() else (0, 0, width, height)
+        x0, y0, x1, y1 = rect
+        w = x1 - x0
+        h = y1 - y0
+        if w < 1 or h < 1:
+            return False
+
+        if not self.floating or self.floating.width != w or self.floating.height != h:
+            if self.floating:
+                self.floating.delete()
+            self.floating = Framebuffer(w, h, TRANSPARENT, True, False, self.fmt)
+
+        uniforms = {
+            "rect": (float(x0), float(y0), float(x1), float(y1)),
+        }
+        uniforms.update(selection.uniforms() if selection else {"selection": 0})
+
+        with tracer.span("transform lift", "transform", {"size": [w, h]}):
+            self.vao.use()
+
+            # the region, premultiplied and masked, into the floating texture
+            self.floating.use()
+            self.lift_program.use()
+            values = dict(uniforms)
+            values["sourcetexture"] = canvas.front().texture
+            self.lift_program.set_uniforms(values)
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+            self.floating.update_mipmaps()
+
+            # and out of the layer
+            canvas.fbs[canvas.toggle].use()
+            self.cut_program.use()
+            values = dict(uniforms)
+            values["basetexture"] = canvas.front().texture
+            self.cut_program.set_uniforms(values)
+            GL.glEnable( GL.GL_SCISSOR_TEST )
+            GL.glScissor( x0, y0, w, h )
+            GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+            GL.glDisable( GL.GL_SCISSOR_TEST )
+            canvas.commit_back((x0, y0, w, h))
+
+        self.canvas = canvas
+        self.rect = (x0, y0, x1, y1)
+        self.matrix = mat4_identity()
+        self.version += 1
+        return True
+
+    def centre(self):
+        """ Where the middle of the region is now, in canvas pixels. """
+        x0, y0, x1, y1 = self.rect
+        cx = (x0 + x1) * 0.5
+        cy = (y0 + y1) * 0.5
+        m = self.matrix
+        return (cx * m[0][0] + cy * m[1][0] + m[3][0], cx * m[0][1] + cy * m[1][1] + m[3][1])
+
+    def translate(self, x, y):
+        mat4_translate(self.matrix, x, y, 0)
+        self.version += 1
+
+    def rotate(self, a):
+        cx, cy = self.centre()
+        mat4_rotate_z_at_point(self.matrix, cx, cy, a)
+        self.version += 1
+
+    def scale(self, s):
+        cx, cy = self.centre()
+        mat4_scale_at_point(self.matrix, cx, cy, s)
+        self.version += 1
+
+    def inverse(self):
+        return numpy.linalg.inv(numpy.array(self.matrix, dtype=numpy.float64)).astype(numpy.float32)
+
+    def bounds(self):
+        """ The canvas rect (x, y, w, h) the transformed region covers, or None if it's off the canvas. """
+        x0, y0, x1, y1 = self.rect
+        m = self.matrix
+        xs = []
+        ys = []
+        for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+            xs.append(x * m[0][0] + y * m[1][0] + m[3][0])
+            ys.append(x * m[0][1] + y * m[1][1] + m[3][1])
+        # a pixel of margin for the bicubic kernel
+        left = int(floor(min(xs))) - 1
+        bottom = int(floor(min(ys))) - 1
+        rect = (left, bottom, int(ceil(max(xs))) + 1 - left, int(ceil(max(ys))) + 1 - bottom)
+        width, height = self.canvas.size
+        return clip_rect(rect, (0, 0, width, height))
+
+    def apply(self):
+        """ Draws the region into its layer where it's been moved to, and ends the transform. """
+        if not self.active():
+            return
+        canvas = self.canvas
+        rect = self.bounds()
+        if rect:
+            m = self.matrix
+            # how many source pixels fall on a canvas pixel along the more squashed axis, for the mip level
+            shrink = 1.0 / max(min(sqrt(m[0][0] ** 2 + m[0][1] ** 2), sqrt(m[1][0] ** 2 + m[1][1] ** 2)), 1e-6)
+            with tracer.span("transform apply", "transform", {"rect": list(rect)}):
+                canvas.fbs[canvas.toggle].use()
+                self.commit_program.use()
+                self.vao.use()
+                self.commit_program.set_uniforms({
+                    "basetexture": canvas.front().texture,
+                    "floatingtexture": self.floating.texture,
+                    "floatinginverse": self.inverse(),
+                    "floatingrect": tuple(float(v) for v in self.rect),
+                    "floatinglod": int(min(max(floor(log2(shrink)), 0), TransformMaxLod)),
+                })
+                GL.glEnable( GL.GL_SCISSOR_TEST )
+                GL.glScissor( *rect )
+                GL.glDrawArrays( GL.GL_TRIANGLE_STRIP, 0, 4 )
+                GL.glDisable( GL.GL_SCISSOR_TEST )
+                canvas.commit_back(rect)
+        self.canvas = None
+        self.version += 1
+
+    def cancel(self):
+        """ Puts the region back where it was lifted from. """
+        if not self.active():
+            return
+        self.matrix = mat4_identity()
+        self.apply()
+
+    def discard(self):
+        """ Forgets the region without drawing it anywhere, for when its layer is gone. """
+        self.canvas = None
+        self.version += 1
+
+    def uniforms(self, canvas):
+        """ What the view's composite shader needs to draw the floating region over canvas, if it's the
+            layer the region came from.
+        """
+        if not self.active() or self.canvas is not canvas:
+            return {"floating": 0}
+        return {
+            "floating": 1,
+            "floatingtexture": self.floating.texture,
+            "floatinginverse": self.inverse(),
+            "floatingrect": tuple(float(v) for v in self.rect),
+        }
@@ -14,7 +14,7 @@ elif platform.startswith("win32"):
 
 from modules.math import vec2f_mat4_mul_inverse
 from modules.gl.glrenderer import Renderer
-from modules.inputstate import InputState, KeyPressed, KeyNotPressed, KeyJustReleased, InputHistoryLength
+from modules.inputstate import InputState, KeyPressed, KeyNotPressed, KeyJustReleased
 from modules.operators import Operators
 from modules.settings import Settings
 
@@ -73,6 +73,10 @@ class App:
         self.input_state.found_stylus = self.devices.add_device("stylus")
 
         self.renderer = Renderer(self.window_size, self.settings.canvas_size, self.input_state)
+        # the SDL app defers these until after its first frame; this one has no startup split
+        self.input_state.brush.load_programs()
+        self.renderer.load_engines()
+        self.renderer.load_tips(self.input_state.brush.tips)
 
         glfw.set_error_callback(error_callback)
         glfw.set_mouse_button_callback(self.window, mouse_button_callback)
@@ -125,14 +129,7 @@ class App:
         y = self.window_size[1] - xy[1]
 
         x, y = self.input_state.smooth_mpos(x, y)
-
-        if (x, y) != self.input_state.mpos_history[-1]:
-            self.input_state.update_input_history(self.input_state.mpos_history, self.input_state.mpos)
-            self.input_state.update_input_history(self.input_state.mpos_w_history, self.input_state.mpos_w)
-
-        self.input_state.mpos = (x, y)
-        self.input_state.mdelta = (self.input_state.mpos[0] - self.input_state.mpos_history[-1][0], self.input_state.mpos[1] - self.input_state.mpos_history[-1][1])
-        self.input_state.mpos_w = vec2f_mat4_mul_inverse( self.renderer.view_transform, (x, y) )
+        self.input_state.update_pointer(time(), x, y, vec2f_mat4_mul_inverse( self.renderer.view_transform, (x, y) ))
     
     def check_keybinds_and_run_operators(self):
         self.input_state.previous_bind = self.input_state.active_bind
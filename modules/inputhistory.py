@@ -0,0 +1,59 @@
+import numpy
+
+# columns of InputHistory.data: time, window position, canvas position, pressure, tilt, canvas velocity
+T, X, Y, WX, WY, PRESSURE, TILT_X, TILT_Y, VX, VY = range(10)
+HistoryColumns = 10
+HistoryCapacity = 256
+
+class InputHistory:
+    """ Fixed-capacity ring of timestamped input samples, one row each, with the canvas velocity since the
+        previous sample worked out on append. Every row is written twice, a capacity apart, so the newest
+        n rows are always one contiguous slice: last(n) is a view into the ring, never a copy.
+    """
+    def __init__(self, capacity=HistoryCapacity):
+        self.capacity = capacity
+        self.data = numpy.zeros((capacity * 2, HistoryColumns), dtype=numpy.float64)
+        self.count = 0
+        self.clear()
+
+    def clear(self, t=0.0, pos=(0.0, 0.0), world=(0.0, 0.0), pressure=1.0, tilt=(0.0, 0.0)):
+        """ Empties the history. Every row is set to one still sample, so last(n) is defined straight away. """
+        self.data[:] = (t, pos[0], pos[1], world[0], world[1], pressure, tilt[0], tilt[1], 0.0, 0.0)
+        self.count = 0
+
+    def index(self, age=0):
+        # the newest row's mirrored copy, so anything up to a capacity older sits just below it
+        return (self.count - 1 - age) % self.capacity + self.capacity
+
+    def append(self, t, pos, world, pressure=1.0, tilt=(0.0, 0.0)):
+        prev = self.data[self.index()]
+        dt = t - prev[T]
+        if dt > 0.0:
+            vx = (world[0] - prev[WX]) / dt
+            vy = (world[1] - prev[WY]) / dt
+        else:
+            vx, vy = prev[VX], prev[VY]
+
+        row = (t, pos[0], pos[1], world[0], world[1], pressure, tilt[0], tilt[1], vx, vy)
+        i = self.count % self.capacity
+        self.data[i] = row
+        self.data[i + self.capacity] = row
+        self.count += 1
+
+    def newest(self):
+        return self.data[self.index()]
+
+    def last(self, n):
+        """ The newest n rows, oldest first, as a view (n <= capacity). """
+        i = self.index()
+        return self.data[i - n + 1:i + 1]
+
+    def set_world(self, n, world):
+        """ Moves the canvas position of the newest n samples, e.g. to start a stroke from rest. """
+        for age in range(n):
+            i = self.index(age)
+            for j in (i, i - self.capacity):
+                self.data[j, WX] = world[0]
+                self.data[j, WY] = world[1]
+                self.data[j, VX] = 0.0
+                self.data[j, VY] = 0.0
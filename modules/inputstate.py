@@ -1,9 +1,10 @@
 from copy import deepcopy
 
+from modules.inputhistory import InputHistory, X, Y
+from modules.operators import make_operator
+from modules.prediction import PointerPredictor
 from modules.settings import JsonLoadable, BrushSettings
 
-InputHistoryLength = 4
-
 KeyJustReleased = -1
 KeyNotPressed = 0
 KeyPressed = 1
@@ -11,26 +12,26 @@ KeyPressed = 1
 AxisHorizontal = 0
 AxisVertical = 1
 
-ReleaseCommands = ("view_flip", "color_pick", "swap_color", "set_brush")
+ReleaseCommands = ("view_flip", "color_pick", "swap_color", "set_brush", "set_tip", "canvas_fill")
 
 class InputState:
     def __init__(self):
         self.stylus = None
 
         self.mpos = (0, 0)
-        self.mpos_history = [(0.0,0.0), (0.0, 0.0)]
         self.mpos_w = (0, 0)
-        self.mpos_w_history = [(0.0,0.0), (0.0, 0.0)]
+        # when mpos was sampled, on the same clock as time
+        self.mtime = 0.0
         self.mdelta = (0, 0)
+        # where the pointer was before mpos, newest last; the stroke spline runs through these
+        self.pointer = InputHistory()
+        # every dab of the current stroke
+        self.dabs = InputHistory()
         self.key_state = {}
         init_key_state(self.key_state)
 
-        self.update_input_history(self.mpos_history, (0.0, 0.0))
-
         self.found_stylus = False
         self.stylus_active = False
-        self.stylus_history = []
-        self.draw_history = []
 
         self.mod_state = {
             "ctrl": KeyNotPressed,
@@ -55,6 +56,10 @@ class InputState:
         
         self.brush = BrushSettings()
         self.active_stroke = False
+
+        # seconds, on the same clock as the predictor's samples
+        self.time = 0.0
+        self.predictor = PointerPredictor()
     
     def reset_key_state(self, state):
         for key in state:
@@ -81,7 +86,11 @@ class InputState:
         on = KeyJustReleased if binding["on"] == "release" else KeyPressed
         to = binding["to"]
         
-        self.keybinds.append(KeyBind(keys, motion, operator, on, to))
+        bind = KeyBind(keys, motion, operator, on, to)
+        if not bind.op:
+            print("Unknown keybind command:", operator)
+            return
+        self.keybinds.append(bind)
 
     def smooth_mpos(self, x, y):
         # smoothing with many points didn't seem to work right
@@ -94,19 +103,29 @@ class InputState:
         #     y += p[1] * aexp * a
         
         a = 1.0 - min(max(self.brush.smoothing, 0.0), 1.0) * 0.8
-        p = self.mpos_history[-1]
-        x = x * a + p[0] * (1 - a)
-        y = y * a + p[1] * (1 - a)
+        p = self.pointer.newest()
+        x = x * a + p[X] * (1 - a)
+        y = y * a + p[Y] * (1 - a)
         return x, y
 
-    def update_input_history(self, history, val):
-        history.append(val)
+    def stylus_sample(self):
+        """ Pressure and tilt right now, as plain numbers (the stylus dict is updated in place). """
+        if not self.found_stylus or not self.stylus:
+            return 1.0, (0.0, 0.0)
+        return self.stylus.get("pressure", 1.0), (self.stylus.get("tilt x", 0.5) - 0.5, self.stylus.get("tilt y", 0.5) - 0.5)
+
+    def update_pointer(self, t, x, y, world):
+        """ Takes a new (smoothed) pointer position at time t, in window and canvas coordinates. """
+        newest = self.pointer.newest()
+        if (x, y) != (newest[X], newest[Y]):
+            pressure, tilt = self.stylus_sample()
+            self.pointer.append(self.mtime, self.mpos, self.mpos_w, pressure, tilt)
+            newest = self.pointer.newest()
 
-        hlen = len(history)
-        if hlen < InputHistoryLength:
-            history.extend(([val]*(InputHistoryLength-1)))
-        elif hlen > InputHistoryLength:
-            history.pop(0)
+        self.mpos = (x, y)
+        self.mtime = t
+        self.mdelta = (x - newest[X], y - newest[Y])
+        self.mpos_w = world
 
     def check_keybinds(self, deadzone):
         for bind in self.keybinds:
@@ -154,6 +173,8 @@ class KeyBind:
         self.on = on
         self.md_accum = [0, 0]
         self.to = to
+        # looked up once here rather than by name every frame; None for an unknown operator
+        self.op = make_operator(operator)
 
 def init_key_state(ks):
     ks["enter"] = KeyNotPressed
@@ -0,0 +1,76 @@
+from threading import Event, Thread
+from time import perf_counter
+
+from modules.trace import tracer
+
+InputRingSize = 1024
+
+class InputRing:
+    """ Single producer, single consumer ring of samples. The producer writes a slot and then publishes it
+        by advancing head; the consumer only reads slots below head and advances tail. Each of those is a
+        single store under the GIL, so neither side needs a lock. A consumer that falls a whole ring
+        behind skips the samples that were overwritten.
+    """
+    def __init__(self, size=InputRingSize):
+        self.size = size
+        self.slots = [None] * size
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def push(self, sample):
+        self.slots[self.head % self.size] = sample
+        self.head += 1
+
+    def drain(self):
+        head = self.head
+        tail = self.tail
+        if head - tail > self.size:
+            self.dropped += head - tail - self.size
+            tail = head - self.size
+        samples = [self.slots[i % self.size] for i in range(tail, head)]
+        self.tail = head
+        return samples
+
+class InputSampler(Thread):
+    """ Samples the pointer and stylus at a fixed rate, independent of the frame rate, into an InputRing.
+        Samples are (time, x, y, stylus values or None, stylus active), with x and y in window coordinates
+        from the top left like SDL's, and time from perf_counter.
+    """
+    def __init__(self, devices, window_id, rate, stylus):
+        super().__init__(name="input", daemon=True)
+        self.devices = devices
+        self.window_id = window_id
+        self.period = 1.0 / rate
+        self.stylus = stylus
+        self.ring = InputRing()
+        # set to stop; also what the thread waits on between samples, so stopping doesn't wait a period
+        self.stopping = Event()
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        tracer.name_thread("input")
+        next_sample = perf_counter()
+        while not self.stopping.is_set():
+            x, y = self.devices.query_pointer(self.window_id)
+            values = None
+            active = False
+            if self.stylus:
+                self.devices.poll_devices()
+                values = dict(self.devices.get_device_values("stylus"))
+                active = self.devices.is_device_active("stylus")
+            self.ring.push((perf_counter(), x, y, values, active))
+
+            next_sample += self.period
+            now = perf_counter()
+            if next_sample < now:
+                # fell behind (e.g. a slow X round trip); don't try to catch up
+                next_sample = now
+            else:
+                # a plain wait, not precise_sleep: its spin covers a whole period at 500 Hz and would hold
+                # the GIL the whole time, and samples are timestamped, so waking a little late costs nothing
+                self.stopping.wait(next_sample - now)
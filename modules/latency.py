@@ -0,0 +1,201 @@
+from ctypes import byref
+from json import dumps
+from random import Random
+from statistics import mean, median
+from time import perf_counter
+
+import numpy
+import sdl2
+from OpenGL import GL
+
+from modules.gl.gltypes import AsyncReadback
+from modules.trace import tracer
+
+# each mode is run for the same number of trials; see modules/pacing.py
+LatencyModes = (
+    {"name": "fixed, vsync off", "pacing": "fixed", "vsync": "off"},
+    {"name": "fixed, vsync on", "pacing": "fixed", "vsync": "on"},
+    {"name": "adaptive, vsync off", "pacing": "adaptive", "vsync": "off"},
+    {"name": "adaptive, vsync on", "pacing": "adaptive", "vsync": "on"},
+    {"name": "adaptive, vsync adaptive", "pacing": "adaptive", "vsync": "adaptive"},
+    {"name": "unpaced, vsync off", "pacing": "none", "vsync": "off"},
+)
+LatencyTrials = 30
+LatencyColor = (1.0, 0.0, 1.0, 1.0)
+# length of the injected stroke, in window pixels
+LatencyStroke = 40
+LatencySettleFrames = 3
+LatencyTimeoutFrames = 60
+LatencyReadbacks = 4
+
+class LatencyHarness:
+    """ Measures input to display latency from inside the frame loop. Each trial presses the left button,
+        then warps the pointer along a short horizontal stroke and notes the time. Every frame after that
+        reads back a pixel on the stroke from the view, fenced, just before the swap. The first frame whose
+        pixel has the brush colour gives the latency: up to that frame's swap returning, and up to the
+        moment the fence is seen signalled. Each frame pacing and vsync mode is measured in turn.
+    """
+    def __init__(self, app, trials=LatencyTrials, path=None):
+        self.app = app
+        self.trials = trials
+        self.path = path
+        self.rng = Random(1)
+        self.readbacks = [AsyncReadback(16) for _ in range(LatencyReadbacks)]
+
+        self.mode_index = 0
+        self.results = dict((mode["name"], []) for mode in LatencyModes)
+        self.timeouts = dict((mode["name"], 0) for mode in LatencyModes)
+        # mean and deviation of frame intervals over each mode's last frames
+        self.intervals = {}
+
+        self.frame = 0
+        self.state = "settle"
+        self.state_frame = 0
+        self.injected = 0.0
+        self.injected_frame = 0
+        self.target = (0, 0)
+        self.swaps = {}
+
+        brush = app.input_state.brush
+        brush.color = LatencyColor
+        brush.opacity = 1.0
+        brush.size = 20.0
+        brush.smoothing = 0.0
+        brush.current_prog = "draw"
+        app.input_state.found_stylus = False
+        app.input_state.predictor.lookahead = 0.0
+
+        self.begin_mode()
+
+    def mode(self):
+        return LatencyModes[self.mode_index]
+
+    def begin_mode(self):
+        print(f"Latency: {self.mode()['name']}")
+        self.app.pacer.configure(self.mode()["pacing"], self.mode()["vsync"])
+        self.app.pacer.intervals.clear()
+
+    def push_button(self, down, x, y):
+        event = sdl2.SDL_Event()
+        event.type = sdl2.SDL_MOUSEBUTTONDOWN if down else sdl2.SDL_MOUSEBUTTONUP
+        event.button.type = event.type
+        event.button.windowID = self.app.windowID
+        event.button.button = sdl2.SDL_BUTTON_LEFT
+        event.button.state = sdl2.SDL_PRESSED if down else sdl2.SDL_RELEASED
+        event.button.x = x
+        event.button.y = y
+        sdl2.SDL_PushEvent(byref(event))
+
+    def set_state(self, state):
+        self.state = state
+        self.state_frame = self.frame
+
+    def before_input(self):
+        """ Called at the start of each frame, before events are parsed. """
+        self.app.paused = False
+        w, h = self.app.window_size
+        age = self.frame - self.state_frame
+
+        if self.state == "settle" and age >= LatencySettleFrames:
+            # well inside the window and away from the UI windows in the top left corner
+            x = self.rng.randint(w // 2 - 60, w // 2 + 60 - LatencyStroke)
+            y = self.rng.randint(h // 2 - 60, h // 2 + 60)
+            self.start = (x, y)
+            sdl2.SDL_WarpMouseInWindow(self.app.window, x, y)
+            self.push_button(True, x, y)
+            self.set_state("pressed")
+
+        elif self.state == "pressed" and age >= 2:
+            x, y = self.start
+            # a pixel two thirds of the way along, in view (bottom-up) coordinates
+            self.target = (x + LatencyStroke * 2 // 3, h - y)
+            self.swaps = {}
+            self.injected = perf_counter()
+            self.injected_frame = self.frame
+            tracer.instant("latency inject", "latency")
+            sdl2.SDL_WarpMouseInWindow(self.app.window, x + LatencyStroke, y)
+            self.set_state("waiting")
+
+    def before_swap(self):
+        """ Called after rendering, just before the window is swapped. """
+        if self.state != "waiting":
+            return
+        for readback in self.readbacks:
+            if not readback.busy():
+                readback.start(self.app.renderer.view.fb, self.target[0], self.target[1], 1, 1, GL.GL_RGBA, GL.GL_FLOAT, 16, self.frame)
+                break
+
+    def after_swap(self):
+        """ Called after the swap; returns False once every mode has run. """
+        now = perf_counter()
+        self.swaps[self.frame] = now
+
+        if self.state == "waiting":
+            # oldest frame first, so the first frame showing the stroke is the one counted
+            for readback in sorted((r for r in self.readbacks if r.ready()), key=lambda r: r.tag):
+                if self.state != "waiting":
+                    break
+                frame = readback.tag
+                pixel = numpy.frombuffer(readback.take(), dtype=numpy.float32)
+                if pixel[0] - pixel[1] > 0.3:
+                    self.finish_trial(frame, now)
+            if self.state == "waiting" and self.frame - self.injected_frame > LatencyTimeoutFrames:
+                self.timeouts[self.mode()["name"]] += 1
+                self.end_trial()
+
+        self.frame += 1
+        return self.mode_index < len(LatencyModes)
+
+    def finish_trial(self, frame, now):
+        result = {
+            "frames": frame - self.injected_frame,
+            "to_swap": (self.swaps.get(frame, now) - self.injected) * 1000.0,
+            "to_fence": (now - self.injected) * 1000.0,
+        }
+        self.results[self.mode()["name"]].append(result)
+        tracer.instant("latency detected", "latency", result)
+        self.end_trial()
+
+    def end_trial(self):
+        x, y = self.start
+        self.push_button(False, x + LatencyStroke, y)
+        # drop anything still in flight for this trial
+        for readback in self.readbacks:
+            readback.cancel()
+        self.app.renderer.canvas.clear()
+        self.set_state("settle")
+
+        name = self.mode()["name"]
+        if len(self.results[name]) + self.timeouts[name] >= self.trials:
+            self.intervals[name] = self.app.pacer.stats()
+            self.mode_index += 1
+            if self.mode_index < len(LatencyModes):
+                self.begin_mode()
+
+    def report(self):
+        lines = ["Input to display latency (ms):", f"  {'mode':<26} {'n':>3} {'frames':>6} {'min':>7} {'median':>7} {'p95':>7} {'max':>7} {'fence med':>9} {'interval':>14}"]
+        for mode in LatencyModes:
+            results = self.results[mode["name"]]
+            if not results:
+                lines.append(f"  {mode['name']:<26} no results ({self.timeouts[mode['name']]} timed out)")
+                continue
+            swap = sorted(r["to_swap"] for r in results)
+            lines.append(f"  {mode['name']:<26} {len(results):3d} {mean(r['frames'] for r in results):6.2f} {swap[0]:7.2f} {median(swap):7.2f} {swap[int(len(swap) * 0.95)]:7.2f} {swap[-1]:7.2f} {median(r['to_fence'] for r in results):9.2f} {self.interval_text(mode['name']):>14}")
+            if self.timeouts[mode["name"]]:
+                lines.append(f"    {self.timeouts[mode['name']]} trials timed out")
+        return "\n".join(lines)
+
+    def interval_text(self, name):
+        if name not in self.intervals:
+            return ""
+        mean, deviation = self.intervals[name]
+        return f"{mean:.2f} +- {deviation:.2f}"
+
+    def close(self):
+        for readback in self.readbacks:
+            readback.delete()
+        print(self.report())
+        if self.path:
+            with open(self.path, 'w') as f:
+                f.write(dumps({"modes": LatencyModes, "results": self.results, "timeouts": self.timeouts, "intervals": self.intervals}, indent=2))
+            print(f"Wrote {self.path}")
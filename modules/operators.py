@@ -1,9 +1,20 @@
 from copy import deepcopy
-from math import floor
+from time import perf_counter
 
+import numpy
 from numpy import array
 
-from modules.math import vec2f_dist, vec2f_lerp
+from modules.gl.selection import SelectionRect, SelectionEllipse
+from modules.inputhistory import WX, WY, PRESSURE
+from modules.math import vec2f_dist, vec2f_lerp, vec2f_mat4_mul_inverse
+from modules.symmetry import mirror_dabs
+from modules.trace import tracer
+
+# most dabs drawn for the predicted end of a stroke
+PredictMaxDabs = 64
+
+# operator name: Operator subclass, filled in by @register
+operator_registry = {}
 
 def spline_4p( t, p_1, p0, p1, p2 ):
     """ Catmull-Rom
@@ -16,157 +27,489 @@ def spline_4p( t, p_1, p0, p1, p2 ):
         + t*((4.0 - 3.0*t)*t + 1.0) * p1
         + (t-1.0)*t*t         * p2 ) / 2.0
 
-class Operators:
+def register(name):
+    def add(cls):
+        cls.name = name
+        operator_registry[name] = cls
+        return cls
+    return add
+
+def make_operator(name):
+    """ A new instance of the operator registered as name, or None. Each KeyBind gets its own. """
+    cls = operator_registry.get(name)
+    return cls() if cls else None
+
+class Operator:
+    """ Something a key binding does. start runs on the first frame the bind is active, then update on
+        that frame and every frame after it while the bind stays active, then finish once when it's let go.
+    """
+    name = ""
+
     def __init__(self):
+        self.active = False
+
+    def start(self, bind, renderer, input_state):
+        pass
+
+    def update(self, bind, renderer, input_state):
+        pass
+
+    def finish(self, bind, renderer, input_state):
         pass
-    
+
+class Operators:
+    def __init__(self):
+        # timing counters, off unless turned on from the Operators window
+        self.timing = False
+        # operator name: [calls, total seconds, longest call]
+        self.stats = {}
+
     def do(self, bind, finish, renderer, input_state):
-        if not bind:
+        if not bind or not bind.op:
             return
-        
-        elif bind.operator == "canvas_draw":
-            if finish:
-                input_state.draw_history = []
-                input_state.active_stroke = False
-                return
-
-            mpw = input_state.mpos_w_history
-            cur_mpos = input_state.mpos_w
-
-            if not input_state.active_stroke:
-                mpw[-3] = cur_mpos
-                mpw[-2] = cur_mpos
-                mpw[-1] = cur_mpos
-            
-            p0 = array(mpw[-3], dtype="float32")
-            p1 = array(mpw[-2], dtype="float32")
-            p2 = array(mpw[-1], dtype="float32")
-            p3 = array(cur_mpos, dtype="float32")
 
-            spacing = max(input_state.brush.size / 60.0, 1.0)
+        op = bind.op
+        tracer.begin(op.name, "operator", {"finish": finish} if finish else None)
+        if self.timing:
+            start = perf_counter()
 
-            radius = input_state.brush.size * 0.5
-            pressure = input_state.stylus["pressure"] if input_state.found_stylus else 1.0
-            p_pressure = input_state.stylus_history[-1]["pressure"] if input_state.stylus_history else pressure
-            opacity_start = input_state.brush.opacity / radius
-            
-            delta = ((cur_mpos[0] - mpw[-1][0]), (cur_mpos[1] - mpw[-1][1]))
-            motion = ( -0.5 * delta[0], -0.5 * delta[1] )
-            
-            pos_p = input_state.draw_history[-1] if input_state.active_stroke and input_state.draw_history else cur_mpos
-
-            if input_state.active_stroke and p2[0] == p1[0] and p2[1] == p1[1]:
-                return
-
-            t = 0.0
-            t_inc = 0.005
-            while t < 1.0:
-                t += t_inc
-                xy = spline_4p(t, p0, p1, p2, p3)
-
-                dist = min(vec2f_dist( xy, pos_p ), spacing)
-                if input_state.active_stroke and dist < spacing:
-                    continue
-                
-                opacity = opacity_start * dist
-                pos_p = xy
-
-                renderer.canvas.render(
-                    renderer.screen.vao,
-                    input_state.brush.progs[input_state.brush.current_prog],
-                    {
-                        "brushcolor": input_state.brush.color,
-                        "softness": input_state.brush.softness,
-                        "radius": radius,
-                        "pressure": p_pressure,
-                        "opacity": opacity,
-                        "mpos": xy,
-                        "motion": motion,
-                        "px": 1.0 / renderer.canvas.fbs[0].width,
-                        "sz": renderer.canvas.fbs[0].width,
-                        "mixamount": input_state.brush.mixamount * 0.99
-                    }
-                )
-                input_state.update_input_history(input_state.draw_history, xy)
-                input_state.update_input_history(input_state.stylus_history, input_state.stylus)
-            
-            input_state.active_stroke = True
-        
-        elif bind.operator == "canvas_clear":
-            renderer.canvas.clear()
-        
-        elif bind.operator == "brush_resize":
-            brush = input_state.brush
-            
-            if finish:
-                brush.showcolor = False
-                return
+        if finish:
+            op.active = False
+            op.finish(bind, renderer, input_state)
+        else:
+            if not op.active:
+                op.active = True
+                op.start(bind, renderer, input_state)
+            op.update(bind, renderer, input_state)
 
-            brush.showcolor = True
-            amount = (input_state.mdelta[input_state.active_axis] * 1.5) / renderer.view_scale_amount
-            brush.size = max(brush.size + amount, 1.0)
-        
-        elif bind.operator == "brush_soften":
-            brush = input_state.brush
+        if self.timing:
+            elapsed = perf_counter() - start
+            stat = self.stats.setdefault(op.name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+        tracer.end(op.name, "operator")
 
-            if finish:
-                brush.showcolor = False
-                return
-            
-            brush.showcolor = True
-            amount = input_state.mdelta[input_state.active_axis] / 180.0
-            brush.softness = min(max(brush.softness + amount, 0.0), 1.0)
-        
-        elif bind.operator == "view_pan":
-            xy = input_state.mdelta
-            renderer.view_translate(xy[0], xy[1])
+    def stats_report(self):
+        lines = []
+        for name, (calls, total, longest) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name}: {calls} calls, {total / calls * 1000.0:.3f} ms avg, {longest * 1000.0:.3f} ms max, {total * 1000.0:.1f} ms total")
+        return lines
+
+def predict_dabs(renderer, input_state, start, radius, spacing, opacity):
+    """ Fills the gap between the last real dab and where the pen is predicted to be by the time the
+        frame is shown, with dabs drawn over the view for this frame only.
+    """
+    predictor = input_state.predictor
+    if not predictor.enabled() or input_state.brush.current_prog != "draw" or input_state.brush.tip:
+        return
+    # the overlay doesn't know about the selection, so it would show dabs that won't land
+    if renderer.selection and renderer.selection.active():
+        return
+    # nor about symmetry, so it would only lead one of the copies
+    if input_state.brush.symmetry != "off":
+        return
+    predicted = predictor.predict(input_state.time)
+    if not predicted:
+        return
+
+    end = vec2f_mat4_mul_inverse(renderer.view_transform, predicted)
+    count = min(int(vec2f_dist(start, end) / spacing), PredictMaxDabs)
+    if count < 1:
+        return
+    dabs = [vec2f_lerp(start, end, (i + 1) / count) for i in range(count)]
+    renderer.prediction = (dabs, {
+        "brushcolor": input_state.brush.color,
+        "softness": input_state.brush.softness,
+        "radius": radius,
+        "opacity": opacity * max(vec2f_dist(start, end) / count / spacing, 1.0),
+    })
+
+def dab_uniforms(renderer, input_state, radius):
+    """ What every dab of a stroke shares; mpos, opacity and pressure are added per dab. """
+    brush = input_state.brush
+    uniforms = {
+        "brushcolor": brush.color,
+        "softness": brush.softness,
+        "radius": radius,
+        "px": 1.0 / renderer.canvas.fbs[0].width,
+        "sz": renderer.canvas.fbs[0].width,
+        "mixamount": brush.mixamount * 0.99,
+        "smudgelength": brush.smudge_length,
+        "tips": renderer.tips,
+        "tip": renderer.tips.index(brush.tip),
+    }
+    uniforms.update(renderer.selection_uniforms())
+    return uniforms
+
+def symmetry_centre(renderer, brush):
+    if brush.symmetry_centre:
+        return brush.symmetry_centre
+    width, height = renderer.layers.size
+    return (width * 0.5, height * 0.5)
+
+def draw_dabs(renderer, input_state, engine, uniforms, points, opacities, pressures):
+    """ Draws dabs (points n x 2, canvas pixels, with an opacity and pressure each) with the current
+        brush, adding their mirrored copies if symmetry is on, as one batch. Returns how many were drawn.
+    """
+    brush = input_state.brush
+    # each dab is followed by its copies; engines that carry state along a stroke keep it per copy
+    copies = 1
+    if brush.symmetry != "off":
+        count = len(points)
+        points, opacities, pressures = mirror_dabs(points, opacities, pressures,
+            brush.symmetry, brush.symmetry_count, symmetry_centre(renderer, brush))
+        copies = len(points) // count if count else 1
+    if len(points) == 0:
+        return 0
+
+    # tiles of an opened document still on disk have to be on the canvas before they're drawn over
+    reach = uniforms["radius"] + 2.0
+    lo = numpy.min(points, axis=0) - reach
+    hi = numpy.max(points, axis=0) + reach
+    renderer.page_in((lo[0], lo[1], hi[0], hi[1]), renderer.layers.active_layer())
+
+    # plain floats: the GL calls per dab take them faster than numpy scalars
+    points = numpy.asarray(points).tolist()
+    opacities = numpy.asarray(opacities).tolist()
+    pressures = numpy.asarray(pressures).tolist()
+    if engine:
+        for i, (xy, opacity, pressure) in enumerate(zip(points, opacities, pressures)):
+            values = dict(uniforms)
+            values.update({"mpos": xy, "opacity": opacity, "pressure": pressure})
+            engine.dab(renderer.canvas, renderer.dab_vao, values, i % copies)
+        return len(points)
+    return renderer.canvas.render_batch(renderer.dab_vao, brush.progs[brush.current_prog], uniforms,
+        zip(points, opacities, pressures))
+
+def stroke(renderer, input_state, points, pressures):
+    """ Draws a whole stroke at once with the current brush, as submitted over the control socket:
+        points (n x 2, canvas pixels) are resampled at the brush spacing and drawn as one batch.
+        Returns the number of dabs drawn.
+    """
+    brush = input_state.brush
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    pressures = numpy.asarray(pressures, dtype=numpy.float64).reshape(-1)
+    if len(points) == 0 or len(pressures) != len(points):
+        return 0
+
+    spacing = max(brush.size / 60.0, 1.0)
+    radius = brush.size * 0.5
+    # a continuous stroke's dabs are a full spacing apart, so they all get the full-spacing opacity
+    opacity = brush.opacity / radius * spacing
+
+    lengths = numpy.concatenate(([0.0], numpy.cumsum(numpy.hypot(*numpy.diff(points, axis=0).T))))
+    at = numpy.arange(0.0, lengths[-1] + spacing * 0.5, spacing)
+    xs = numpy.interp(at, lengths, points[:, 0])
+    ys = numpy.interp(at, lengths, points[:, 1])
+    ps = numpy.interp(at, lengths, pressures)
+
+    uniforms = dab_uniforms(renderer, input_state, radius)
+    engine = renderer.engines.get(brush.current_prog)
+    with tracer.span("stroke batch", "dabs", {"dabs": len(at)}):
+        if engine:
+            engine.begin_stroke()
+        return draw_dabs(renderer, input_state, engine, uniforms, numpy.stack((xs, ys), axis=1),
+            numpy.full(len(at), opacity), ps)
+
+@register("canvas_draw")
+class CanvasDraw(Operator):
+    def update(self, bind, renderer, input_state):
+        cur_mpos = input_state.mpos_w
+
+        if not input_state.active_stroke:
+            input_state.pointer.set_world(3, cur_mpos)
         
-        elif bind.operator == "view_rot":
-            angle = input_state.mdelta[input_state.active_axis] * -0.005
-            xy = input_state.operator_start_mpos
-            renderer.view_rotate_at_point(xy[0], xy[1], angle)
-
-        elif bind.operator == "view_zoom":
-            scale = 1.0 + (input_state.mdelta[input_state.active_axis] * -0.01)
-            xy = input_state.operator_start_mpos
-            renderer.view_scale_at_point(xy[0], xy[1], scale)
-
-        elif bind.operator == "color_pick":
-            if finish:
-                return
-            xy = input_state.mpos
-            input_state.brush.color = renderer.view.read_pixel(xy[0], xy[1])
-
-        elif bind.operator == "view_reset":
-            if finish:
-                return
-            
-            renderer.view_reset()
+        # rows of the history itself, not copies
+        p0, p1, p2 = input_state.pointer.last(3)[:, WX:WY + 1]
+        p3 = array(cur_mpos)
 
-        elif bind.operator == "view_flip":
-            if finish:
-                return
-            
-            x = input_state.mpos[0]
-            renderer.view_flip_at_point(x)
+        spacing = max(input_state.brush.size / 60.0, 1.0)
+
+        radius = input_state.brush.size * 0.5
+        pressure, tilt = input_state.stylus_sample()
+        # the pressure at the previous dab, so a batch doesn't jump to the newest reading
+        p_pressure = input_state.dabs.newest()[PRESSURE] if input_state.dabs.count else pressure
+        opacity_start = input_state.brush.opacity / radius
         
-        elif bind.operator == "set_brush":
-            if finish:
-                return
+        pos_p = tuple(input_state.dabs.newest()[WX:WY + 1]) if input_state.active_stroke and input_state.dabs.count else cur_mpos
+
+        if input_state.active_stroke and p2[0] == p1[0] and p2[1] == p1[1]:
+            return
+
+        engine = renderer.engines.get(input_state.brush.current_prog)
+        shared = dab_uniforms(renderer, input_state, radius)
+        if engine and not input_state.active_stroke:
+            engine.begin_stroke()
+        tracer.begin("dab batch", "dabs")
+        # placed first, then drawn (with any mirrored copies) in one batch
+        points = []
+        opacities = []
+        t = 0.0
+        # enough steps to place dabs at the spacing; with the input thread a frame can draw many short segments
+        segment = vec2f_dist(p1, p2)
+        t_inc = min(max(spacing / (segment * 4.0), 0.005), 0.25) if segment > 0.0 else 0.005
+        while t < 1.0:
+            t += t_inc
+            xy = spline_4p(t, p0, p1, p2, p3)
+
+            dist = min(vec2f_dist( xy, pos_p ), spacing)
+            if input_state.active_stroke and dist < spacing:
+                continue
             
-            name = input_state.active_bind.to
-            if name in input_state.brush.progs:
-                print(f"Set brush: {name}")
-                input_state.brush.current_prog = name
-            else:
-                print(f"Unknown brush: {name}")
+            opacity = opacity_start * dist
+            pos_p = xy
+
+            points.append(xy)
+            opacities.append(opacity)
+            input_state.dabs.append(input_state.mtime, input_state.mpos, xy, pressure, tilt)
+        dab_count = 0
+        if points:
+            dab_count = draw_dabs(renderer, input_state, engine, shared, points, opacities, [p_pressure] * len(points))
+        tracer.end("dab batch", "dabs", {"dabs": dab_count})
+
+        predict_dabs(renderer, input_state, pos_p, radius, spacing, opacity_start * spacing * p_pressure)
         
-        elif bind.operator == "swap_color":
-            if finish:
-                return
-            
-            brush = input_state.brush
+        input_state.active_stroke = True
+
+    def finish(self, bind, renderer, input_state):
+        input_state.dabs.clear()
+        input_state.active_stroke = False
+        renderer.prediction = None
+
+@register("canvas_clear")
+class CanvasClear(Operator):
+    def start(self, bind, renderer, input_state):
+        renderer.canvas.clear()
+
+@register("canvas_fill")
+class CanvasFill(Operator):
+    def start(self, bind, renderer, input_state):
+        x, y = input_state.mpos_w
+        renderer.fill(x, y, input_state.brush)
+
+@register("select_rect")
+class SelectRect(Operator):
+    """ Selects the rectangle dragged out from where the bind started; a click selects nothing. """
+    shape = SelectionRect
+
+    def start(self, bind, renderer, input_state):
+        self.anchor = tuple(input_state.mpos_w)
+
+    def update(self, bind, renderer, input_state):
+        renderer.selection.select_shape(renderer.layers.size, self.shape, self.anchor, input_state.mpos_w)
+
+    def finish(self, bind, renderer, input_state):
+        x, y = input_state.mpos_w
+        if abs(x - self.anchor[0]) < 1.0 or abs(y - self.anchor[1]) < 1.0:
+            renderer.selection.clear()
+
+@register("select_ellipse")
+class SelectEllipse(SelectRect):
+    shape = SelectionEllipse
+
+@register("select_lasso")
+class SelectLasso(Operator):
+    """ Selects inside the path the pointer draws while the bind is held, closed back to its start. """
+    def start(self, bind, renderer, input_state):
+        self.points = [tuple(input_state.mpos_w)]
+
+    def update(self, bind, renderer, input_state):
+        xy = tuple(input_state.mpos_w)
+        if vec2f_dist(xy, self.points[-1]) < 1.0:
+            return
+        self.points.append(xy)
+        renderer.selection.select_lasso(renderer.layers.size, self.points)
+
+    def finish(self, bind, renderer, input_state):
+        if len(self.points) < 3:
+            renderer.selection.clear()
+        self.points = []
+
+@register("select_clear")
+class SelectClear(Operator):
+    def start(self, bind, renderer, input_state):
+        renderer.selection.clear()
+
+@register("transform_move")
+class TransformMove(Operator):
+    """ Moves the selection, lifting it to transform on first use; transform_apply puts it down. """
+    def start(self, bind, renderer, input_state):
+        self.lifted = renderer.transform_begin()
+
+    def update(self, bind, renderer, input_state):
+        if not self.lifted:
+            return
+        x, y = input_state.mpos
+        dx, dy = input_state.mdelta
+        a = vec2f_mat4_mul_inverse(renderer.view_transform, (x - dx, y - dy))
+        b = vec2f_mat4_mul_inverse(renderer.view_transform, (x, y))
+        renderer.transform.translate(b[0] - a[0], b[1] - a[1])
+
+@register("transform_rotate")
+class TransformRotate(TransformMove):
+    def update(self, bind, renderer, input_state):
+        if self.lifted:
+            renderer.transform.rotate(input_state.mdelta[input_state.active_axis] * -0.005)
+
+@register("transform_scale")
+class TransformScale(TransformMove):
+    def update(self, bind, renderer, input_state):
+        if self.lifted:
+            renderer.transform.scale(1.0 + (input_state.mdelta[input_state.active_axis] * -0.01))
+
+@register("transform_apply")
+class TransformApply(Operator):
+    def start(self, bind, renderer, input_state):
+        renderer.transform_apply()
+
+@register("transform_cancel")
+class TransformCancel(Operator):
+    def start(self, bind, renderer, input_state):
+        renderer.transform_cancel()
+
+@register("symmetry_centre")
+class SymmetryCentre(Operator):
+    """ Moves the centre symmetric strokes are mirrored about to the pointer. """
+    def start(self, bind, renderer, input_state):
+        x, y = input_state.mpos_w
+        input_state.brush.symmetry_centre = [x, y]
+        print(f"Symmetry centre: {x:.0f}, {y:.0f}")
+
+@register("layer_add")
+class LayerAdd(Operator):
+    def finish(self, bind, renderer, input_state):
+        renderer.add_layer()
+
+@register("layer_remove")
+class LayerRemove(Operator):
+    def finish(self, bind, renderer, input_state):
+        renderer.remove_layer()
+
+@register("layer_select")
+class LayerSelect(Operator):
+    def finish(self, bind, renderer, input_state):
+        # "to" is "up" or "down" through the stack
+        offset = -1 if bind.to == "down" else 1
+        renderer.select_layer(renderer.layers.active + offset)
+
+@register("document_save")
+class DocumentSave(Operator):
+    # only once, when the keys are let go
+    def finish(self, bind, renderer, input_state):
+        renderer.save_document(bind.to if bind.to else renderer.document_path)
+
+@register("document_open")
+class DocumentOpen(Operator):
+    def finish(self, bind, renderer, input_state):
+        renderer.open_document(bind.to if bind.to else renderer.document_path)
+
+@register("filter_apply")
+class FilterApply(Operator):
+    # "to" names the filter; empty is the one selected in the Filters window
+    def start(self, bind, renderer, input_state):
+        renderer.apply_filter(bind.to)
+
+@register("brush_resize")
+class BrushResize(Operator):
+    def update(self, bind, renderer, input_state):
+        brush = input_state.brush
+        brush.showcolor = True
+        amount = (input_state.mdelta[input_state.active_axis] * 1.5) / renderer.view_scale_amount
+        brush.size = max(brush.size + amount, 1.0)
+
+    def finish(self, bind, renderer, input_state):
+        input_state.brush.showcolor = False
+
+@register("brush_soften")
+class BrushSoften(Operator):
+    def update(self, bind, renderer, input_state):
+        brush = input_state.brush
+        brush.showcolor = True
+        amount = input_state.mdelta[input_state.active_axis] / 180.0
+        brush.softness = min(max(brush.softness + amount, 0.0), 1.0)
+
+    def finish(self, bind, renderer, input_state):
+        input_state.brush.showcolor = False
+
+@register("view_pan")
+class ViewPan(Operator):
+    def update(self, bind, renderer, input_state):
+        xy = input_state.mdelta
+        renderer.view_translate(xy[0], xy[1])
+
+@register("view_rot")
+class ViewRotate(Operator):
+    def update(self, bind, renderer, input_state):
+        angle = input_state.mdelta[input_state.active_axis] * -0.005
+        xy = input_state.operator_start_mpos
+        renderer.view_rotate_at_point(xy[0], xy[1], angle)
+
+@register("view_zoom")
+class ViewZoom(Operator):
+    def update(self, bind, renderer, input_state):
+        scale = 1.0 + (input_state.mdelta[input_state.active_axis] * -0.01)
+        xy = input_state.operator_start_mpos
+        renderer.view_scale_at_point(xy[0], xy[1], scale)
+
+@register("color_pick")
+class ColorPick(Operator):
+    def update(self, bind, renderer, input_state):
+        brush = input_state.brush
+
+        # the pick requested on an earlier frame
+        color = renderer.picker.poll(False)
+        if color:
+            brush.color = color
+
+        xy = input_state.mpos
+        if brush.pick_footprint:
+            renderer.picker.request(renderer.view.fb, xy[0], xy[1], brush.size * renderer.view_scale_amount, True)
+        else:
+            renderer.picker.request(renderer.view.fb, xy[0], xy[1], brush.pick_size, False)
+
+    def finish(self, bind, renderer, input_state):
+        # when the keys are let go take the last one regardless
+        color = renderer.picker.poll(True)
+        if color:
+            input_state.brush.color = color
+
+@register("view_reset")
+class ViewReset(Operator):
+    def start(self, bind, renderer, input_state):
+        renderer.view_reset()
+
+@register("view_flip")
+class ViewFlip(Operator):
+    def start(self, bind, renderer, input_state):
+        x = input_state.mpos[0]
+        renderer.view_flip_at_point(x)
+
+@register("set_brush")
+class SetBrush(Operator):
+    def start(self, bind, renderer, input_state):
+        name = bind.to
+        if name in input_state.brush.progs or name in renderer.engines:
+            print(f"Set brush: {name}")
+            input_state.brush.current_prog = name
+        else:
+            print(f"Unknown brush: {name}")
+
+@register("set_tip")
+class SetTip(Operator):
+    def start(self, bind, renderer, input_state):
+        name = bind.to
+        if not name or name in renderer.tips.names:
+            print(f"Set tip: {name or 'round'}")
+            input_state.brush.tip = name
+        else:
+            print(f"Unknown tip: {name}")
+
+@register("swap_color")
+class SwapColor(Operator):
+    def start(self, bind, renderer, input_state):
+        brush = input_state.brush
 
-            temp = deepcopy(brush.color)
-            brush.color = brush.color2
-            brush.color2 = temp
+        temp = deepcopy(brush.color)
+        brush.color = brush.color2
+        brush.color2 = temp
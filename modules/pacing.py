@@ -0,0 +1,139 @@
+from collections import deque
+from ctypes import byref
+from time import perf_counter, sleep
+
+import sdl2
+from OpenGL import GL
+
+from modules.trace import tracer
+
+PACING_MODES = ("adaptive", "fixed", "none")
+VSYNC_MODES = ("off", "on", "adaptive")
+
+# frames of work time kept to estimate the next frame's cost
+PacingHistory = 60
+# the estimate is this percentile of recent frames, so an occasional slow one doesn't miss the deadline
+PacingPercentile = 0.9
+# slack for sleep overshoot and swap overhead, in seconds
+PacingMargin = 0.001
+# sleep() is trusted up to this close to the target, after that it spins
+PacingSpin = 0.002
+FenceTimeout = 100 * 1000 * 1000
+
+class FramePacer:
+    """ Decides when each frame starts. In adaptive mode a frame starts as late as it can before the next
+        refresh and still make it, judging by what recent frames cost, so input is sampled as close to the
+        swap as possible. Fixed mode keeps the old millisecond SDL_Delay at a set frame rate. A fence per
+        frame caps how many frames the driver may queue ahead of the display.
+    """
+    def __init__(self, window, mode="adaptive", vsync="on", fps=120.0, frames_in_flight=1):
+        self.window = window
+        self.fps = fps
+        self.frames_in_flight = frames_in_flight
+        self.costs = deque(maxlen=PacingHistory)
+        self.intervals = deque(maxlen=PacingHistory)
+        self.fences = deque()
+        self.frame_start = perf_counter()
+        self.work_end = self.frame_start
+        self.last_start = None
+        self.deadline = None
+        self.configure(mode, vsync)
+
+    def configure(self, mode, vsync):
+        if mode not in PACING_MODES:
+            print(f"ERROR: Unknown frame pacing {mode}, using adaptive.")
+            mode = "adaptive"
+        self.mode = mode
+
+        self.vsync = vsync
+        interval = {"off": 0, "on": 1, "adaptive": -1}.get(vsync, 1)
+        if sdl2.SDL_GL_SetSwapInterval(interval) != 0 and interval == -1:
+            # late swap tearing isn't supported everywhere
+            self.vsync = "on"
+            sdl2.SDL_GL_SetSwapInterval(1)
+
+        self.refresh = self.detect_refresh()
+        self.period = 1.0 / (self.refresh if self.refresh > 0 else self.fps)
+        if self.mode == "fixed":
+            self.period = 1.0 / self.fps
+        self.deadline = None
+        self.costs.clear()
+        print(f"Frame pacing: {self.mode}, vsync {self.vsync}, {1.0 / self.period:.1f} Hz")
+
+    def detect_refresh(self):
+        display_mode = sdl2.SDL_DisplayMode()
+        index = sdl2.SDL_GetWindowDisplayIndex(self.window)
+        if index < 0 or sdl2.SDL_GetCurrentDisplayMode(index, byref(display_mode)) != 0:
+            return 0
+        return display_mode.refresh_rate
+
+    def estimate_cost(self):
+        if not self.costs:
+            return self.period * 0.5
+        costs = sorted(self.costs)
+        return costs[min(int(len(costs) * PacingPercentile), len(costs) - 1)]
+
+    def wait(self):
+        """ Returns once it's time to start the next frame. """
+        now = perf_counter()
+        if self.mode == "fixed":
+            if self.deadline is not None and now < self.deadline:
+                with tracer.span("delay", "frame"):
+                    sdl2.SDL_Delay(int((self.deadline - now) * 1000.0))
+        elif self.mode == "adaptive" and self.deadline is not None:
+            start = self.deadline - self.estimate_cost() - PacingMargin
+            if now < start:
+                with tracer.span("pacing wait", "frame", {"cost": self.estimate_cost() * 1000.0}):
+                    precise_sleep(start)
+
+        self.frame_start = perf_counter()
+        if self.last_start is not None:
+            self.intervals.append(self.frame_start - self.last_start)
+        self.last_start = self.frame_start
+
+    def before_swap(self):
+        self.work_end = perf_counter()
+        self.costs.append(self.work_end - self.frame_start)
+
+    def after_swap(self):
+        now = perf_counter()
+        if self.mode == "fixed":
+            # as before: the next frame is due one period after this one finished
+            self.deadline = now + self.period
+        elif self.vsync != "off":
+            # the swap returns at (about) the refresh, so the next one is a period later
+            self.deadline = now + self.period
+        else:
+            self.deadline = self.deadline + self.period if self.deadline else now + self.period
+            if self.deadline < now:
+                self.deadline = now + self.period
+
+        if self.frames_in_flight > 0:
+            self.fences.append(GL.glFenceSync( GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0 ))
+            while len(self.fences) > self.frames_in_flight:
+                fence = self.fences.popleft()
+                with tracer.span("frames in flight", "frame"):
+                    GL.glClientWaitSync( fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, FenceTimeout )
+                GL.glDeleteSync(fence)
+
+    def stats(self):
+        """ Mean and standard deviation of recent frame intervals, in milliseconds. """
+        if not self.intervals:
+            return 0.0, 0.0
+        n = len(self.intervals)
+        mean = sum(self.intervals) / n
+        variance = sum((i - mean) ** 2 for i in self.intervals) / n
+        return mean * 1000.0, variance ** 0.5 * 1000.0
+
+    def close(self):
+        for fence in self.fences:
+            GL.glDeleteSync(fence)
+        self.fences.clear()
+
+def precise_sleep(until):
+    remaining = until - perf_counter()
+    while remaining > PacingSpin:
+        sleep(remaining - PacingSpin)
+        remaining = until - perf_counter()
+    while perf_counter() < until:
+        pass
@@ -0,0 +1,68 @@
+from collections import deque
+from math import sqrt
+
+# samples older than this (seconds) relative to the newest don't count towards the velocity
+PredictWindow = 0.05
+# no prediction once the pointer has been still this long
+PredictStale = 0.1
+PredictMinSamples = 3
+# never predict further than this many pixels ahead
+PredictMaxDistance = 120.0
+
+class PointerPredictor:
+    """ Extrapolates the pointer a few milliseconds ahead from its recent timestamped positions,
+        using a least-squares velocity over the last PredictWindow seconds.
+    """
+    def __init__(self, lookahead=0.0):
+        self.lookahead = lookahead
+        self.samples = deque(maxlen=32)
+
+    def enabled(self):
+        return self.lookahead > 0.0
+
+    def reset(self):
+        self.samples.clear()
+
+    def add(self, t, x, y):
+        if self.samples and t < self.samples[-1][0]:
+            self.samples.clear()
+        self.samples.append((t, x, y))
+
+    def velocity(self):
+        if len(self.samples) < PredictMinSamples:
+            return None
+        t_last = self.samples[-1][0]
+        recent = [s for s in self.samples if t_last - s[0] <= PredictWindow]
+        if len(recent) < PredictMinSamples:
+            return None
+
+        n = float(len(recent))
+        mt = sum(s[0] for s in recent) / n
+        mx = sum(s[1] for s in recent) / n
+        my = sum(s[2] for s in recent) / n
+        stt = sum((s[0] - mt) ** 2 for s in recent)
+        if stt <= 0.0:
+            return None
+        vx = sum((s[0] - mt) * (s[1] - mx) for s in recent) / stt
+        vy = sum((s[0] - mt) * (s[2] - my) for s in recent) / stt
+        return vx, vy
+
+    def predict(self, now, ahead=None):
+        """ Where the pointer is expected to be at now + ahead seconds, or None if there's nothing to go on. """
+        if ahead is None:
+            ahead = self.lookahead
+        if not self.samples or now - self.samples[-1][0] > PredictStale:
+            return None
+        v = self.velocity()
+        if not v:
+            return None
+
+        t, x, y = self.samples[-1]
+        dt = now - t + ahead
+        dx = v[0] * dt
+        dy = v[1] * dt
+        dist = sqrt(dx * dx + dy * dy)
+        if dist > PredictMaxDistance:
+            dx *= PredictMaxDistance / dist
+            dy *= PredictMaxDistance / dist
+        return x + dx, y + dy
@@ -2,20 +2,24 @@ from sys import platform
 from ctypes import byref, c_int
 from os.path import isfile
 from json import loads
+from time import perf_counter
 
 import sdl2
 
-if platform.startswith("linux"):
-    from modules.devices.xdevices import Devices
-elif platform.startswith("win32"):
-    from modules.devices.windevices import Devices
-
+from modules.autosave import Autosave, recover_autosave
 from modules.math import vec2f_mat4_mul_inverse
-from modules.gl.glrenderer import Renderer
-from modules.inputstate import InputState, KeyPressed, KeyNotPressed, KeyJustReleased, InputHistoryLength
+from modules.gl.glrenderer import Renderer, FIRST_FRAME_PROGRAMS
+from modules.gl.gltypes import load_program, reload_programs, program_errors
+from modules.inputstate import InputState, KeyPressed, KeyNotPressed, KeyJustReleased
+from modules.inputthread import InputSampler
 from modules.operators import Operators
+from modules.pacing import FramePacer
 from modules.settings import Settings
-from modules.ui_imgui import UI
+from modules.shaderwatch import ShaderWatcher
+from modules.startup import startup
+from modules.trace import tracer
+
+# device discovery (Xlib) and imgui aren't needed for the first frame, so they're imported in finish_startup
 
 class App:
     def __init__(self, title):
@@ -33,6 +37,84 @@ class App:
         if "settings" in json:
             self.settings.from_json(json["settings"])
         
+        with startup.phase("sdl/gl init"):
+            self.init_window(title)
+            s = self.settings
+            self.pacer = FramePacer(self.window, s.frame_pacing, s.vsync, s.fps, s.frames_in_flight)
+
+        self.input_state = InputState()
+        if "bindings" in json:
+            for binding in json["bindings"]:
+                self.input_state.add_keybind(binding)
+        if "brush" in json:
+            self.input_state.brush.from_json(json["brush"])
+
+        with startup.phase("shader compile"):
+            for v_fpath, f_fpath in FIRST_FRAME_PROGRAMS:
+                load_program(v_fpath, f_fpath)
+
+        with startup.phase("renderer init"):
+            self.renderer = Renderer(self.window_size, self.settings.canvas_size, self.input_state, self.settings.canvas_format, self.settings.view_format)
+            self.renderer.document_path = self.settings.document_path
+            self.autosave = Autosave(self.settings)
+
+        self.input_state.predictor.lookahead = self.settings.predict_ms / 1000.0
+
+        self.shader_watcher = ShaderWatcher("shaders")
+        self.devices = None
+        self.sampler = None
+        self.samples = []
+        self.ui = None
+
+        self.event = sdl2.SDL_Event()
+        
+        self.running = True
+
+    def finish_startup(self):
+        """ Everything the first frame can do without: brushes, devices, the UI. """
+        with startup.phase("brush shader compile"):
+            self.input_state.brush.load_programs()
+            self.renderer.load_engines()
+
+        with startup.phase("brush tips"):
+            self.renderer.load_tips(self.input_state.brush.tips)
+
+        with startup.phase("device discovery"):
+            if platform.startswith("linux"):
+                from modules.devices.xdevices import Devices
+            elif platform.startswith("win32"):
+                from modules.devices.windevices import Devices
+            self.devices = Devices()
+            self.input_state.found_stylus = self.devices.add_device("stylus")
+            if self.settings.input_rate > 0:
+                self.start_input_sampler()
+
+        with startup.phase("imgui init"):
+            from modules.ui_imgui import UI
+            self.ui = UI(self.window)
+
+        if self.settings.watch_shaders:
+            self.shader_watcher.start()
+        startup.mark_ready()
+
+    def start_input_sampler(self):
+        window_id = self.x11_window_id()
+        if window_id is None or not hasattr(self.devices, "query_pointer"):
+            print("Input thread needs X11, sampling input once per frame instead.")
+            return
+        # from here on the sampler thread is the only one using self.devices
+        self.sampler = InputSampler(self.devices, window_id, self.settings.input_rate, self.input_state.found_stylus)
+        self.sampler.start()
+        print(f"Sampling input at {self.settings.input_rate:.0f} Hz")
+
+    def x11_window_id(self):
+        wm_info = sdl2.SDL_SysWMinfo()
+        sdl2.SDL_VERSION(wm_info.version)
+        if not sdl2.SDL_GetWindowWMInfo(self.window, byref(wm_info)) or wm_info.subsystem != sdl2.SDL_SYSWM_X11:
+            return None
+        return wm_info.info.x11.window
+
+    def init_window(self, title):
         if sdl2.SDL_Init(sdl2.SDL_INIT_VIDEO) != 0:
             print(sdl2.SDL_GetError())
         
@@ -64,24 +146,6 @@ class App:
         
         self.context = sdl2.SDL_GL_CreateContext(self.window)
 
-        self.input_state = InputState()
-        if "bindings" in json:
-            for binding in json["bindings"]:
-                self.input_state.add_keybind(binding)
-        if "brush" in json:
-            self.input_state.brush.from_json(json["brush"])
-
-        self.devices = Devices()
-        self.input_state.found_stylus = self.devices.add_device("stylus")
-
-        self.renderer = Renderer(self.window_size, self.settings.canvas_size, self.input_state)
-
-        self.event = sdl2.SDL_Event()
-        
-        self.running = True
-
-        self.ui = UI(self.window)
-
     def update_window_size(self):
         w = c_int()
         h = c_int()
@@ -93,9 +157,16 @@ class App:
         self.renderer.resize_window(self.window_size)
 
     def close(self):
-        self.devices.close()
+        self.shader_watcher.stop()
+        self.autosave.close()
+        if self.sampler:
+            self.sampler.stop()
+        if self.devices:
+            self.devices.close()
         self.renderer.close()
-        self.ui.close()
+        self.pacer.close()
+        if self.ui:
+            self.ui.close()
         sdl2.SDL_GL_DeleteContext(self.context)
         sdl2.SDL_DestroyWindow(self.window)
         sdl2.SDL_Quit()
@@ -107,13 +178,54 @@ class App:
         sdl2.SDL_Delay(int(ticks))
 
     def update_input_state(self):
+        if self.sampler:
+            self.parse_events()
+            # anything left from a paused frame is dropped
+            self.samples = self.sampler.ring.drain()
+            return
         if self.input_state.found_stylus:
             self.devices.update_devices()
             self.input_state.stylus = self.devices.get_device_values("stylus")
             self.input_state.stylus_active = self.devices.is_device_active("stylus")
         self.parse_events()
-    
+        m_x = c_int()
+        m_y = c_int()
+        sdl2.SDL_GetMouseState(byref(m_x), byref(m_y))
+        self.update_pointer(self.input_state.time, m_x.value, m_y.value)
+
+    def apply_sample(self, sample):
+        t, x, y, values, active = sample
+        if values is not None:
+            self.input_state.stylus = values
+            self.input_state.stylus_active = active
+        self.input_state.predictor.add(t, x, self.window_size[1] - y)
+        self.update_pointer(t, x, y)
+
+    def run_samples(self):
+        """ Replays the input thread's samples since the last frame. A stroke in progress is drawn through
+            every one of them, so its shape doesn't depend on how long frames take; everything else only
+            sees where the frame ends up.
+        """
+        samples = self.samples
+        self.samples = []
+        if not samples:
+            self.input_state.mdelta = (0, 0)
+            return
+        start = self.input_state.mpos
+        bind = self.input_state.active_bind
+        drawing = bind and bind.operator == "canvas_draw" and self.input_state.active_stroke
+        with tracer.span("replay samples", "input", {"samples": len(samples)}):
+            for sample in samples[:-1]:
+                self.apply_sample(sample)
+                if drawing:
+                    self.ops.do(bind, False, self.renderer, self.input_state)
+            self.apply_sample(samples[-1])
+        # motion operators measure the whole frame's movement, not just the last sample's
+        self.input_state.mdelta = (self.input_state.mpos[0] - start[0], self.input_state.mpos[1] - start[1])
+
     def check_keybinds_and_run_operators(self):
+        if self.sampler:
+            self.run_samples()
         self.input_state.previous_bind = self.input_state.active_bind
         self.input_state.check_keybinds(self.settings.motion_deadzone)
         
@@ -128,11 +240,48 @@ class App:
         if finish:
             self.input_state.active_bind = None
 
-    def render(self):
+    def update_shaders(self):
+        changed = self.shader_watcher.take()
+        if not changed:
+            return
+        with tracer.span("reload shaders", "frame", {"files": len(changed)}):
+            reload_programs(changed)
+            self.renderer.invalidate_view()
+            # a new shader in shaders/draw is a new brush
+            try:
+                self.input_state.brush.load_programs()
+            except (RuntimeError, OSError) as e:
+                program_errors["shaders/draw"] = str(e)
+                print(f"ERROR: Loading new brush failed: {e}")
+            else:
+                program_errors.pop("shaders/draw", None)
+
+    def render_first_frame(self):
+        # just the canvas; the UI appears on the next frame, once finish_startup has run
         self.renderer.render()
-        result = self.ui.do_ui(self.input_state)
+        self.swap_window()
+        startup.mark_first_frame()
+
+    def render(self):
+        self.update_shaders()
+        with tracer.span("renderer", "frame"):
+            self.renderer.render()
+        with tracer.span("autosave", "frame"):
+            self.autosave.update(self.renderer.layers)
+        with tracer.span("ui", "frame"):
+            result = self.ui.do_ui(self.input_state, self.renderer.layers, self.ops, self.renderer.filters)
         if result == "quit":
             self.running = False
+        elif result == "save":
+            self.renderer.save_document(self.renderer.document_path)
+        elif result == "open":
+            self.renderer.open_document(self.renderer.document_path)
+        elif result == "filter_apply":
+            self.renderer.apply_filter()
+        elif result == "layer_remove":
+            self.renderer.remove_layer()
+        elif result == "recover":
+            recover_autosave(self.settings.autosave_dir, self.renderer)
 
     def show_cursor(self):
         sdl2.SDL_ShowCursor(sdl2.SDL_ENABLE)
@@ -155,6 +304,8 @@ class App:
             self.set_cursor(self.cursor_crosshair)
             self.set_cursor_visibility(self.settings.show_cursor)
 
+        # samples from the input thread are timed with perf_counter
+        self.input_state.time = perf_counter() if self.sampler else self.get_ticks() / 1000.0
         while sdl2.SDL_PollEvent(byref(self.event)) != 0:
             if self.event.type == sdl2.SDL_QUIT:
                 self.running = False
@@ -167,27 +318,21 @@ class App:
                     self.paused = True
             elif self.event.type in (sdl2.SDL_KEYDOWN, sdl2.SDL_KEYUP):
                 update_key_state(self.input_state.key_state, self.input_state.mod_state, self.event.key)
+            elif self.event.type == sdl2.SDL_MOUSEMOTION and not self.sampler:
+                motion = self.event.motion
+                self.input_state.predictor.add(motion.timestamp / 1000.0, motion.x, self.window_size[1] - motion.y)
             elif self.event.type in (sdl2.SDL_MOUSEBUTTONDOWN, sdl2.SDL_MOUSEBUTTONUP):
                 if not self.ui.want_mouse_capture():
                     update_mouse_state(self.input_state.mouse_state, self.event)
             self.ui.process_event(self.event)
         self.ui.process_inputs()
-        
-        m_x = c_int()
-        m_y = c_int()
-        sdl2.SDL_GetMouseState(byref(m_x), byref(m_y))
-        x = m_x.value
-        y = self.window_size[1] - m_y.value
 
-        x, y = self.input_state.smooth_mpos(x, y)
-
-        if (x, y) != self.input_state.mpos_history[-1]:
-            self.input_state.update_input_history(self.input_state.mpos_history, self.input_state.mpos)
-            self.input_state.update_input_history(self.input_state.mpos_w_history, self.input_state.mpos_w)
+    def update_pointer(self, t, x, y):
+        """ Takes a pointer position in window coordinates from the top left, as SDL gives them. """
+        y = self.window_size[1] - y
 
-        self.input_state.mpos = (x, y)
-        self.input_state.mdelta = (self.input_state.mpos[0] - self.input_state.mpos_history[-1][0], self.input_state.mpos[1] - self.input_state.mpos_history[-1][1])
-        self.input_state.mpos_w = vec2f_mat4_mul_inverse( self.renderer.view_transform, (x, y) )
+        x, y = self.input_state.smooth_mpos(x, y)
+        self.input_state.update_pointer(t, x, y, vec2f_mat4_mul_inverse( self.renderer.view_transform, (x, y) ))
 
     def swap_window(self):
         sdl2.SDL_GL_SwapWindow(self.window)
@@ -1,6 +1,6 @@
 from os import listdir
 
-from modules.gl.gltypes import Program
+from modules.gl.gltypes import load_program
 
 class JsonLoadable(object):
     def from_json(self, json):
@@ -17,6 +17,25 @@ class Settings(JsonLoadable):
         self.rear_color = [ 0.25, 0.25, 0.25, 1.0 ]
         self.canvas_size = 512
         self.canvas_color = [ 0.4, 0.4, 0.4, 1.0 ]
+        # one of rgba8, rgba16, rgba16f
+        self.canvas_format = "rgba16"
+        self.view_format = "rgba16"
+        self.document_path = "canvas.fpd"
+        self.autosave_interval = 60.0
+        self.autosave_retention = 3
+        self.autosave_dir = "autosave"
+        self.autosave_tiles_per_frame = 2
+        self.watch_shaders = True
+        # adaptive, fixed (sleep to fps) or none
+        self.frame_pacing = "adaptive"
+        # off, on or adaptive
+        self.vsync = "on"
+        self.fps = 120.0
+        self.frames_in_flight = 1
+        # how far ahead to predict the pen while drawing, in milliseconds; 0 disables it
+        self.predict_ms = 0.0
+        # pointer and stylus samples per second, taken on their own thread (X11 only); 0 samples once per frame
+        self.input_rate = 500.0
 
 class BrushSettings(JsonLoadable):
     def __init__(self):
@@ -28,15 +47,34 @@ class BrushSettings(JsonLoadable):
         self.showcolor = True
         self.mixamount = 0.5
         self.smoothing = 0.4
+        # how much of the smudge pickup is kept from one dab to the next
+        self.smudge_length = 0.8
+        self.pick_size = 1
+        self.pick_footprint = False
+        # fill: how far (0-1, per channel) colours can be from the clicked one, whether to compare against
+        # all layers merged rather than the active one, and cpu or gpu (see modules/gl/fill.py)
+        self.fill_tolerance = 0.1
+        self.fill_merged = False
+        self.fill_method = "cpu"
+        # off, vertical, horizontal or radial (symmetry_count copies), about symmetry_centre in canvas
+        # pixels, or the middle of the canvas if that's empty
+        self.symmetry = "off"
+        self.symmetry_count = 8
+        self.symmetry_centre = []
+        # tip name: image path, stamped by the draw brush; an empty tip is the round procedural one
+        self.tips = {}
+        self.tip = ""
 
-        path_v = "shaders/draw/draw.vert"
+        # filled in by load_programs once the first frame is up
         self.progs = {}
-        fragprogs = []
-        for f in listdir("shaders/draw"):
-            if f.endswith(".frag"):
-                fragprogs.append(f.split(".")[0])
-        for prog in fragprogs:
-            path_f = f"shaders/draw/{prog}.frag"
-            self.progs[prog] = Program(path_v, path_f)
 
         self.current_prog = "draw"
+
+    def load_programs(self):
+        # one brush per fragment shader in shaders/draw; already loaded ones come from the program cache
+        path_v = "shaders/draw/draw.vert"
+        for f in listdir("shaders/draw"):
+            if f.endswith(".frag"):
+                prog = f.split(".")[0]
+                if prog not in self.progs:
+                    self.progs[prog] = load_program(path_v, f"shaders/draw/{prog}.frag")
@@ -0,0 +1,108 @@
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import close, listdir, read, walk
+from os.path import getmtime, isdir, join
+from queue import Queue, Empty
+from struct import Struct
+from sys import platform
+from threading import Thread
+from time import sleep
+
+from modules.trace import tracer
+
+SHADER_EXTENSIONS = (".vert", ".frag")
+
+# inotify_event: wd, mask, cookie, name length
+INOTIFY_EVENT = Struct("iIII")
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+ShaderPollInterval = 0.25
+
+def load_inotify():
+    if not platform.startswith("linux"):
+        return None
+    try:
+        libc = CDLL(find_library("c"), use_errno=True)
+        libc.inotify_init
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class ShaderWatcher(Thread):
+    """ Watches the shader directories for saved .vert/.frag files, with inotify where available and
+        mtime polling otherwise. Changed paths are queued for the render thread, which owns the GL context
+        and does the actual recompiling.
+    """
+    def __init__(self, directory):
+        super().__init__(name="shader watcher", daemon=True)
+        self.directories = [root for root, _, _ in walk(directory)] if isdir(directory) else []
+        self.changed = Queue()
+        self.running = True
+
+    def take(self):
+        """ Changed shader paths since the last call, without duplicates. """
+        paths = set()
+        while True:
+            try:
+                paths.add(self.changed.get_nowait())
+            except Empty:
+                return paths
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        tracer.name_thread("shader watcher")
+        libc = load_inotify()
+        if not libc or not self.watch_inotify(libc):
+            self.watch_polling()
+
+    def watch_inotify(self, libc):
+        fd = libc.inotify_init()
+        if fd < 0:
+            print(f"Shader watcher: inotify unavailable (errno {get_errno()}), polling instead.")
+            return False
+
+        directories = {}
+        for directory in self.directories:
+            wd = libc.inotify_add_watch(fd, directory.encode('utf-8'), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd >= 0:
+                directories[wd] = directory
+
+        try:
+            while self.running:
+                data = read(fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset:offset + length].rstrip(b"\0").decode('utf-8', 'replace')
+                    offset += length
+                    if wd in directories and name.endswith(SHADER_EXTENSIONS):
+                        self.changed.put(join(directories[wd], name))
+        finally:
+            close(fd)
+        return True
+
+    def watch_polling(self):
+        mtimes = self.scan()
+        while self.running:
+            sleep(ShaderPollInterval)
+            current = self.scan()
+            for path, mtime in current.items():
+                if mtimes.get(path) != mtime:
+                    self.changed.put(path)
+            mtimes = current
+
+    def scan(self):
+        mtimes = {}
+        for directory in self.directories:
+            for name in listdir(directory):
+                if name.endswith(SHADER_EXTENSIONS):
+                    path = join(directory, name)
+                    try:
+                        mtimes[path] = getmtime(path)
+                    except OSError:
+                        pass
+        return mtimes
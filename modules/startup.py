@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+from modules.trace import tracer
+
+class StartupProfile:
+    """ Times each phase of startup, split into what runs before the first frame is shown and what's
+        deferred until after it.
+    """
+    def __init__(self):
+        self.start = perf_counter()
+        self.phases = []
+        self.first_frame = None
+        self.ready = None
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        with tracer.span(name, "startup"):
+            yield
+        self.phases.append((name, perf_counter() - start, self.first_frame is not None))
+
+    def mark_first_frame(self):
+        self.first_frame = perf_counter() - self.start
+        tracer.instant("first frame", "startup")
+
+    def mark_ready(self):
+        self.ready = perf_counter() - self.start
+
+    def report(self):
+        lines = ["Startup profile:"]
+        for deferred in (False, True):
+            for name, seconds, after in self.phases:
+                if after == deferred:
+                    lines.append(f"  {name:<28} {seconds * 1000.0:8.1f} ms{'  (after first frame)' if after else ''}")
+            if not deferred and self.first_frame is not None:
+                lines.append(f"  {'time to first frame':<28} {self.first_frame * 1000.0:8.1f} ms")
+        if self.ready is not None:
+            lines.append(f"  {'time to ready':<28} {self.ready * 1000.0:8.1f} ms")
+        return "\n".join(lines)
+
+startup = StartupProfile()
@@ -0,0 +1,40 @@
+'''
+Symmetry painting: every dab of a stroke reflected or rotated about a centre into the full symmetric
+set, for all of a frame's dabs at once. NumPy only, so benchmarks/symmetry.py can time it without a GL
+context.
+'''
+
+from math import cos, sin, pi
+
+import numpy
+
+SYMMETRY_MODES = ("off", "vertical", "horizontal", "radial")
+SymmetryMaxCount = 32
+
+def symmetry_matrices(mode, count):
+    """ The 2x2 matrices (k x 2 x 2, the identity first) taking an offset from the centre to each of its
+        copies: a reflection in the vertical or horizontal axis, or count rotations for radial.
+    """
+    if mode == "vertical":
+        return numpy.array([[[1.0, 0.0], [0.0, 1.0]], [[-1.0, 0.0], [0.0, 1.0]]])
+    if mode == "horizontal":
+        return numpy.array([[[1.0, 0.0], [0.0, 1.0]], [[1.0, 0.0], [0.0, -1.0]]])
+    if mode == "radial":
+        count = min(max(int(count), 1), SymmetryMaxCount)
+        angles = [2.0 * pi * k / count for k in range(count)]
+        return numpy.array([[[cos(a), -sin(a)], [sin(a), cos(a)]] for a in angles])
+    return numpy.eye(2)[numpy.newaxis]
+
+def mirror_dabs(points, opacities, pressures, mode, count, centre):
+    """ points (n x 2) and their opacities and pressures, with each dab followed by its copies, so every
+        copy of the stroke advances together. Returns three arrays of n * k rows.
+    """
+    matrices = symmetry_matrices(mode, count)
+    k = len(matrices)
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    if k == 1:
+        return points, numpy.asarray(opacities), numpy.asarray(pressures)
+    centre = numpy.asarray(centre, dtype=numpy.float64)
+    # n x k x 2: every offset through every matrix in one product
+    mirrored = numpy.einsum("kij,nj->nki", matrices, points - centre) + centre
+    return mirrored.reshape(-1, 2), numpy.repeat(opacities, k), numpy.repeat(pressures, k)
@@ -0,0 +1,123 @@
+from json import dumps
+from os import getpid
+from threading import Lock, get_ident
+from time import perf_counter
+
+# events are buffered in memory and written out once this many have accumulated
+TraceRingLimit = 50000
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class TraceSpan:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.tracer.begin(self.name, self.cat, self.args)
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.end(self.name, self.cat)
+        return False
+
+class Tracer:
+    """ Records begin/end events in the Chrome Trace Event format,
+        viewable in chrome://tracing or ui.perfetto.dev
+    """
+    def __init__(self):
+        self.enabled = False
+        self.file = None
+        self.events = []
+        self.limit = TraceRingLimit
+        self.first_event = True
+        self.pid = getpid()
+        self.start_time = perf_counter()
+        self.lock = Lock()
+
+    def open(self, path, limit=TraceRingLimit):
+        self.file = open(path, 'w')
+        self.file.write("[\n")
+        self.first_event = True
+        self.limit = limit
+        self.enabled = True
+        self.name_thread("main")
+        print(f"Tracing to {path}")
+
+    def close(self):
+        if not self.file:
+            return
+        self.flush()
+        self.enabled = False
+        self.file.write("\n]\n")
+        self.file.close()
+        self.file = None
+
+    def timestamp(self):
+        # trace timestamps are in microseconds
+        return (perf_counter() - self.start_time) * 1000000.0
+
+    def add(self, event):
+        with self.lock:
+            self.events.append(event)
+            full = len(self.events) >= self.limit
+        if full:
+            self.flush()
+
+    def begin(self, name, cat="app", args=None):
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ph": "B", "ts": self.timestamp(), "pid": self.pid, "tid": get_ident()}
+        if args:
+            event["args"] = args
+        self.add(event)
+
+    def end(self, name, cat="app", args=None):
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ph": "E", "ts": self.timestamp(), "pid": self.pid, "tid": get_ident()}
+        if args:
+            event["args"] = args
+        self.add(event)
+
+    def instant(self, name, cat="app", args=None):
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ph": "i", "s": "t", "ts": self.timestamp(), "pid": self.pid, "tid": get_ident()}
+        if args:
+            event["args"] = args
+        self.add(event)
+
+    def name_thread(self, name):
+        if not self.enabled:
+            return
+        self.add({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": get_ident(), "args": {"name": name}})
+
+    def span(self, name, cat="app", args=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return TraceSpan(self, name, cat, args)
+
+    def flush(self):
+        with self.lock:
+            events = self.events
+            self.events = []
+        if not self.file:
+            return
+        for event in events:
+            if not self.first_event:
+                self.file.write(",\n")
+            self.first_event = False
+            self.file.write(dumps(event))
+        self.file.flush()
+
+tracer = Tracer()
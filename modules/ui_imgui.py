@@ -1,15 +1,44 @@
+from time import perf_counter
+
 import imgui
+import sdl2
 from imgui.integrations.sdl2 import SDL2Renderer
 
+from modules.gl.gltypes import memory_report, program_errors
+from modules.gl.filters import FILTERS
+from modules.gl.layers import BLEND_MODES
+from modules.symmetry import SYMMETRY_MODES, SymmetryMaxCount
+
 BrushSettingsWindow = 0
 ColorSettingsWindow = 1
+LayersWindow = 2
+MemoryWindow = 3
+OperatorsWindow = 4
+FiltersWindow = 5
+
+# seconds a frame's UI is reused for at most, for anything it shows that nothing here keys on
+UIRefreshInterval = 0.5
 
 class UI():
+    """ The imgui windows. Building them costs far more than drawing them, so a frame's draw data is
+        drawn again on the frames after it for as long as nothing could change it: no UI input (clicks,
+        keys, the pointer moving over a window), no window focused or item held, and the values the
+        windows show the same as when it was built.
+    """
     def __init__(self, window):
         imgui.create_context()
         self.impl = SDL2Renderer(window)
         self.io = imgui.get_io()
-        self.visible_windows = [BrushSettingsWindow, ColorSettingsWindow]
+        self.visible_windows = [BrushSettingsWindow, ColorSettingsWindow, LayersWindow]
+
+        # whether the next frame has to be built, what it showed last time and when that was
+        self.dirty = True
+        self.key = None
+        self.built = 0.0
+        # window rects (x0, y0, x1, y1, from the top left) as of the last build, for hover checks
+        self.window_rects = []
+        self.frames_built = 0
+        self.frames_reused = 0
 
     def want_mouse_capture(self):
         return self.io.want_capture_mouse
@@ -19,6 +48,47 @@ class UI():
 
     def process_event(self, event):
         self.impl.process_event(event)
+        if event.type == sdl2.SDL_MOUSEMOTION:
+            # moving over the canvas changes nothing; moving onto or over a window can highlight something
+            x = event.motion.x
+            y = event.motion.y
+            if any(r[0] <= x < r[2] and r[1] <= y < r[3] for r in self.window_rects):
+                self.dirty = True
+        else:
+            self.dirty = True
+
+    def begin(self, label, closable=True):
+        """ imgui.begin, noting where the window is. Returns whether it's still open. """
+        _, opened = imgui.begin(label, closable)
+        self.note_window()
+        return opened
+
+    def note_window(self):
+        x, y = imgui.get_window_position()
+        w, h = imgui.get_window_size()
+        self.window_rects.append((x, y, x + w, y + h))
+
+    def state_key(self, input_state, layers, ops, filters):
+        """ Everything the windows show that can change without UI input. """
+        brush = tuple((name, repr(value)) for name, value in vars(input_state.brush).items() if name != "progs")
+        layer_state = tuple((layer.name, layer.visible, layer.opacity, layer.blend_mode) for layer in layers.layers)
+        key = [
+            brush,
+            layer_state,
+            layers.active,
+            filters.current if filters else None,
+            repr(filters.values[filters.current]) if filters else None,
+            filters.previewing if filters else None,
+            tuple(self.visible_windows),
+            tuple(program_errors),
+            self.io.display_size,
+        ]
+        if MemoryWindow in self.visible_windows:
+            key.append(tuple(memory_report()))
+        if OperatorsWindow in self.visible_windows:
+            key.append(ops.timing)
+            key.append(repr(ops.stats))
+        return tuple(key)
     
     def process_inputs(self):
         self.impl.process_inputs()
@@ -26,11 +96,42 @@ class UI():
     def close(self):
         self.impl.shutdown()
 
-    def do_ui(self, input_state):
+    def do_ui(self, input_state, layers, ops, filters):
+        key = self.state_key(input_state, layers, ops, filters)
+        now = perf_counter()
+        if not self.dirty and key == self.key and now - self.built < UIRefreshInterval:
+            # nothing to react to: last frame's draw data stays valid until the next new_frame
+            self.impl.render(imgui.get_draw_data())
+            self.frames_reused += 1
+            return ""
+
+        result = self.build(input_state, layers, ops, filters)
+        # the values as the windows left them
+        self.key = self.state_key(input_state, layers, ops, filters)
+        self.built = now
+        self.frames_built += 1
+        # anything held, typed into or open (a focused window, combo or menu) is checked again next frame
+        self.dirty = (self.io.want_capture_mouse or self.io.want_text_input or imgui.is_any_item_active()
+            or imgui.is_window_focused(imgui.FOCUS_ANY_WINDOW) or result != "")
+        return result
+
+    def build(self, input_state, layers, ops, filters):
         imgui.new_frame()
+        result = ""
+        self.window_rects = []
 
         if imgui.begin_main_menu_bar():
+            self.note_window()
             if imgui.begin_menu("File", True):
+                clicked, _ = imgui.menu_item("Open", "Ctrl+O", False, True)
+                if clicked:
+                    result = "open"
+                clicked, _ = imgui.menu_item("Save", "Ctrl+S", False, True)
+                if clicked:
+                    result = "save"
+                clicked, _ = imgui.menu_item("Recover Autosave", None, False, True)
+                if clicked:
+                    result = "recover"
                 clicked, _ = imgui.menu_item("Quit", None, False, True)
                 if clicked:
                     return "quit"
@@ -42,12 +143,24 @@ class UI():
                 clicked, _ = imgui.menu_item("Color Settings", None, False, True)
                 if clicked and ColorSettingsWindow not in self.visible_windows:
                     self.visible_windows.append(ColorSettingsWindow)
+                clicked, _ = imgui.menu_item("Layers", None, False, True)
+                if clicked and LayersWindow not in self.visible_windows:
+                    self.visible_windows.append(LayersWindow)
+                clicked, _ = imgui.menu_item("Filters", None, False, True)
+                if clicked and FiltersWindow not in self.visible_windows:
+                    self.visible_windows.append(FiltersWindow)
+                clicked, _ = imgui.menu_item("Memory", None, False, True)
+                if clicked and MemoryWindow not in self.visible_windows:
+                    self.visible_windows.append(MemoryWindow)
+                clicked, _ = imgui.menu_item("Operators", None, False, True)
+                if clicked and OperatorsWindow not in self.visible_windows:
+                    self.visible_windows.append(OperatorsWindow)
                 imgui.end_menu()
             imgui.end_main_menu_bar()
 
         b = input_state.brush
         if BrushSettingsWindow in self.visible_windows:
-            _, opened = imgui.begin("Brush Settings", True)
+            opened = self.begin("Brush Settings", True)
             if not opened:
                 self.visible_windows.remove(BrushSettingsWindow)
             else:
@@ -55,10 +168,30 @@ class UI():
                     changed, val = imgui.slider_float(attr[0].capitalize(), getattr(b, attr[0]), attr[1], attr[2], "%.3f", 1.0)
                     if changed:
                         setattr(b, attr[0], val)
+                tips = [""] + list(b.tips)
+                current = tips.index(b.tip) if b.tip in tips else 0
+                changed, current = imgui.combo("Tip", current, [name or "round" for name in tips])
+                if changed:
+                    b.tip = tips[current]
+                changed, val = imgui.slider_float("Fill Tolerance", b.fill_tolerance, 0.0, 1.0, "%.3f", 1.0)
+                if changed:
+                    b.fill_tolerance = val
+                _, b.fill_merged = imgui.checkbox("Fill Samples All Layers", b.fill_merged)
+                current = SYMMETRY_MODES.index(b.symmetry) if b.symmetry in SYMMETRY_MODES else 0
+                changed, current = imgui.combo("Symmetry", current, list(SYMMETRY_MODES))
+                if changed:
+                    b.symmetry = SYMMETRY_MODES[current]
+                if b.symmetry == "radial":
+                    changed, val = imgui.slider_int("Symmetry Axes", b.symmetry_count, 2, SymmetryMaxCount)
+                    if changed:
+                        b.symmetry_count = val
+                if b.symmetry != "off" and b.symmetry_centre:
+                    if imgui.button("Centre Symmetry"):
+                        b.symmetry_centre = []
             imgui.end()
 
         if ColorSettingsWindow in self.visible_windows:
-            _, opened = imgui.begin("Color Settings", True)
+            opened = self.begin("Color Settings", True)
             if not opened:
                 self.visible_windows.remove(ColorSettingsWindow)
             else:
@@ -70,7 +203,116 @@ class UI():
                     setattr(b, "color2", (*val, 1.0))
             imgui.end()
 
+        if LayersWindow in self.visible_windows:
+            opened = self.begin("Layers", True)
+            if not opened:
+                self.visible_windows.remove(LayersWindow)
+            else:
+                result = self.do_layers(layers) or result
+            imgui.end()
+
+        if FiltersWindow in self.visible_windows:
+            opened = self.begin("Filters", True)
+            if not opened:
+                self.visible_windows.remove(FiltersWindow)
+                filters.previewing = False
+            elif self.do_filters(filters):
+                result = "filter_apply"
+            imgui.end()
+
+        if MemoryWindow in self.visible_windows:
+            opened = self.begin("Memory", True)
+            if not opened:
+                self.visible_windows.remove(MemoryWindow)
+            else:
+                imgui.text(f"Canvas: {layers.fmt}")
+                for line in memory_report():
+                    imgui.text(line)
+            imgui.end()
+
+        if OperatorsWindow in self.visible_windows:
+            opened = self.begin("Operators", True)
+            if not opened:
+                self.visible_windows.remove(OperatorsWindow)
+            else:
+                _, ops.timing = imgui.checkbox("Time operators", ops.timing)
+                imgui.same_line()
+                if imgui.button("Reset"):
+                    ops.stats.clear()
+                for line in ops.stats_report():
+                    imgui.text(line)
+                total = self.frames_built + self.frames_reused
+                if total:
+                    imgui.text(f"UI frames built: {self.frames_built}, reused: {self.frames_reused} "
+                        f"({self.frames_reused / total * 100.0:.0f}%)")
+            imgui.end()
+
+        # stays up for as long as a shader fails to compile
+        if program_errors:
+            self.begin("Shader Errors", False)
+            for name, error in program_errors.items():
+                imgui.text(name)
+                imgui.text_wrapped(error)
+            imgui.end()
+
         imgui.render()
         self.impl.render(imgui.get_draw_data())
 
-        return ""
\ No newline at end of file
+        return result
+
+    def do_filters(self, filters):
+        """ Returns True when Apply is clicked. """
+        names = list(FILTERS)
+        changed, current = imgui.combo("Filter", names.index(filters.current), [FILTERS[name].label for name in names])
+        if changed:
+            filters.current = names[current]
+
+        values = filters.values[filters.current]
+        for name, (default, lo, hi) in FILTERS[filters.current].params.items():
+            changed, val = imgui.slider_float(name.capitalize(), values[name], lo, hi, "%.3f", 1.0)
+            if changed:
+                values[name] = val
+
+        _, filters.previewing = imgui.checkbox("Preview", filters.previewing)
+        imgui.same_line()
+        if imgui.button("Reset"):
+            filters.values[filters.current] = FILTERS[filters.current].defaults()
+        imgui.same_line()
+        return imgui.button("Apply")
+
+    def do_layers(self, layers):
+        """ Returns "layer_remove" when Remove is clicked; the renderer removes it, since a transform may
+            be holding on to the layer.
+        """
+        result = ""
+        if imgui.button("Add"):
+            layers.add_layer()
+        imgui.same_line()
+        if imgui.button("Remove"):
+            result = "layer_remove"
+        imgui.same_line()
+        if imgui.button("Up"):
+            layers.move_layer(1)
+        imgui.same_line()
+        if imgui.button("Down"):
+            layers.move_layer(-1)
+
+        # top of the stack first
+        for i in reversed(range(len(layers.layers))):
+            layer = layers.layers[i]
+            changed, visible = imgui.checkbox(f"##visible{layer.id}", layer.visible)
+            if changed:
+                layers.set_property(layer, "visible", visible)
+            imgui.same_line()
+            clicked, _ = imgui.selectable(f"{layer.name}##{layer.id}", i == layers.active)
+            if clicked:
+                layers.set_active(i)
+
+        layer = layers.active_layer()
+        changed, val = imgui.slider_float("Opacity", layer.opacity, 0.0, 1.0, "%.3f", 1.0)
+        if changed:
+            layers.set_property(layer, "opacity", val)
+        changed, val = imgui.combo("Blend", BLEND_MODES.index(layer.blend_mode), BLEND_MODES)
+        if changed:
+            layers.set_property(layer, "blend_mode", BLEND_MODES[val])
+        return result
\ No newline at end of file
@@ -2,8 +2,71 @@
 in vec2 uv;
 out vec4 color;
 
+// layers under the active one, the active layer, and layers over it, each flattened
+uniform sampler2D belowtexture;
 uniform sampler2D basetexture;
+uniform sampler2D abovetexture;
+uniform int above;
+uniform float opacity;
+uniform int blendmode;
+// a filter being previewed: drawn instead of the active layer over the canvas uv rect it covers
+uniform sampler2D previewtexture;
+uniform vec4 previewrect;
+uniform vec2 previewextent;
+uniform int preview;
+// a region being transformed (premultiplied), drawn over the active layer: the canvas rect it was lifted
+// from, and canvas pixels back to where in that rect
+uniform sampler2D floatingtexture;
+uniform vec4 floatingrect;
+uniform mat4 floatinginverse;
+uniform int floating;
+// the selection's edge is drawn over everything as a dashed line
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+// 0 normal, 1 multiply, 2 screen, 3 overlay, 4 add
+vec3 blend( vec3 cb, vec3 cs, int mode ) {
+    if( mode == 1 ) return cb * cs;
+    if( mode == 2 ) return cb + cs - cb * cs;
+    if( mode == 3 ) return mix( 2.0 * cb * cs, 1.0 - 2.0 * (1.0 - cb) * (1.0 - cs), step(0.5, cb) );
+    if( mode == 4 ) return min( cb + cs, 1.0 );
+    return cs;
+}
+
+vec4 composite( vec4 dst, vec4 src, float opac, int mode ) {
+    float sa = src.a * opac;
+    vec3 cs = mix( src.rgb, blend(dst.rgb, src.rgb, mode), dst.a );
+    float ao = sa + dst.a * (1.0 - sa);
+    vec3 co = cs * sa + dst.rgb * dst.a * (1.0 - sa);
+    return ao > 0.0 ? vec4(co / ao, ao) : vec4(0.0);
+}
 
 void main() {
-    color = texture( basetexture, uv ).rgba;
+    vec4 base = texture(basetexture, uv);
+    if( preview == 1 && all(greaterThanEqual(uv, previewrect.xy)) && all(lessThan(uv, previewrect.zw)) )
+        base = texture(previewtexture, (uv - previewrect.xy) / (previewrect.zw - previewrect.xy) * previewextent);
+    if( floating == 1 ) {
+        vec2 q = (floatinginverse * vec4(uv * vec2(textureSize(basetexture, 0)), 0.0, 1.0)).xy;
+        // sampled outside the test so the mip level comes from neighbouring pixels that all sample
+        vec4 src = texture(floatingtexture, (q - floatingrect.xy) / (floatingrect.zw - floatingrect.xy));
+        src *= float( all(greaterThanEqual(q, floatingrect.xy)) && all(lessThan(q, floatingrect.zw)) );
+        float ao = src.a + base.a * (1.0 - src.a);
+        vec3 co = src.rgb + base.rgb * base.a * (1.0 - src.a);
+        base = ao > 0.0 ? vec4(co / ao, ao) : vec4(0.0);
+    }
+    vec4 col = composite( texture(belowtexture, uv), base, opacity, blendmode );
+    // only normal layers are flattened above, so they go over everything else as they are
+    if( above == 1 ) col = composite( col, texture(abovetexture, uv), 1.0, 0 );
+    color = clamp( col, 0.0, 1.0 );
+    if( selection == 1 ) {
+        vec2 p = uv * vec2(textureSize(selectiontexture, 0));
+        float s = texture(selectiontexture, uv).r;
+        if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) s = 0.0;
+        // the mask changes across this window pixel: it's on the edge
+        if( abs(s - 0.5) < fwidth(s) ) {
+            float dash = step( 4.0, mod( gl_FragCoord.x + gl_FragCoord.y, 8.0 ) );
+            color = vec4( vec3(dash), 1.0 );
+        }
+    }
 }
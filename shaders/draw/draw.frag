@@ -12,12 +12,34 @@ uniform vec2 mpos;
 uniform float sz;
 
 uniform sampler2D basetexture;
+// brush tip images, and the layer to stamp with (-1 for the round procedural tip)
+uniform sampler2DArray tips;
+uniform int tip;
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+// how selected canvas pixel p is; everything is while nothing is selected
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
 
 void main() {
     vec4 texcolor = texture( basetexture, uv );
+    // transparent pixels (on layers) take the brush colour so strokes don't fringe towards black
+    texcolor.rgb = mix( brushcolor.rgb, texcolor.rgb, texcolor.a );
     float mask;
     
-    if( radius < 2.0 ) {
+    if( tip >= 0 ) {
+        // the tip fills the dab's bounding square; bigger dabs read smaller mip levels, so cost stays flat with radius
+        vec2 tuv = (uv*sz - mpos) / (radius * 2.0) + 0.5;
+        float lod = max( log2( float(textureSize(tips, 0).x) / (radius * 2.0) ), 0.0 );
+        float inside = step(0.0, tuv.x) * step(0.0, tuv.y) * step(tuv.x, 1.0) * step(tuv.y, 1.0);
+        mask = textureLod( tips, vec3(tuv, float(tip)), lod ).r * inside;
+    }
+    else if( radius < 2.0 ) {
         // this adds some antialiasing (0.5 pixels) to the brush mask, while still using softness to affect opacity
         mask = clamp( (radius + 0.5 - distance(uv*sz, mpos)) * clamp(1.05 - softness, 0.0, 1.0), 0.0, 1.0);
     }
@@ -30,6 +52,7 @@ void main() {
     float lod = sqrt(radius*0.25);
     vec4 mixcolor = texture( basetexture, uv, lod );
     
-    float opac = clamp( mask * opacity, 0.0, 1.0 );
-    color = mix( texcolor, mix( mix(texcolor, mixcolor, mixamount), brushcolor, pressure ), opac );
+    float opac = clamp( mask * opacity * selected(gl_FragCoord.xy), 0.0, 1.0 );
+    // clamped so float canvases hold the same range as the normalized ones
+    color = clamp( mix( texcolor, mix( mix(texcolor, mixcolor, mixamount), brushcolor, pressure ), opac ), 0.0, 1.0 );
 }
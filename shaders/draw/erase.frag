@@ -9,6 +9,16 @@ uniform vec2 mpos;
 // uniform float px;
 
 uniform sampler2D basetexture;
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+// how selected canvas pixel p is; everything is while nothing is selected
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
 
 // #define PI 3.1415926535897932384626433832795
 // #define sz 512.0
@@ -30,5 +40,5 @@ void main() {
     
     
     // float opac = clamp( mask * opacity, 0.0, 1.0 );
-    color = vec4(texcolor.rgb, 0.0);
+    color = vec4(texcolor.rgb, texcolor.a * (1.0 - selected(gl_FragCoord.xy)));
 }
@@ -0,0 +1,25 @@
+#version 330 core
+in vec2 uv;
+out vec4 color;
+
+uniform sampler2D basetexture;
+uniform vec2 origin;
+uniform float scale;
+uniform float lod;
+uniform float sigma;
+uniform int taps;
+uniform float sz;
+
+// first, horizontal pass: each scratch pixel covers scale x scale canvas pixels starting at origin,
+// and is read from the canvas mip level of the same size so the kernel stays a few texels wide
+void main() {
+    vec2 p = origin + gl_FragCoord.xy * scale;
+    vec4 sum = vec4(0.0);
+    float wsum = 0.0;
+    for( int i = -taps; i <= taps; i++ ) {
+        float w = exp( -0.5 * float(i*i) / (sigma*sigma) );
+        sum += textureLod( basetexture, vec2(p.x + float(i)*scale, p.y) / sz, lod ) * w;
+        wsum += w;
+    }
+    color = sum / wsum;
+}
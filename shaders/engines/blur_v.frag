@@ -0,0 +1,44 @@
+#version 330 core
+in vec2 uv;
+out vec4 color;
+
+uniform float opacity;
+uniform float radius;
+uniform vec2 mpos;
+uniform float sz;
+
+uniform sampler2D basetexture;
+uniform sampler2D blurtexture;
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 blursize;
+uniform float sigma;
+uniform int taps;
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+// how selected canvas pixel p is; everything is while nothing is selected
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
+
+// second, vertical pass over the horizontally blurred scratch target, blended in under the dab mask
+void main() {
+    vec4 texcolor = texture( basetexture, uv );
+    vec2 uv_px = uv * sz;
+
+    vec2 q = (uv_px - origin) / scale;
+    vec4 sum = vec4(0.0);
+    float wsum = 0.0;
+    for( int i = -taps; i <= taps; i++ ) {
+        float w = exp( -0.5 * float(i*i) / (sigma*sigma) );
+        sum += texture( blurtexture, vec2(q.x, q.y + float(i)) / blursize ) * w;
+        wsum += w;
+    }
+
+    float cd = clamp( radius + 0.5 - distance(uv_px, mpos), 0.0, 1.0 );
+    color = clamp( mix(texcolor, sum / wsum, clamp(cd*opacity*selected(gl_FragCoord.xy), 0.0, 1.0)), 0.0, 1.0 );
+}
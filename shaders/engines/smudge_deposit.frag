@@ -0,0 +1,35 @@
+#version 330 core
+in vec2 uv;
+out vec4 color;
+
+uniform float radius;
+uniform float pressure;
+uniform vec2 mpos;
+uniform float sz;
+
+uniform sampler2D basetexture;
+uniform sampler2D pickuptexture;
+uniform float pickupsize;
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+// how selected canvas pixel p is; everything is while nothing is selected
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
+
+#define PI 3.1415926535897932384626433832795
+
+void main() {
+    vec4 texcolor = texture( basetexture, uv );
+    vec2 uv_px = uv * sz;
+    vec4 held = texture( pickuptexture, (uv_px - mpos + pickupsize * 0.5) / pickupsize );
+    
+    float cd = clamp(radius + 0.5 - distance(uv_px, mpos), 0.0, 1.0);
+    float soft = 0.5 - cos( clamp( 1.0 - sqrt( distance(uv_px, mpos) / radius ), 0.0, 1.0 ) * PI) * 0.5;
+    float str = clamp( mix( cd, soft, 1.0-pressure ) * pressure * selected(gl_FragCoord.xy), 0.0, 1.0 );
+    color = clamp( mix(texcolor, held, str), 0.0, 1.0 );
+}
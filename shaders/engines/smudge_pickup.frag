@@ -0,0 +1,18 @@
+#version 330 core
+in vec2 uv;
+out vec4 color;
+
+uniform sampler2D pickuptexture;
+uniform sampler2D basetexture;
+uniform vec2 mpos;
+uniform float pickupsize;
+uniform float rate;
+uniform float sz;
+
+// the pickup buffer is centred on the dab; each dab mixes in what's under the brush now
+void main() {
+    vec2 offset = gl_FragCoord.xy - pickupsize * 0.5;
+    vec4 held = texture( pickuptexture, gl_FragCoord.xy / pickupsize );
+    vec4 under = texture( basetexture, (mpos + offset) / sz );
+    color = mix( held, under, rate );
+}
@@ -0,0 +1,42 @@
+#version 330 core
+out vec4 color;
+
+// the fill so far, and what it's filling over
+uniform sampler2D masktexture;
+uniform sampler2D reftexture;
+uniform vec4 seedcolor;
+uniform float tolerance;
+// along rows (1, 0) or columns (0, 1), and how far
+uniform vec2 direction;
+uniform int reach;
+
+bool similar( ivec2 p ) {
+    vec4 c = texelFetch( reftexture, p, 0 );
+    return all( lessThanEqual( abs(c - seedcolor), vec4(tolerance) ) );
+}
+
+// a similar pixel joins the fill if it can walk to a filled one over similar pixels within reach;
+// everything else is discarded, so only new pixels are written (and counted by the occlusion query)
+void main() {
+    ivec2 p = ivec2( gl_FragCoord.xy );
+    ivec2 size = textureSize( masktexture, 0 );
+    if( texelFetch( masktexture, p, 0 ).r > 0.0 || !similar(p) )
+        discard;
+
+    ivec2 d = ivec2( direction );
+    for( int side = -1; side <= 1; side += 2 ) {
+        ivec2 q = p;
+        for( int i = 0; i < reach; i++ ) {
+            q += d * side;
+            if( any( lessThan(q, ivec2(0)) ) || any( greaterThanEqual(q, size) ) )
+                break;
+            if( texelFetch( masktexture, q, 0 ).r > 0.0 ) {
+                color = vec4(1.0);
+                return;
+            }
+            if( !similar(q) )
+                break;
+        }
+    }
+    discard;
+}
@@ -0,0 +1,27 @@
+#version 330 core
+out vec4 color;
+
+uniform sampler2D basetexture;
+uniform sampler2D masktexture;
+uniform vec4 brushcolor;
+uniform float opacity;
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+// how selected canvas pixel p is; everything is while nothing is selected
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
+
+void main() {
+    ivec2 p = ivec2( gl_FragCoord.xy );
+    vec4 texcolor = texelFetch( basetexture, p, 0 );
+    // transparent pixels (on layers) take the fill colour so the edge doesn't fringe towards black
+    texcolor.rgb = mix( brushcolor.rgb, texcolor.rgb, texcolor.a );
+    float mask = texelFetch( masktexture, p, 0 ).r > 0.0 ? 1.0 : 0.0;
+    mask *= selected( gl_FragCoord.xy );
+    color = clamp( mix( texcolor, vec4(brushcolor.rgb, 1.0), mask * opacity ), 0.0, 1.0 );
+}
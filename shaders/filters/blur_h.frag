@@ -0,0 +1,39 @@
+#version 330 core
+out vec4 color;
+
+// this pass writes the canvas pixels from origin on, scale of them per output pixel
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 sz;
+// the previous pass's output (the canvas, for the first pass), scale canvas pixels per texel from inputorigin
+uniform sampler2D inputtexture;
+uniform vec2 inputorigin;
+uniform vec2 inputscale;
+uniform float inputlod;
+uniform float radius;
+
+// canvas pixel p of the input, clamped to the canvas edge
+vec4 read_input( vec2 p ) {
+    p = clamp( p, vec2(0.5), sz - 0.5 );
+    return textureLod( inputtexture, (p - inputorigin) * inputscale, inputlod );
+}
+
+// horizontal half of a separable gaussian; radius is the sigma in canvas pixels. Colour is weighted by alpha
+// so transparent pixels don't bleed black into the edges. Wide blurs run at a coarser scale (gaussian_scale
+// in modules/gl/filters.py), so the cap of 64 taps either side is never reached
+void main() {
+    vec2 p = origin + gl_FragCoord.xy * scale;
+    float sigma = max( radius / scale, 0.5 );
+    int taps = min( int(ceil(sigma * 3.0)), 64 );
+    vec3 rgb = vec3(0.0);
+    float alpha = 0.0;
+    float wsum = 0.0;
+    for( int i = -taps; i <= taps; i++ ) {
+        float w = exp( -0.5 * float(i*i) / (sigma*sigma) );
+        vec4 c = read_input( p + vec2(1.0, 0.0) * float(i) * scale );
+        rgb += c.rgb * c.a * w;
+        alpha += c.a * w;
+        wsum += w;
+    }
+    color = vec4( alpha > 0.0 ? rgb / alpha : vec3(0.0), alpha / wsum );
+}
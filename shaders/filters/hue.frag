@@ -0,0 +1,34 @@
+#version 330 core
+out vec4 color;
+
+// this pass writes the canvas pixels from origin on, scale of them per output pixel
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 sz;
+// the previous pass's output (the canvas, for the first pass), scale canvas pixels per texel from inputorigin
+uniform sampler2D inputtexture;
+uniform vec2 inputorigin;
+uniform vec2 inputscale;
+uniform float inputlod;
+// degrees, a multiplier, and an offset
+uniform float hue;
+uniform float saturation;
+uniform float lightness;
+
+// canvas pixel p of the input, clamped to the canvas edge
+vec4 read_input( vec2 p ) {
+    p = clamp( p, vec2(0.5), sz - 0.5 );
+    return textureLod( inputtexture, (p - inputorigin) * inputscale, inputlod );
+}
+
+// the hue turns about the grey axis in YIQ space
+void main() {
+    vec4 c = read_input( origin + gl_FragCoord.xy * scale );
+    mat3 to_yiq = mat3( 0.299, 0.596, 0.211, 0.587, -0.274, -0.523, 0.114, -0.322, 0.312 );
+    mat3 to_rgb = mat3( 1.0, 1.0, 1.0, 0.956, -0.272, -1.106, 0.621, -0.647, 1.703 );
+    vec3 yiq = to_yiq * c.rgb;
+    float a = radians(hue);
+    vec2 iq = mat2( cos(a), sin(a), -sin(a), cos(a) ) * yiq.yz * saturation;
+    vec3 rgb = to_rgb * vec3( yiq.x, iq );
+    color = vec4( clamp( rgb + lightness, 0.0, 1.0 ), c.a );
+}
@@ -0,0 +1,27 @@
+#version 330 core
+out vec4 color;
+
+// this pass writes the canvas pixels from origin on, scale of them per output pixel
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 sz;
+// the previous pass's output (the canvas, for the first pass), scale canvas pixels per texel from inputorigin
+uniform sampler2D inputtexture;
+uniform vec2 inputorigin;
+uniform vec2 inputscale;
+uniform float inputlod;
+uniform float black;
+uniform float white;
+uniform float gamma;
+
+// canvas pixel p of the input, clamped to the canvas edge
+vec4 read_input( vec2 p ) {
+    p = clamp( p, vec2(0.5), sz - 0.5 );
+    return textureLod( inputtexture, (p - inputorigin) * inputscale, inputlod );
+}
+
+void main() {
+    vec4 c = read_input( origin + gl_FragCoord.xy * scale );
+    vec3 v = clamp( (c.rgb - black) / max(white - black, 0.001), 0.0, 1.0 );
+    color = vec4( pow(v, vec3(1.0 / gamma)), c.a );
+}
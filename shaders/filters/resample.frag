@@ -0,0 +1,17 @@
+#version 330 core
+out vec4 color;
+
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 sz;
+// the last pass's output, run at a coarser scale than this one
+uniform sampler2D inputtexture;
+uniform vec2 inputorigin;
+uniform vec2 inputscale;
+uniform float inputlod;
+
+// last pass when the filter's own last pass ran on a coarser level: it's filtered back up to this one
+void main() {
+    vec2 p = clamp( origin + gl_FragCoord.xy * scale, vec2(0.5), sz - 0.5 );
+    color = textureLod( inputtexture, (p - inputorigin) * inputscale, inputlod );
+}
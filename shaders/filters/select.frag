@@ -0,0 +1,31 @@
+#version 330 core
+out vec4 color;
+
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 sz;
+// the filtered result, and the canvas as it was
+uniform sampler2D inputtexture;
+uniform vec2 inputorigin;
+uniform vec2 inputscale;
+uniform float inputlod;
+uniform sampler2D sourcetexture;
+uniform float sourcelod;
+
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
+
+// last pass while something is selected: the filter only shows through the selection
+void main() {
+    vec2 p = clamp( origin + gl_FragCoord.xy * scale, vec2(0.5), sz - 0.5 );
+    vec4 filtered = textureLod( inputtexture, (p - inputorigin) * inputscale, inputlod );
+    vec4 source = textureLod( sourcetexture, p / sz, sourcelod );
+    color = mix( source, filtered, selected(p) );
+}
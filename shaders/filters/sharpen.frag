@@ -0,0 +1,30 @@
+#version 330 core
+out vec4 color;
+
+// this pass writes the canvas pixels from origin on, scale of them per output pixel
+uniform vec2 origin;
+uniform float scale;
+uniform vec2 sz;
+// the previous pass's output (the canvas, for the first pass), scale canvas pixels per texel from inputorigin
+uniform sampler2D inputtexture;
+uniform vec2 inputorigin;
+uniform vec2 inputscale;
+uniform float inputlod;
+// the canvas itself, read at the level of detail of the output
+uniform sampler2D sourcetexture;
+uniform float sourcelod;
+uniform float amount;
+
+// canvas pixel p of the input, clamped to the canvas edge
+vec4 read_input( vec2 p ) {
+    p = clamp( p, vec2(0.5), sz - 0.5 );
+    return textureLod( inputtexture, (p - inputorigin) * inputscale, inputlod );
+}
+
+// unsharp mask: the canvas pushed away from its blurred copy (the input)
+void main() {
+    vec2 p = origin + gl_FragCoord.xy * scale;
+    vec4 src = textureLod( sourcetexture, clamp( p, vec2(0.5), sz - 0.5 ) / sz, sourcelod );
+    vec4 blurred = read_input( p );
+    color = clamp( vec4( src.rgb + (src.rgb - blurred.rgb) * amount, src.a ), 0.0, 1.0 );
+}
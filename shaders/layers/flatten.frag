@@ -0,0 +1,30 @@
+#version 330 core
+in vec2 uv;
+out vec4 color;
+
+uniform sampler2D dsttexture;
+uniform sampler2D srctexture;
+uniform float opacity;
+uniform int blendmode;
+
+// 0 normal, 1 multiply, 2 screen, 3 overlay, 4 add
+vec3 blend( vec3 cb, vec3 cs, int mode ) {
+    if( mode == 1 ) return cb * cs;
+    if( mode == 2 ) return cb + cs - cb * cs;
+    if( mode == 3 ) return mix( 2.0 * cb * cs, 1.0 - 2.0 * (1.0 - cb) * (1.0 - cs), step(0.5, cb) );
+    if( mode == 4 ) return min( cb + cs, 1.0 );
+    return cs;
+}
+
+vec4 composite( vec4 dst, vec4 src, float opac, int mode ) {
+    float sa = src.a * opac;
+    vec3 cs = mix( src.rgb, blend(dst.rgb, src.rgb, mode), dst.a );
+    float ao = sa + dst.a * (1.0 - sa);
+    vec3 co = cs * sa + dst.rgb * dst.a * (1.0 - sa);
+    return ao > 0.0 ? vec4(co / ao, ao) : vec4(0.0);
+}
+
+void main() {
+    // float targets keep out of range values, which the normalized formats would have clamped
+    color = clamp( composite( texture(dsttexture, uv), texture(srctexture, uv), opacity, blendmode ), 0.0, 1.0 );
+}
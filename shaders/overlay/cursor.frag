@@ -0,0 +1,39 @@
+#version 330 core
+in vec2 offset;
+out vec4 color;
+
+uniform vec4 brushcolor;
+uniform float opacity;
+uniform float diam;
+uniform vec2 winsize;
+uniform int showcolor;
+uniform float softness;
+
+#define line 2.0    // width of lines drawn * 2
+
+// what shaders/screen.frag used to draw over the whole window, as a premultiplied colour blended over the view
+void main() {
+    float px = (1/winsize.y)*0.5;
+
+    float dist = length(offset) / winsize.y;
+    float dr = diam*px;
+    float lr = line*px;
+
+    float cl = clamp((pow(max(dr - dist, 0.0), softness))*2.0, 0, 1)*showcolor;
+
+    float wl = 1.0 - (1.0 + smoothstep( dr, dr+lr, dist)
+                          - smoothstep( dr-lr, dr, dist));
+
+    dr = (diam+line)*px;
+    float bl = 1.0 - (1.0 + smoothstep( dr, dr+lr, dist)
+                          - smoothstep( dr-lr, dr, dist));
+
+    float opac = min(max(opacity, 0.2), 0.6);
+
+    // colour preview, then the black and white rings, each "over" the last
+    vec4 col = vec4(brushcolor.rgb * cl, cl);
+    col = col * (1.0 - bl*opac) + vec4(0.0, 0.0, 0.0, bl*opac);
+    col = col * (1.0 - wl*opac) + vec4(vec3(wl*opac), wl*opac);
+
+    color = col;
+}
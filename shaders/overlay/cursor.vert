@@ -0,0 +1,14 @@
+#version 330 core
+in vec3 v_pos;
+in vec2 v_uv;
+out vec2 offset;
+
+uniform vec2 mpos;
+uniform vec2 winsize;
+uniform float diam;
+
+// a quad just big enough for the outline, placed in window pixels
+void main() {
+    offset = v_pos.xy * (diam * 0.5 + 3.0);
+    gl_Position = vec4( (mpos + offset) / winsize * 2.0 - 1.0, 0.0, 1.0 );
+}
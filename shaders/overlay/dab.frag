@@ -0,0 +1,20 @@
+#version 330 core
+in vec2 offset;
+out vec4 color;
+
+uniform vec4 brushcolor;
+uniform float softness;
+uniform float radius;
+uniform float opacity;
+
+// the same mask as shaders/draw/draw.frag, blended over the view instead of into the canvas
+void main() {
+    float mask;
+    if( radius < 2.0 ) {
+        mask = clamp( (radius + 0.5 - length(offset)) * clamp(1.05 - softness, 0.0, 1.0), 0.0, 1.0 );
+    }
+    else {
+        mask = clamp( pow(max(1.0 - length(offset)/radius, 0.0), softness), 0.0, 1.0 );
+    }
+    color = vec4( brushcolor.rgb, clamp(mask * opacity, 0.0, 1.0) );
+}
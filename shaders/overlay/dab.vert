@@ -0,0 +1,14 @@
+#version 330 core
+in vec3 v_pos;
+in vec2 v_uv;
+out vec2 offset;
+
+uniform mat4 transform;
+uniform vec2 mpos;
+uniform float radius;
+
+// a quad just around one dab, placed in canvas pixels and drawn through the view transform
+void main() {
+    offset = v_pos.xy * (radius + 1.0);
+    gl_Position = transform * vec4( mpos + offset, 0.0, 1.0 );
+}
@@ -0,0 +1,7 @@
+#version 330 core
+out vec4 color;
+
+// blended as 1 - dst, so pixels covered an odd number of times end up selected
+void main() {
+    color = vec4( 1.0 );
+}
@@ -0,0 +1,9 @@
+#version 330 core
+in vec3 v_pos;
+
+// canvas size in pixels; the points come in canvas pixels
+uniform vec2 sz;
+
+void main() {
+    gl_Position = vec4( v_pos.xy / sz * 2.0 - 1.0, 0.0, 1.0 );
+}
@@ -0,0 +1,24 @@
+#version 330 core
+out vec4 color;
+
+// 0 rectangle, 1 ellipse, filling rect (x0, y0, x1, y1) in canvas pixels
+uniform int shape;
+uniform vec4 rect;
+
+void main() {
+    vec2 p = gl_FragCoord.xy;
+    float inside;
+    if( shape == 1 ) {
+        vec2 centre = (rect.xy + rect.zw) * 0.5;
+        vec2 radii = max( (rect.zw - rect.xy) * 0.5, vec2(0.5) );
+        // distance past the edge in pixels, roughly, for a one pixel antialiased edge
+        float d = (length( (p - centre) / radii ) - 1.0) * min(radii.x, radii.y);
+        inside = clamp( 0.5 - d, 0.0, 1.0 );
+    }
+    else {
+        // how much of the pixel's square each axis overlaps
+        vec2 overlap = clamp( min(p + 0.5, rect.zw) - max(p - 0.5, rect.xy), 0.0, 1.0 );
+        inside = overlap.x * overlap.y;
+    }
+    color = vec4( inside );
+}
@@ -0,0 +1,58 @@
+#version 330 core
+out vec4 color;
+
+uniform sampler2D basetexture;
+// the lifted region (premultiplied), the canvas rect it came from, canvas pixels back to where in it
+uniform sampler2D floatingtexture;
+uniform vec4 floatingrect;
+uniform mat4 floatinginverse;
+// mip level to resample from, so large reductions don't alias
+uniform int floatinglod;
+
+// Catmull-Rom weights for the four texels around a sample, t being how far it is past the second
+vec4 catmull_rom( float t ) {
+    float t2 = t * t;
+    float t3 = t2 * t;
+    return vec4(
+        -0.5 * t3 + t2 - 0.5 * t,
+        1.5 * t3 - 2.5 * t2 + 1.0,
+        -1.5 * t3 + 2.0 * t2 + 0.5 * t,
+        0.5 * t3 - 0.5 * t2 );
+}
+
+vec4 floating_texel( ivec2 q, ivec2 size ) {
+    if( any(lessThan(q, ivec2(0))) || any(greaterThanEqual(q, size)) ) return vec4(0.0);
+    return texelFetch( floatingtexture, q, floatinglod );
+}
+
+// bicubic sample at q, in the floating texture's pixels at level 0
+vec4 bicubic( vec2 q ) {
+    ivec2 size = textureSize( floatingtexture, floatinglod );
+    q = q / float(1 << floatinglod) - 0.5;
+    vec2 base = floor( q );
+    vec2 f = q - base;
+    vec4 wx = catmull_rom( f.x );
+    vec4 wy = catmull_rom( f.y );
+    ivec2 b = ivec2( base ) - 1;
+    vec4 sum = vec4( 0.0 );
+    for( int j = 0; j < 4; j++ ) {
+        vec4 row = wx.x * floating_texel( b + ivec2(0, j), size )
+                 + wx.y * floating_texel( b + ivec2(1, j), size )
+                 + wx.z * floating_texel( b + ivec2(2, j), size )
+                 + wx.w * floating_texel( b + ivec2(3, j), size );
+        sum += wy[j] * row;
+    }
+    // the kernel overshoots at hard edges; premultiplied colour can't exceed alpha
+    sum.a = clamp( sum.a, 0.0, 1.0 );
+    return vec4( clamp(sum.rgb, 0.0, sum.a), sum.a );
+}
+
+void main() {
+    vec4 base = texelFetch( basetexture, ivec2(gl_FragCoord.xy), 0 );
+    vec2 q = (floatinginverse * vec4(gl_FragCoord.xy, 0.0, 1.0)).xy - floatingrect.xy;
+    vec4 src = bicubic( q );
+    // src over base, base being straight alpha
+    float ao = src.a + base.a * (1.0 - src.a);
+    vec3 co = src.rgb + base.rgb * base.a * (1.0 - src.a);
+    color = clamp( ao > 0.0 ? vec4(co / ao, ao) : vec4(0.0), 0.0, 1.0 );
+}
@@ -0,0 +1,20 @@
+#version 330 core
+out vec4 color;
+
+uniform sampler2D basetexture;
+
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
+
+// what's lifted leaves transparency behind, as the eraser does
+void main() {
+    vec4 c = texelFetch( basetexture, ivec2(gl_FragCoord.xy), 0 );
+    color = vec4( c.rgb, c.a * (1.0 - selected(gl_FragCoord.xy)) );
+}
@@ -0,0 +1,24 @@
+#version 330 core
+out vec4 color;
+
+// canvas rect (x0, y0, x1, y1) being lifted; this draws its pixels from (0, 0) of the floating texture
+uniform vec4 rect;
+uniform sampler2D sourcetexture;
+
+uniform sampler2D selectiontexture;
+uniform int selection;
+uniform vec4 selectionrect;
+
+float selected( vec2 p ) {
+    if( selection == 0 ) return 1.0;
+    if( any(lessThan(p, selectionrect.xy)) || any(greaterThanEqual(p, selectionrect.zw)) ) return 0.0;
+    return texelFetch( selectiontexture, ivec2(p), 0 ).r;
+}
+
+// premultiplied, so filtering and mipmaps don't pull in the colour of transparent pixels
+void main() {
+    vec2 p = rect.xy + gl_FragCoord.xy;
+    vec4 c = texelFetch( sourcetexture, ivec2(p), 0 );
+    float a = c.a * selected( p );
+    color = vec4( c.rgb * a, a );
+}